@@ -1,28 +1,36 @@
 """Build a songbook, according to parameters found in a .yaml file."""
 
 import codecs
+import concurrent.futures
 import copy
 import glob
+import itertools
 import logging
-import threading
 import os.path
-from subprocess import Popen, PIPE, call, check_call
+from subprocess import call
 
 import yaml
 
-from patacrep import authors, content, encoding, errors, pkg_datapath, utils
+from patacrep import authors, content, encoding, errors, pkg_datapath, processes, scores, texlog
+from patacrep import texformat, utils
 from patacrep.index import process_sxd
+from patacrep.songs import Song, cache
 from patacrep.templates import TexBookRenderer, iter_bookoptions
 
 LOGGER = logging.getLogger(__name__)
 EOL = "\n"
-DEFAULT_STEPS = ['tex', 'pdf', 'sbx', 'pdf', 'clean']
+DEFAULT_STEPS = ['tex', 'scores', 'pdf', 'sbx', 'rerun', 'clean']
+# Maximum number of LaTeX compilations performed by the 'rerun' step
+MAX_RERUNS = 3
 GENERATED_EXTENSIONS = [
     "_auth.sbx",
     "_auth.sxd",
     ".aux",
+    "_body.tex",
     ".log",
+    ".lys",
     ".out",
+    ".scores",
     ".sxc",
     ".tex",
     "_title.sbx",
@@ -79,6 +87,7 @@ class Songbook:
             tex_config['_datadir'],
             tex_config['book']['lang'],
             tex_config['book']['encoding'],
+            cache=tex_config.get('_cache', False),
             )
 
         try:
@@ -155,13 +164,28 @@ class Songbook:
         """Tell if lilypond is part of the bookoptions"""
         return 'lilypond' in iter_bookoptions(self._raw_config)
 
-def _log_pipe(pipe):
-    """Log content from `pipe`."""
-    while 1:
-        line = pipe.readline()
-        if not bool(line):
-            break
-        LOGGER.debug(line.strip())
+    @property
+    def datadirs(self):
+        """List of the datadirs of the songbook."""
+        return self._raw_config['_datadir']
+
+    def cache_dirs(self):
+        """Return the list of the song cache directories (empty if cache is disabled)."""
+        if not self._raw_config.get('_cache'):
+            return []
+        if self._raw_config.get('_cache_dir'):
+            return [self._raw_config['_cache_dir']]
+        return [cache.cache_dir(datadir) for datadir in self.datadirs]
+
+    def cache_limits(self):
+        """Return the `(max_size, max_entries)` bounds of each song cache directory.
+
+        Both are `None` if the cache is not bounded (see :func:`patacrep.songs.cache.evict`).
+        """
+        return (
+            self._raw_config.get('_cache_max_size'),
+            self._raw_config.get('_cache_max_entries'),
+            )
 
 class SongbookBuilder:
     """Provide methods to compile a songbook."""
@@ -170,17 +194,35 @@ class SongbookBuilder:
     interactive = False
     # if True, allow unsafe option, like adding the --shell-escape to lualatex
     unsafe = False
-    # Options to add to lualatex
-    _lualatex_options = []
-    # Dictionary of functions that have been called by self._run_once(). Keys
-    # are function; values are return values of functions.
-    _called_functions = {}
+    # Maximum number of scores compiled in parallel (None: number of CPUs)
+    jobs = None
+    # Maximum duration (in seconds) of a LaTeX compilation (None: no limit)
+    timeout = None
+    # if True, precompile the preamble into a LaTeX format (see patacrep.texformat)
+    precompile = False
 
     def __init__(self, raw_songbook):
         # Basename of the songbook to be built.
         self.basename = raw_songbook['_outputname']
         # Representation of the .yaml songbook configuration file.
         self.songbook = Songbook(raw_songbook, self.basename)
+        # Options to add to lualatex
+        self._lualatex_options = []
+        # Dictionary of functions that have been called by self._run_once().
+        # Keys are function; values are return values of functions.
+        self._called_functions = {}
+        # Events of LaTeX compilations (see :mod:`patacrep.texlog`)
+        self.events = []
+        # Number of LaTeX compilations performed so far
+        self._passes = 0
+        # True iff the last LaTeX compilation is outdated (LaTeX asked to be
+        # run again, or indexes changed since then)
+        self._rerun = False
+        # Name of the format of the precompiled preamble (None: no format)
+        self._format = None
+        # Scores requested by LaTeX when the 'scores' step last ran (None: the
+        # step did not run)
+        self._score_requests = None
 
     def _run_once(self, function, *args, **kwargs):
         """Run function if it has not been run yet.
@@ -208,8 +250,14 @@ class SongbookBuilder:
         - steps: list of steps to perform to compile songbook. Available steps
           are:
           - tex: build .tex file from templates;
+          - scores: compile lilypond scores included by the previous LaTeX
+            compilation;
           - pdf: compile .tex using lualatex;
           - sbx: compile song and author indexes;
+          - rerun: compile .tex using lualatex again, if needed (if the
+            previous compilation asked for it, or if indexes changed), at
+            most MAX_RERUNS times (running step `scores` again before, if it
+            was run, and LaTeX requested other scores since then);
           - clean: remove temporary files,
           - any string beginning with a sharp sign (#): it is interpreted as a
             command to run in a shell.
@@ -218,19 +266,55 @@ class SongbookBuilder:
             steps = DEFAULT_STEPS
 
         for step in steps:
-            if step == 'tex':
-                self.build_tex()
-            elif step == 'pdf':
-                self.build_pdf()
-            elif step == 'sbx':
-                self.build_sbx()
-            elif step == 'clean':
-                self.clean()
-            elif step.startswith("#"):
-                self.build_custom(step[1:])
-            else:
-                # Unknown step name
-                raise errors.UnknownStep(step)
+            self.build_step(step)
+
+        self.evict_cache()
+
+    def build_step(self, step):
+        """Perform a single step (see :meth:`build_steps`)."""
+        if step == 'tex':
+            self.build_tex()
+        elif step == 'scores':
+            self.build_scores()
+        elif step == 'pdf':
+            self.build_pdf()
+        elif step == 'sbx':
+            self.build_sbx()
+        elif step == 'rerun':
+            self.build_rerun()
+        elif step == 'clean':
+            self.clean()
+        elif step.startswith("#"):
+            self.build_custom(step[1:])
+        else:
+            # Unknown step name
+            raise errors.UnknownStep(step)
+
+    def evict_cache(self):
+        """Remove outdated, and least recently used, songs from the cache.
+
+        Does nothing unless the cache is bounded (`_cache_max_size` or
+        `_cache_max_entries` configuration keys). Limits apply to each cache
+        directory (see :func:`patacrep.songs.cache.evict`).
+        """
+        max_size, max_entries = self.songbook.cache_limits()
+        if max_size is None and max_entries is None:
+            return
+        for cachedir in self.songbook.cache_dirs():
+            if not os.path.isdir(cachedir):
+                continue
+            with cache.lock(cachedir):
+                removed = cache.evict(
+                    cachedir,
+                    Song.CACHE_VERSION,
+                    max_size=max_size,
+                    max_entries=max_entries,
+                    )
+            if removed:
+                LOGGER.info("Removed {} entries from cache directory '{}'.".format(
+                    len(removed),
+                    cachedir,
+                    ))
 
     def build_tex(self):
         """Build .tex file from templates"""
@@ -240,6 +324,18 @@ class SongbookBuilder:
             ) as output:
             self.songbook.write_tex(output)
 
+    def build_scores(self):
+        """Compile lilypond scores into the cache (see :mod:`patacrep.scores`)"""
+        if not self.songbook.requires_lilypond():
+            return
+        LOGGER.info("Building scores…")
+        self._score_requests = scores.read_requests("{}.lys".format(self.basename))
+        scores.build_scores(
+            self.basename,
+            self.songbook.datadirs,
+            jobs=self.jobs,
+            )
+
     def build_pdf(self):
         """Build .pdf file from .tex file"""
         LOGGER.info("Building '{}.pdf'…".format(self.basename))
@@ -247,74 +343,131 @@ class SongbookBuilder:
 
         compiler = "lualatex"
 
-        # Test if the LaTeX compiler is accessible
-        try:
-            check_call(
-                [compiler, "--version"],
-                stdin=PIPE,
-                stdout=PIPE,
-                stderr=PIPE,
-                universal_newlines=True,
-                )
-        except FileNotFoundError as error:
-            raise errors.ExecutableNotFound(compiler)
-
-        # Test if lilypond compiler is accessible
+        # Test if the LaTeX compiler (and lilypond, if needed) is accessible
+        processes.check_executable(compiler)
         if self.songbook.requires_lilypond():
-            lilypond_compiler = 'lilypond'
-            try:
-                check_call(
-                    [lilypond_compiler, "--version"],
-                    stdin=PIPE,
-                    stdout=PIPE,
-                    stderr=PIPE,
-                    universal_newlines=True,
-                    )
-            except FileNotFoundError as error:
-                raise errors.ExecutableNotFound(lilypond_compiler)
+            processes.check_executable(scores.LILYPOND)
+
+        if self.precompile:
+            self._run_once(self._set_format, compiler)
 
         # Perform compilation
-        try:
-            process = Popen(
+        self._passes += 1
+        returncode, parser = None, None
+        # Parser of the failed compilation using the format (if any)
+        format_parser = None
+        if self._format is not None:
+            bodyname = "{}_body.tex".format(self.basename)
+            returncode, parser = self._compile(
+                [
+                    compiler,
+                    "-fmt={}.fmt".format(self._format),
+                    "-jobname={}".format(self.basename),
+                ] + self._lualatex_options + [bodyname],
+                bodyname,
+                )
+            if returncode != 0:
+                if not parser.format_failed:
+                    # Error in the document: it would fail without format too
+                    self._record_events(parser.events)
+                    raise errors.LatexCompilationError(self.basename)
+                format_parser = parser
+        if returncode != 0:
+            # No format, or the format may be the cause of the failure
+            returncode, parser = self._compile(
                 [compiler] + self._lualatex_options + [self.basename],
-                stdin=PIPE,
-                stdout=PIPE,
-                stderr=PIPE,
-                universal_newlines=True,
+                "{}.tex".format(self.basename),
                 )
-        except Exception as error:
-            LOGGER.debug(error)
+            if format_parser is not None:
+                if returncode == 0:
+                    # The document is fine: the format is not
+                    LOGGER.info(
+                        "The precompiled preamble cannot be used: it is compiled at each pass."
+                        )
+                    texformat.discard(self._format)
+                    self._format = None
+                else:
+                    self._record_events(format_parser.events)
+        self._record_events(parser.events)
+        self._rerun = parser.rerun
+
+        if returncode:
             raise errors.LatexCompilationError(self.basename)
 
-        if not self.interactive:
-            process.stdin.close()
-
-        standard_output = threading.Thread(
-            target=_log_pipe,
-            kwargs={
-                'pipe' : process.stdout,
-                }
+    def _set_format(self, compiler):
+        """Precompile the preamble of the .tex file (see :mod:`patacrep.texformat`)."""
+        self._format = texformat.prepare(
+            compiler,
+            self._lualatex_options,
+            self.basename,
+            self.songbook.datadirs,
+            timeout=self.timeout,
             )
-        standard_error = threading.Thread(
-            target=_log_pipe,
-            kwargs={
-                'pipe' : process.stderr,
-                }
-            )
-        standard_output.daemon = True
-        standard_error.daemon = True
-        standard_error.start()
-        standard_output.start()
-        standard_error.join()
-        standard_output.join()
-        process.wait()
-
-        # Close the stdout and stderr to prevent ResourceWarning:
-        process.stdout.close()
-        process.stderr.close()
-
-        if process.returncode:
+
+    def _compile(self, args, texname):
+        """Run LaTeX, parsing its output (see :mod:`patacrep.texlog`).
+
+        Arguments:
+        - args: the LaTeX compiler, and its arguments;
+        - texname: name of the compiled file.
+
+        Return the return code of LaTeX, and the :class:`texlog.LogParser`
+        of its output.
+        """
+        parser = texlog.LogParser(texname, texlog.read_songs(texname))
+
+        def parse_line(line):
+            """Log and parse a line of the output of LaTeX."""
+            LOGGER.debug(line)
+            parser.feed(line)
+
+        try:
+            returncode = processes.run(
+                args,
+                interactive=self.interactive,
+                env=dict(os.environ, **texlog.ENVIRONMENT),
+                timeout=self.timeout,
+                stdout_callback=parse_line,
+                )
+        except Exception as error:
+            parser.close()
+            self._record_events(parser.events)
+            if isinstance(error, errors.StepError):
+                raise
+            LOGGER.debug(error)
             raise errors.LatexCompilationError(self.basename)
+        parser.close()
+        return returncode, parser
+
+    def _record_events(self, events):
+        """Record (and log) the events of a LaTeX compilation."""
+        for event in events:
+            event['book'] = self.basename
+            event['pass'] = self._passes
+            if event['type'] == "error":
+                LOGGER.error("{}: {}".format(
+                    event['song'] or event['file'] or "{}.tex".format(self.basename),
+                    event['message'],
+                    ))
+        self.events.extend(events)
+
+    def build_rerun(self):
+        """Compile .tex file again, as long as needed (at most MAX_RERUNS times)."""
+        for _ in range(MAX_RERUNS):
+            if not self._rerun:
+                return
+            if self._score_requests is not None:
+                if self._score_requests != scores.read_requests("{}.lys".format(self.basename)):
+                    # Compile scores requested by the previous compilation
+                    # (e.g. the first one), instead of letting LaTeX do it
+                    self.build_scores()
+            self.build_pdf()
+        if self._rerun:
+            LOGGER.warning(
+                "'{}.pdf' may be incomplete: LaTeX asked to be run again after {} passes.".format(
+                    self.basename,
+                    self._passes,
+                    ))
 
     def build_sbx(self):
         """Make .sbx indexes from .sxd files"""
@@ -322,9 +475,18 @@ class SongbookBuilder:
         sxd_files = glob.glob("%s_*.sxd" % self.basename)
         for sxd_file in sxd_files:
             LOGGER.debug("Processing " + sxd_file)
-            idx = process_sxd(sxd_file)
-            with codecs.open(sxd_file[:-3] + "sbx", "w", "utf-8") as index_file:
-                index_file.write(idx.entries_to_str())
+            entries = process_sxd(sxd_file).entries_to_str()
+            sbx_file = sxd_file[:-3] + "sbx"
+            try:
+                with codecs.open(sbx_file, "r", "utf-8") as index_file:
+                    if index_file.read() == entries:
+                        continue
+            except OSError:
+                pass
+            # Index changed: LaTeX has to be run again to include it
+            self._rerun = True
+            with codecs.open(sbx_file, "w", "utf-8") as index_file:
+                index_file.write(entries)
 
     def _get_interpolation(self):
         """Return the interpolation values for a custom command."""
@@ -369,6 +531,58 @@ class SongbookBuilder:
                 except Exception as exception:
                     raise errors.CleaningError(self.basename + ext, exception)
 
+def build_songbooks(builders, steps=None, *, jobs=None):
+    """Build several songbooks, in this process.
+
+    Arguments:
+    - builders: list of :class:`SongbookBuilder` objects;
+    - steps: list of steps (see :meth:`SongbookBuilder.build_steps`);
+    - jobs: maximum number of songbooks built in parallel (default is the
+      number of CPUs).
+
+    The leading `tex` steps (parsing and rendering songs) are performed one
+    songbook after the other, so that songbooks share the songs and templates
+    read by the previous ones. The following steps (mostly running LaTeX,
+    lilypond, etc.) of the different songbooks are performed in parallel,
+    unless they contain a `tex` step (parsing songs changes the working
+    directory of the process).
+
+    A songbook failing does not stop the other ones. Return the dictionary
+    of errors (:class:`errors.SongbookError`) that stopped songbooks,
+    indexed by basenames.
+    """
+    if not steps:
+        steps = DEFAULT_STEPS
+    head = list(itertools.takewhile(lambda step: step == 'tex', steps))
+    tail = steps[len(head):]
+    failures = {}
+
+    def build(builder, steps):
+        """Perform `steps` on `builder`, recording its error (if any)."""
+        try:
+            for step in steps:
+                builder.build_step(step)
+        except errors.SongbookError as error:
+            failures[builder.basename] = error
+
+    for builder in builders:
+        build(builder, head)
+    remaining = [builder for builder in builders if builder.basename not in failures]
+    if 'tex' in tail:
+        jobs = 1
+    if tail and remaining:
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=min(jobs or os.cpu_count() or 1, len(remaining)),
+            ) as executor:
+            futures = [executor.submit(build, builder, tail) for builder in remaining]
+        for future in futures:
+            # Raise unexpected errors
+            future.result()
+
+    for builder in builders:
+        if builder.basename not in failures:
+            builder.evict_cache()
+    return failures
 
 def config_model(key):
     """Get the model structure
@@ -162,7 +162,9 @@ class ContentList:
         """
         self._content.extend(iterator)
         if isinstance(iterator, ContentList):
-            self._errors.extend(iterator.iter_errors())
+            # Errors of the items are not copied: they are iterated over by
+            # :meth:`iter_errors`.
+            self._errors.extend(iterator._errors) # pylint: disable=protected-access
 
     def append(self, item):
         """Append an item to the content list."""
@@ -291,7 +293,7 @@ def process_content(content, config=None):
                     contentlist.append_error(error)
         else:
             contentlist.append_error(ContentError(str(elem), "Unknown content type."))
-    if contentlist.has_errors() and config['_error'] in ("failonsong", "failonbook"):
+    if config['_error'] in ("failonsong", "failonbook") and contentlist.has_errors():
         raise ContentError(
             "Error while parsing the 'content' section of the songbook. Stopping as requested."
         )
@@ -10,6 +10,7 @@ import jinja2
 from patacrep.content import process_content, validate_parser_argument
 from patacrep.content import ContentError, ContentItem, ContentList
 from patacrep import files, errors
+from patacrep.songs import registry
 
 LOGGER = logging.getLogger(__name__)
 
@@ -22,7 +23,12 @@ class SongRenderer(ContentItem):
 
     def iter_errors(self):
         """Iterate over song errors."""
-        yield from self.song.errors
+        try:
+            yield from self.song.errors
+        except ContentError as error:
+            # The song content is parsed when first needed: it may turn out
+            # not to be parsable at all.
+            yield error
 
     def has_errors(self):
         """Return `True` iff errors has been found."""
@@ -48,6 +54,13 @@ class SongRenderer(ContentItem):
     #pylint: disable=unused-argument
     def render(self, context):
         """Return the string that will render the song."""
+        try:
+            song = self.song.render()
+        except ContentError as error:
+            LOGGER.warning(error)
+            return ""
+        # Songs are rendered once: their content is no longer needed.
+        self.song.release()
         return textwrap.dedent("""\
                 {separator}
                 %% {path}
@@ -56,7 +69,7 @@ class SongRenderer(ContentItem):
                 """).format(
                     separator="%"*80,
                     path=files.path2posix(self.song.subpath),
-                    song=self.song.render(),
+                    song=song,
                 )
 
     def __lt__(self, other):
@@ -122,7 +135,8 @@ def parse(keyword, argument, config):
                         )
                         continue
                     try:
-                        renderer = SongRenderer(plugins[extension](
+                        renderer = SongRenderer(registry.get_song(
+                            plugins[extension],
                             filename,
                             config,
                             datadir=songdir.datadir,
@@ -135,7 +149,7 @@ def parse(keyword, argument, config):
                                 .format(os.path.join(songdir.fullpath, filename))
                                 )
                         continue
-                    if renderer.has_errors() and config['_error'] == "failonsong":
+                    if config['_error'] == "failonsong" and renderer.has_errors():
                         raise errors.SongbookError(
                             "Error in song '{}'. Stopping as requested."
                             .format(os.path.join(songdir.fullpath, filename))
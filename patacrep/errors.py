@@ -73,6 +73,13 @@ class StepCommandError(StepError):
             " code {code}."
             ).format(command=command, code=code))
 
+class StepTimeoutError(StepError):
+    """A program run by a compilation step did not complete in time."""
+
+    def __init__(self, command, timeout):
+        super().__init__((
+            """Command "{command}" did not complete within {timeout} seconds."""
+            ).format(command=command, timeout=timeout))
 
 class CleaningError(SongbookError):
     """Error during cleaning of LaTeX auxiliary files."""
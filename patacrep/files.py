@@ -118,6 +118,18 @@ def load_renderer_plugins(datadirs=()):
         keyword='SONG_RENDERERS',
         )
 
+def load_directive_plugins(datadirs=()):
+    """Load the ChordPro directive plugins, and return a dictionary of those plugins.
+
+    Those are the parsers of directive arguments: see
+    :data:`patacrep.songs.chordpro.syntax.CHORDPRO_DIRECTIVES`.
+    """
+    return load_plugins(
+        datadirs=tuple(datadirs),
+        root_modules=('songs',),
+        keyword='CHORDPRO_DIRECTIVES',
+        )
+
 @lru_cache()
 def load_plugins(datadirs, root_modules, keyword):
     """Load all plugins, and return a dictionary of those plugins.
@@ -2,22 +2,34 @@
 
 # pylint: disable=too-few-public-methods
 
+import threading
+
 DEFAULT_LANGUAGE = "english"
 
+class _Metadata(threading.local):
+    """Descriptor of :attr:`AST.metadata`: each thread parses its own song."""
+
+    value = None
+
+    def __get__(self, instance, owner):
+        return self.value
+
+_METADATA = _Metadata()
+
 class AST:
     """Base class for the tree."""
     # pylint: disable=no-init
 
-    metadata = None
+    metadata = _METADATA
 
     @classmethod
     def init_metadata(cls):
         """Clear metadata
 
-        As this attribute is a class attribute, it as to be reset at each new
-        parsing.
+        As this attribute is shared by the nodes (of the song parsed by the
+        current thread), it as to be reset at each new parsing.
         """
-        cls.metadata = {
+        _METADATA.value = {
             '@language': DEFAULT_LANGUAGE,
             }
 
@@ -1,6 +1,7 @@
 """Render `very simple` TeX commands in a simple TeX code."""
 
 import logging
+import re
 
 LOGGER = logging.getLogger()
 
@@ -90,6 +91,134 @@ MATCH = [
     ]
 
 
+def _interfere(first, second):
+    """Return `True` iff replacing `first` can change how `second` is replaced.
+
+    Arguments:
+    - first, second: `(latex, plain)` tuples, `first` being replaced first.
+
+    This is the case if the replacement of `first` can build an occurrence of
+    `second`, or if occurrences of both commands can overlap.
+    """
+    if not first[1] or set(first[1]) & set(second[0]):
+        return True
+    for one, other in ((first[0], second[0]), (second[0], first[0])):
+        for index in range(len(one)):
+            if other.startswith(one[index:]) or one[index:].startswith(other):
+                return True
+    return False
+
+def _trie_regexp(words):
+    """Return a regular expression matching any of `words`.
+
+    Words are stored in a trie, which is turned into a regular expression
+    sharing common prefixes (much faster to match than a plain alternation):
+    for instance, `["ab", "ac", "d"]` gives `(?:a[bc]|d)`.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def pattern(node):
+        """Return the regular expression matching the words of `node`."""
+        leaves = []
+        branches = []
+        for char, child in sorted(node.items()):
+            if not char:
+                continue
+            if list(child) == [""]:
+                leaves.append(re.escape(char))
+            else:
+                branches.append(re.escape(char) + pattern(child))
+        if len(leaves) > 1:
+            branches.append("[{}]".format("".join(leaves)))
+        else:
+            branches.extend(leaves)
+        if len(branches) == 1 and "" not in node:
+            return branches[0]
+        if not branches:
+            return ""
+        return "(?:{}){}".format("|".join(branches), "?" if "" in node else "")
+
+    return pattern(trie)
+
+class Detexer:
+    """Render very simple TeX commands, in a single pass over strings.
+
+    Arguments:
+    - match: list of `(latex, plain)` tuples (see :data:`MATCH`).
+
+    Output is the same as replacing each `latex` command by its `plain`
+    equivalent, one after the other, in the order of `match`. To do so,
+    commands are split into as few consecutive groups as possible, such that
+    the commands of a group do not interfere with each other; each group is
+    then replaced in a single pass, by a regular expression built from a
+    trie of its commands.
+
+    >>> detexer = Detexer(MATCH)
+    >>> detexer(r"\\'El\\`eve \\dots")
+    'Élève …'
+    >>> detexer.translate(r"\\\\IeC %")
+    '%'
+    """
+
+    def __init__(self, match):
+        groups = []
+        for command in match:
+            if not groups or any(_interfere(previous, command) for previous in groups[-1]):
+                groups.append([])
+            groups[-1].append(command)
+        self._groups = []
+        for group in groups:
+            table = dict(group)
+            regexp = re.compile("({})".format(_trie_regexp(table)))
+            self._groups.append((regexp, table))
+
+    def translate(self, string):
+        """Replace TeX commands of `string`, without any other processing."""
+        for regexp, table in self._groups:
+            parts = regexp.split(string)
+            if len(parts) > 1:
+                # Odd items are the commands
+                parts[1::2] = map(table.__getitem__, parts[1::2])
+                string = "".join(parts)
+        return string
+
+    def __call__(self, arg):
+        """Render very simple TeX commands from argument.
+
+        Argument can be:
+        - a string: it is processed;
+        - a list, dict or set: its values are processed.
+        """
+        if isinstance(arg, dict):
+            return dict([
+                (key, self(value))
+                for (key, value)
+                in arg.items()
+                ])
+        elif isinstance(arg, list):
+            return [
+                self(item)
+                for item
+                in arg
+                ]
+        elif isinstance(arg, set):
+            return set(self(list(arg)))
+        elif isinstance(arg, str):
+            string = self.translate(arg)
+            if '\\' in string:
+                LOGGER.warning("Remaining command in string '{}'.".format(string))
+            return string.strip()
+        else:
+            return self(str(arg))
+
+#: :class:`Detexer` of the commands of :data:`MATCH`.
+DETEXER = Detexer(MATCH)
+
 def detex(arg):
     """Render very simple TeX commands from argument.
 
@@ -97,26 +226,4 @@ def detex(arg):
     - a string: it is processed;
     - a list, dict or set: its values are processed.
     """
-    if isinstance(arg, dict):
-        return dict([
-            (key, detex(value))
-            for (key, value)
-            in arg.items()
-            ])
-    elif isinstance(arg, list):
-        return [
-            detex(item)
-            for item
-            in arg
-            ]
-    elif isinstance(arg, set):
-        return set(detex(list(arg)))
-    elif isinstance(arg, str):
-        string = arg
-        for (latex, plain) in MATCH:
-            string = string.replace(latex, plain)
-        if '\\' in string:
-            LOGGER.warning("Remaining command in string '{}'.".format(string))
-        return string.strip()
-    else:
-        return detex(str(arg))
+    return DETEXER(arg)
@@ -1,5 +1,6 @@
 """Very simple LaTeX lexer."""
 
+import functools
 import logging
 import ply.lex as lex
 
@@ -55,7 +56,9 @@ class SimpleLexer:
     t_SPACE = r'[ \t\n\r]+'
 
     def __init__(self):
-        self.__class__.lexer = lex.lex(module=self)
+        self.lexer = _base_lexer(self.__class__).clone()
+        # Cloning shares the state stack.
+        self.lexer.lexstatestack = []
 
     # Define a rule so we can track line numbers
     @staticmethod
@@ -115,10 +118,10 @@ class SongLexer(SimpleLexer):
             token.type = 'SONG_ROPTIONS'
             token.lexer.open_braces -= 1
             token.lexer.pop_state()
-            for __ignored in token.lexer:
-                # In this parser, we only want to read metadata. So, after the
-                # first ``\beginsong`` command, we can stop parsing.
-                pass
+            # In this parser, we only want to read metadata. So, after the
+            # first ``\beginsong`` command, we can stop parsing (without
+            # reading the body of the song).
+            token.lexer.lexpos = token.lexer.lexlen
         return token
 
     @staticmethod
@@ -147,3 +150,12 @@ class SongLexer(SimpleLexer):
         if token.lexer.open_braces == 0:
             token.type = 'SONG_RTITLE'
         return token
+
+@functools.lru_cache()
+def _base_lexer(cls):
+    """Return the lexer built from the rules of `cls`.
+
+    Building a lexer is expensive: it is done once per class, and lexers are
+    cloned from this one.
+    """
+    return lex.lex(module=cls.__new__(cls))
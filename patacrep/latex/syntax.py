@@ -1,7 +1,7 @@
 """Very simple LaTeX parser"""
 
 import logging
-from functools import lru_cache
+import threading
 import ply.yacc as yacc
 
 from patacrep.latex import ast
@@ -212,17 +212,27 @@ def silent_yacc(*args, **kwargs):
         **kwargs
         )
 
-@lru_cache()
-def latex_yacc(filename=None):
+_PARSERS = threading.local()
+
+def latex_yacc():
     """Call the yacc with the LaTeX parser.
+
+    Building the parsing tables is expensive, so this is done once per
+    thread. Parsers hold the state of the code being parsed: each thread has
+    its own parser, so that songs can be parsed concurrently. Return a tuple
+    `(parser, yacc)` of the :class:`LatexParser` object and the yacc parser
+    built from it.
     """
-    parser = silent_yacc(module=LatexParser(filename))
-    return parser
+    parsers = getattr(_PARSERS, "parsers", None)
+    if parsers is None:
+        parser = LatexParser()
+        parsers = _PARSERS.parsers = (parser, silent_yacc(module=parser))
+    return parsers
 
 def tex2plain(string):
     """Parse string and return its plain text version."""
     return detex(
-        latex_yacc().parse(
+        latex_yacc()[1].parse(
             string,
             lexer=SimpleLexer().lexer,
             )
@@ -236,8 +246,11 @@ def parse_song(content, filename=None):
     - filename: the name of file where content was read from. Used only to
       display error messages.
     """
+    parser, yacc = latex_yacc()
+    parser.filename = filename
+    parser.ast.init_metadata()
     return detex(
-        latex_yacc(filename).parse(
+        yacc.parse(
             content,
             lexer=SongLexer().lexer,
             ).metadata
@@ -0,0 +1,125 @@
+"""Run external programs (LaTeX, lilypond, etc.).
+
+Programs are run by an :mod:`asyncio` event loop, which reads their standard
+output and error as they are written (without a thread per stream), and
+kills them if they do not complete in time. Several threads (e.g. building
+several songbooks, see :func:`patacrep.build.build_songbooks`) may run
+programs at the same time: at most :data:`MAX_JOBS` programs run in
+parallel, the other ones wait for their turn.
+"""
+
+import asyncio
+import functools
+import logging
+import os
+import subprocess
+import threading
+
+from patacrep import errors
+
+LOGGER = logging.getLogger(__name__)
+
+#: Maximum length of the lines written by programs.
+LINE_LIMIT = 2**20
+
+#: Maximum number of programs run in parallel (see :func:`set_max_jobs`).
+MAX_JOBS = os.cpu_count() or 1
+_SLOTS = threading.BoundedSemaphore(MAX_JOBS)
+
+def set_max_jobs(jobs):
+    """Set the maximum number of programs run in parallel (default is the number of CPUs).
+
+    This must be called before programs are run.
+    """
+    global MAX_JOBS, _SLOTS # pylint: disable=global-statement
+    MAX_JOBS = jobs or os.cpu_count() or 1
+    _SLOTS = threading.BoundedSemaphore(MAX_JOBS)
+
+@functools.lru_cache()
+def check_executable(executable):
+    """Check that `executable` can be run (once per process).
+
+    Raise :class:`errors.ExecutableNotFound` if it cannot.
+    """
+    try:
+        subprocess.run(
+            [executable, "--version"],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            check=True,
+            )
+    except (OSError, subprocess.CalledProcessError):
+        raise errors.ExecutableNotFound(executable)
+
+async def _read_lines(stream, callback):
+    """Call `callback` on each line of `stream` (without end of line)."""
+    while True:
+        line = await stream.readline()
+        if not line:
+            break
+        callback(line.decode("utf8", errors="replace").rstrip("\r\n"))
+
+async def _run(args, *, stdin, env, timeout, stdout_callback, stderr_callback):
+    """Run `args`, and return its return code (see :func:`run`)."""
+    process = await asyncio.create_subprocess_exec(
+        *args,
+        stdin=stdin,
+        env=env,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        limit=LINE_LIMIT,
+        )
+    try:
+        await asyncio.wait_for(
+            asyncio.gather(
+                _read_lines(process.stdout, stdout_callback),
+                _read_lines(process.stderr, stderr_callback),
+                process.wait(),
+                ),
+            timeout,
+            )
+    except asyncio.TimeoutError:
+        raise errors.StepTimeoutError(" ".join(args), timeout)
+    finally:
+        # Timeout, or error while reading the output (e.g. line too long)
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+    return process.returncode
+
+def run(
+        args, *,
+        interactive=False, env=None, timeout=None, stdout_callback=None, stderr_callback=None,
+    ):
+    """Run program `args` (a list of strings), and return its return code.
+
+    Arguments:
+    - args: the program and its arguments;
+    - interactive: if true, the program reads the standard input of this
+      process; otherwise, its standard input is empty;
+    - env: environment variables of the program (default is the environment
+      of this process);
+    - timeout: if not `None`, the program is killed (and
+      :class:`errors.StepTimeoutError` is raised) if it does not complete
+      within this number of seconds (not counting the time spent waiting for
+      other programs to complete);
+    - stdout_callback, stderr_callback: functions called with each line of
+      the standard output and error of the program (default is logging them,
+      as debug messages).
+
+    Wait while :data:`MAX_JOBS` programs are already running.
+    """
+    if stdout_callback is None:
+        stdout_callback = LOGGER.debug
+    if stderr_callback is None:
+        stderr_callback = LOGGER.debug
+    with _SLOTS:
+        return asyncio.run(_run(
+            args,
+            stdin=None if interactive else subprocess.DEVNULL,
+            env=env,
+            timeout=timeout,
+            stdout_callback=stdout_callback,
+            stderr_callback=stderr_callback,
+            ))
@@ -0,0 +1,194 @@
+"""Compile lilypond scores.
+
+Scores are compiled at the width of the text they are included in, which is
+only known by LaTeX. When compiling a songbook, the `\\lilypond` command
+records each score it includes, and its width, in the `<basename>.lys` file.
+Using this file, :func:`build_scores` compiles those scores (in parallel) into
+a cache, and writes the `<basename>.scores` file, which tells LaTeX to include
+the cached PDF files instead of compiling the scores itself.
+
+Cached PDF files are named after the hash of the score, its width, and the
+version of lilypond: they are shared between songbooks, and are never
+outdated. Files included by scores are not part of this hash.
+"""
+
+import codecs
+import concurrent.futures
+import hashlib
+import logging
+import os
+import subprocess
+import tempfile
+
+from patacrep import encoding, errors, files, processes
+from patacrep.songs import cache
+
+LOGGER = logging.getLogger(__name__)
+
+LILYPOND = "lilypond"
+CACHE_DIRNAME = "scores"
+
+#: Scheme code defining the paper size used to compile scores (the same as
+#: the one used by `patacrep.sty` to compile scores on the fly).
+PAPER_SIZE = """(set! paper-alist (cons '("patasize" . (cons (* {} pt) (* 1 cm) )) paper-alist))"""
+
+def lilypond_version():
+    """Return the version of lilypond (first line of `lilypond --version`).
+
+    Raise :class:`errors.ExecutableNotFound` if lilypond cannot be run.
+    """
+    try:
+        output = subprocess.check_output(
+            [LILYPOND, "--version"],
+            stdin=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            universal_newlines=True,
+            )
+    except (OSError, subprocess.CalledProcessError):
+        raise errors.ExecutableNotFound(LILYPOND)
+    return output.strip().split("\n")[0]
+
+def read_requests(filename):
+    """Return the scores recorded by LaTeX in `filename` (a `.lys` file).
+
+    Return a list of `(score, width)` tuples (without duplicates), where
+    `score` is the path given to the `\\lilypond` command, and `width` is the
+    width (as a TeX dimension, e.g. `241.84842pt`) the score is included at.
+    Return an empty list if `filename` does not exist.
+    """
+    requests = []
+    try:
+        with encoding.open_read(filename) as lysfile:
+            for line in lysfile:
+                width, _, score = line.strip().partition(" ")
+                if score and (score, width) not in requests:
+                    requests.append((score, width))
+    except FileNotFoundError:
+        pass
+    return requests
+
+def search_score(score, datadirs):
+    """Return the path of the lilypond file included as `score` by LaTeX.
+
+    Relative paths are searched in the datadirs (as LaTeX does, with the
+    `\\graphicspath` set by the songbook templates). Return `None` if nothing
+    is found.
+    """
+    if os.path.isabs(score):
+        directories = [""]
+    else:
+        directories = [""] + list(files.iter_datadirs(datadirs))
+    for directory in directories:
+        for extension in ["", ".ly"]:
+            path = os.path.join(directory, score + extension)
+            if path.endswith(".ly") and os.path.isfile(path):
+                return path
+    return None
+
+def cached_name(cachedir, source, width, version):
+    """Return the name of the PDF file compiled from `source` at `width`.
+
+    Arguments:
+    - cachedir: directory of cached scores;
+    - source: path of the lilypond file;
+    - width: width of the score (as a TeX dimension);
+    - version: version of lilypond.
+    """
+    sha = hashlib.sha1()
+    sha.update("{}\0{}\0".format(version, width).encode("utf8"))
+    with open(source, "rb") as scorefile:
+        sha.update(scorefile.read())
+    return os.path.join(cachedir, sha.hexdigest() + ".pdf")
+
+def compile_score(source, width, target):
+    """Compile lilypond file `source`, at `width`, into PDF file `target`.
+
+    The target file is written atomically. Return `True` iff compilation
+    succeeded (and the target could be written). Lilypond is run by
+    :func:`processes.run` (which limits the number of programs run in
+    parallel).
+    """
+    try:
+        with tempfile.TemporaryDirectory(dir=os.path.dirname(target)) as tempdir:
+            output = os.path.join(tempdir, "score")
+            returncode = processes.run([
+                LILYPOND,
+                "-e", PAPER_SIZE.format(width[:-len("pt")]),
+                '-dpaper-size="patasize"',
+                "--format=pdf",
+                "--output={}".format(output),
+                source,
+                ])
+            if returncode or not os.path.isfile(output + ".pdf"):
+                return False
+            os.replace(output + ".pdf", target)
+    except OSError as error:
+        LOGGER.warning("Cannot write cached score '{}': {}".format(target, error))
+        return False
+    return True
+
+def build_scores(basename, datadirs, jobs=None):
+    """Compile the scores of a songbook, and write its `.scores` file.
+
+    Arguments:
+    - basename: basename of the songbook;
+    - datadirs: list of datadirs of the songbook (cached scores are stored
+      in the cache of the first one);
+    - jobs: maximum number of scores compiled in parallel (default is the
+      number of CPUs).
+
+    Return the list of scores that could not be compiled (they are then
+    compiled by LaTeX, as if this function had not been called).
+    """
+    requests = read_requests(basename + ".lys")
+    failures = []
+    if not datadirs:
+        LOGGER.info("No datadir: scores are compiled by LaTeX.")
+        requests = []
+    if requests:
+        cachedir = os.path.join(cache.cache_dir(datadirs[0]), CACHE_DIRNAME)
+        try:
+            os.makedirs(cachedir, exist_ok=True)
+        except OSError as error:
+            LOGGER.warning("Cannot create score cache: scores are compiled by LaTeX ({}).".format(
+                error,
+                ))
+            failures = [score for score, _ in requests]
+            requests = []
+    if requests:
+        version = lilypond_version()
+
+    cached = {}
+    tasks = {}
+    for score, width in requests:
+        source = search_score(score, datadirs)
+        if source is None:
+            LOGGER.warning("Score '{}' not found.".format(score))
+            failures.append(score)
+            continue
+        target = cached_name(cachedir, source, width, version)
+        cached[score, width] = target
+        if not os.path.isfile(target):
+            tasks[target] = (source, width)
+
+    if tasks:
+        LOGGER.info("Compiling {} scores…".format(len(tasks)))
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=min(jobs or os.cpu_count() or 1, len(tasks)),
+            ) as executor:
+            futures = {
+                target: executor.submit(compile_score, source, width, target)
+                for target, (source, width) in tasks.items()
+                }
+        for (score, width), target in list(cached.items()):
+            if target in futures and not futures[target].result():
+                LOGGER.warning("Error while compiling score '{}'.".format(score))
+                failures.append(score)
+                del cached[score, width]
+
+    with codecs.open(basename + ".scores", "w", "utf-8") as mapfile:
+        for (score, width), target in cached.items():
+            mapfile.write("\\patacrepcachedscore{{{}}}{{{}}}{{{}}}\n".format(
+                score, width, files.path2posix(os.path.abspath(target)),
+                ))
+    return failures
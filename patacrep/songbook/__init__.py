@@ -8,7 +8,7 @@ import yaml
 from patacrep import encoding
 from patacrep.build import config_model
 from patacrep.utils import DictOfDict
-from patacrep.songs import DataSubpath
+from patacrep.songs import DataSubpath, cache
 import patacrep
 
 LOGGER = logging.getLogger()
@@ -43,6 +43,24 @@ def open_songbook(filename):
 
     return prepare_songbook(user_songbook, outputdir, outputname, songbookfile_dir)
 
+def read_manifest(filename):
+    """Return the list of songbook files listed in manifest `filename`.
+
+    A manifest is a YAML list of songbook files, relative to the directory
+    of the manifest.
+    """
+    try:
+        with encoding.open_read(filename) as manifest_file:
+            paths = yaml.safe_load(manifest_file)
+    except Exception as error: # pylint: disable=broad-except
+        raise patacrep.errors.SongbookError(str(error))
+    if not (isinstance(paths, list) and all(isinstance(path, str) for path in paths)):
+        raise patacrep.errors.SongbookError(
+            "Manifest '{}' is not a list of songbook files.".format(filename)
+            )
+    directory = os.path.dirname(filename)
+    return [os.path.join(directory, path) for path in paths]
+
 def prepare_songbook(songbook, outputdir, outputname, songbookfile_dir=None, datadir_prefix=None):
     """Prepare a songbook by adding default values and datadirs
     Returns a raw songbook object.
@@ -73,6 +91,10 @@ def prepare_songbook(songbook, outputdir, outputname, songbookfile_dir=None, dat
         for path in songbook['_datadir']
     ]
 
+    # Central cache directory
+    if os.environ.get(cache.CACHE_DIR_ENV):
+        songbook['_cache_dir'] = os.path.abspath(os.environ[cache.CACHE_DIR_ENV])
+
     return songbook
 
 def _add_songbook_defaults(user_songbook):
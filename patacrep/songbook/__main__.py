@@ -1,16 +1,20 @@
 """Command line tool to compile songbooks using the songbook library."""
 
 import argparse
+import json
 import locale
 import logging
+import os
 import sys
 import textwrap
 
-from patacrep.build import SongbookBuilder, DEFAULT_STEPS
+from patacrep.build import SongbookBuilder, DEFAULT_STEPS, MAX_RERUNS, build_songbooks
 from patacrep.utils import yesno
 from patacrep import __version__
-from patacrep import errors
-from patacrep.songbook import open_songbook
+from patacrep import errors, processes
+from patacrep.songbook import open_songbook, read_manifest
+from patacrep.songs import cache
+from patacrep.tools import existing_file, positive_int, size
 
 # Logging configuration
 logging.basicConfig(level=logging.INFO)
@@ -60,7 +64,16 @@ def argument_parser(args):
         )
 
     parser.add_argument(
-        'book', nargs=1, help=textwrap.dedent("Book to compile.")
+        'book', nargs='*', help=textwrap.dedent("""\
+                Books to compile. Several books are compiled by the same process, sharing songs and templates.
+        """),
+        )
+
+    parser.add_argument(
+        '--manifest', '-m', nargs=1, action='append', type=existing_file,
+        help=textwrap.dedent("""\
+                Also compile the books listed in this file: a YAML list of book files (relative to the directory of the manifest).
+        """),
         )
 
     parser.add_argument(
@@ -86,6 +99,58 @@ def argument_parser(args):
         default=[True],
         )
 
+    parser.add_argument(
+        '--cache-dir', nargs='?',
+        help=textwrap.dedent("""\
+                Cache songs in this directory (shared by all datadirs and songbooks), instead of in the '.cache' directory of each datadir.
+                Default is the directory set by the {env} environment variable, if any; if this option is given without a directory (after the book), default is "{default}".
+        """.format(env=cache.CACHE_DIR_ENV, default=cache.default_central_dir())),
+        type=str,
+        const=cache.default_central_dir(),
+        default=None,
+        )
+
+    parser.add_argument(
+        '--cache-format', nargs=1,
+        help=textwrap.dedent("""\
+                Format of cache files:
+                - pickle: songs are pickled as is;
+                - flat: song contents are pickled as tuples of codes and strings (smaller, and faster to read).
+                Cache files are read whatever their format. Default is "{}".
+        """.format(cache.DEFAULT_SERIALIZER)),
+        type=str,
+        choices=sorted(cache.SERIALIZERS),
+        default=[None],
+        )
+
+    parser.add_argument(
+        '--cache-compression', nargs=1,
+        help=textwrap.dedent("""\
+                Compression of cache files (smaller files, read slower). Default is "{}".
+        """.format(cache.DEFAULT_COMPRESSION)),
+        type=str,
+        choices=sorted(cache.COMPRESSIONS),
+        default=[None],
+        )
+
+    parser.add_argument(
+        '--cache-max-size', nargs=1,
+        help=textwrap.dedent("""\
+                Maximum size of each cache directory (e.g. "500M"). At the end of the build, least recently used songs are removed from the cache until it fits (as well as songs cached by another version of patacrep).
+        """),
+        type=size,
+        default=[None],
+        )
+
+    parser.add_argument(
+        '--cache-max-entries', nargs=1,
+        help=textwrap.dedent("""\
+                Maximum number of files of each cache directory (see --cache-max-size).
+        """),
+        type=positive_int,
+        default=[None],
+        )
+
     parser.add_argument(
         '--error', '-e', nargs=1,
         help=textwrap.dedent("""\
@@ -105,27 +170,134 @@ def argument_parser(args):
         default=["fix"],
         )
 
+    parser.add_argument(
+        '--chordpro-engine', nargs=1,
+        help=textwrap.dedent("""\
+                Engine used to parse ChordPro songs:
+                - ply: the reference parser;
+                - fast: a faster parser, which relies on "ply" for songs it does not support (e.g. songs containing errors).
+                Both engines produce the same songs.
+        """),
+        type=str,
+        choices=[
+            "ply",
+            "fast",
+        ],
+        default=["ply"],
+        )
+
     parser.add_argument(
         '--steps', '-s', nargs=1, type=str,
         action=ParseStepsAction,
         help=textwrap.dedent("""\
                 Steps to run. Default is "{steps}".  Available steps are:
                 - "tex" produce .tex file from templates;
+                - "scores" compile lilypond scores (included by the previous LaTeX compilation) in parallel;
                 - "pdf" compile .tex file;
                 - "sbx" compile index files;
+                - "rerun" compile .tex file again, if needed (if the previous compilation asked for it, or if index files changed), at most {reruns} times;
                 - "clean" remove temporary files;
                 - any string beginning with '#' (in this case, it will be run in a shell).
                 Several steps (excepted the custom shell command) can be combinend in one --steps argument, as a comma separated string.
 
                 Substring {{basename}} is replaced by the basename of the song book, and substrings {{aux}}, {{log}}, {{out}}, {{pdf}}, {{sxc}}, {{tex}} are replaced by "<BASENAME>.aux", "<BASENAME>.log", and so on.
-        """.format(steps=','.join(DEFAULT_STEPS))),
+        """.format(steps=','.join(DEFAULT_STEPS), reruns=MAX_RERUNS)),
         default=None,
         )
 
+    parser.add_argument(
+        '--jobs', '-j', nargs=1,
+        help=textwrap.dedent("""\
+                Maximum number of programs (LaTeX, lilypond) run in parallel, and of books compiled in parallel (default is the number of CPUs).
+        """),
+        type=positive_int,
+        default=[None],
+        )
+
+    parser.add_argument(
+        '--timeout', nargs=1,
+        help=textwrap.dedent("""\
+                Stop if a LaTeX compilation does not complete within this number of seconds (default is no limit).
+        """),
+        type=positive_int,
+        default=[None],
+        )
+
+    parser.add_argument(
+        '--precompile', nargs=1,
+        help=textwrap.dedent("""\
+                Precompile the preamble of books into a LaTeX format (cached), so that LaTeX compilations start from it instead of loading packages and fonts again. Books are compiled as usual if their preamble cannot be precompiled.
+        """),
+        type=yesno_type,
+        default=[False],
+        )
+
+    parser.add_argument(
+        '--events', nargs=1,
+        help=textwrap.dedent("""\
+                Write the events of LaTeX compilations (errors, warnings, overfull and underfull boxes, missing files, requests to compile again), with the song they refer to, in this file, as JSON lines.
+        """),
+        type=str,
+        default=[None],
+        )
+
     options = parser.parse_args(args)
+    if not (options.book or options.manifest):
+        parser.error("No book to compile.")
 
     return options
 
+def _apply_options(songbook, options):
+    """Set the command line options on raw songbook `songbook`."""
+    if options.datadir:
+        for datadir in reversed(options.datadir):
+            songbook['datadir'].insert(0, datadir)
+    songbook['_cache'] = options.cache[0]
+    if options.cache_dir is not None:
+        # Songs are built from their datadir: a relative path would be
+        # resolved relatively to each of them.
+        songbook['_cache_dir'] = os.path.abspath(options.cache_dir)
+    if options.cache_format[0] is not None:
+        songbook['_cache_format'] = options.cache_format[0]
+    if options.cache_compression[0] is not None:
+        songbook['_cache_compression'] = options.cache_compression[0]
+    if options.cache_max_size[0] is not None:
+        songbook['_cache_max_size'] = options.cache_max_size[0]
+    if options.cache_max_entries[0] is not None:
+        songbook['_cache_max_entries'] = options.cache_max_entries[0]
+    songbook['_error'] = options.error[0]
+    songbook['_chordpro_engine'] = options.chordpro_engine[0]
+
+def _builders(options):
+    """Return the list of builders of the books given on the command line."""
+    paths = list(options.book)
+    for manifest in options.manifest or []:
+        paths.extend(read_manifest(manifest[0]))
+
+    builders = {}
+    for path in paths:
+        songbook = open_songbook(path)
+        _apply_options(songbook, options)
+        builder = SongbookBuilder(songbook)
+        builder.unsafe = True
+        builder.jobs = options.jobs[0]
+        builder.timeout = options.timeout[0]
+        builder.precompile = options.precompile[0]
+        if builder.basename in builders:
+            raise errors.SongbookError(
+                "Several books would be compiled as '{}' (from '{}').".format(
+                    builder.basename,
+                    path,
+                    ))
+        builders[builder.basename] = builder
+    return list(builders.values())
+
+def _write_events(filename, builders):
+    """Write the LaTeX events of `builders` in `filename`, as JSON lines."""
+    with open(filename, "w", encoding="utf8") as eventsfile:
+        for builder in builders:
+            for event in builder.events:
+                eventsfile.write(json.dumps(event) + "\n")
 
 def main(args=None):
     """Main function:"""
@@ -141,23 +313,23 @@ def main(args=None):
 
     options = argument_parser(args[1:])
 
-    songbook_path = options.book[-1]
+    processes.set_max_jobs(options.jobs[0])
 
-    # Load the user songbook config
+    # Load the user songbook configs
+    builders = []
     try:
-        songbook = open_songbook(songbook_path)
-
-        # Command line options
-        if options.datadir:
-            for datadir in reversed(options.datadir):
-                songbook['datadir'].insert(0, datadir)
-        songbook['_cache'] = options.cache[0]
-        songbook['_error'] = options.error[0]
-
-        sb_builder = SongbookBuilder(songbook)
-        sb_builder.unsafe = True
-
-        sb_builder.build_steps(options.steps)
+        builders = _builders(options)
+        if len(builders) == 1:
+            builders[0].build_steps(options.steps)
+        else:
+            failures = build_songbooks(builders, options.steps, jobs=options.jobs[0])
+            for basename, error in sorted(failures.items()):
+                LOGGER.error("Book '{}': {}".format(basename, error))
+            if failures:
+                raise errors.SongbookError("{} books out of {} could not be compiled.".format(
+                    len(failures),
+                    len(builders),
+                    ))
     except errors.SongbookError as error:
         LOGGER.error(error)
         if LOGGER.level >= logging.INFO:
@@ -168,6 +340,9 @@ def main(args=None):
     except KeyboardInterrupt:
         LOGGER.warning("Aborted by user.")
         sys.exit(1)
+    finally:
+        if options.events[0] is not None:
+            _write_events(options.events[0], builders)
 
     sys.exit(0)
 
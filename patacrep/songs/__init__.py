@@ -1,31 +1,30 @@
 """Song management."""
 
-import errno
+import copy
 import hashlib
 import logging
 import os
-import pickle
 import re
 
 from patacrep import errors as book_errors
 from patacrep import files, encoding
 from patacrep.authors import process_listauthors
+from patacrep.songs import cache
+from patacrep.songs.cache import cached_name
 from patacrep.songs import errors as song_errors
 
 LOGGER = logging.getLogger(__name__)
 
-def cached_name(datadir, filename):
-    """Return the filename of the cache version of the file."""
-    fullpath = os.path.abspath(os.path.join(datadir, '.cache', filename))
-    directory = os.path.dirname(fullpath)
-    try:
-        os.makedirs(directory)
-    except OSError as error:
-        if error.errno == errno.EEXIST and os.path.isdir(directory):
-            pass
-        else:
-            raise
-    return fullpath
+def _metadata_fingerprint(config):
+    """Return the fingerprint of `config` derived song metadata depend on (see
+    :meth:`Song.metadata_fingerprint`)."""
+    authwords = config.get("_compiled_authwords", {})
+    return hashlib.sha1(repr((
+        config['titles']['prefix'],
+        authwords.get('ignore'),
+        [regexp.pattern for regexp in authwords.get('after', [])],
+        [regexp.pattern for regexp in authwords.get('separators', [])],
+        )).encode("utf8")).hexdigest()
 
 class DataSubpath:
     """A path divided in two path: a datadir, and its subpath.
@@ -73,29 +72,50 @@ class Song:
     - Its content is cached, so that if the file has not been changed, the
       file is not parsed again.
 
+    Cached data does not depend on the songbook configuration, so that it is
+    shared by all the songbooks using the song. Metadata depending on the
+    configuration (titles without their prefix, and processed authors) is
+    cached for each configuration, in the metadata cache file (see
+    :meth:`metadata_fingerprint`).
+
     This class is inherited by classes implementing song management for
     several file formats. Those subclasses must implement:
     - `parse()` to parse the file;
     - `render()` to render the song as code.
+    They may also implement `_parse_header()` to parse song metadata only.
     """
 
     # Version format of cached song. Increment this number if we update
     # information stored in cache.
-    CACHE_VERSION = 4
+    CACHE_VERSION = 7
 
-    # List of attributes to cache
+    # List of attributes to cache (song metadata, as set by the parser)
     cached_attributes = [
         "titles",
-        "unprefixed_titles",
-        "cached",
         "data",
-        "errors",
         "lang",
-        "authors",
+        "raw_authors",
         "_filehash",
         "_version",
         ]
 
+    # List of attributes depending on the configuration (see
+    # :meth:`metadata_fingerprint`).
+    derived_attributes = [
+        "unprefixed_titles",
+        "authors",
+        ]
+
+    # Maximum number of configurations whose derived attributes are cached.
+    derived_cache_size = 8
+
+    # List of attributes describing the song content, cached separately (see
+    # :meth:`_parse_header`).
+    body_attributes = [
+        "cached",
+        "errors",
+        ]
+
     def __init__(self, subpath, config=None, *, datadir=None):
         if config is None:
             config = {}
@@ -114,83 +134,262 @@ class Song:
         self.encoding = config['book']["encoding"]
         self.lang = config['book']["lang"]
         self.config = config
-        self.errors = []
-
-        if self._cache_retrieved():
+        # Song content (`None` until it is parsed)
+        self._cached = None
+        self._errors = None
+        # Error raised when parsing song content (if any)
+        self._parse_error = None
+        # Derived attributes, indexed by configuration fingerprints
+        self._derived = {}
+
+        if self._cache_retrieved(self.cached_name, self.cached_attributes + ["_derived"]):
+            if not self._derived_retrieved():
+                self._derive_metadata()
+                self._write_cache(self.cached_name, self.cached_attributes + ["_derived"])
             return
 
         # Data extraction from the latex song
         self.titles = []
         self.data = {}
-        self.cached = {}
-        self._parse()
+        if not self._parse_header():
+            self.cached = {}
+            self.errors = []
+            self._parse()
+        self._process_metadata()
+
+        # Cache management
+        self._version = self.CACHE_VERSION
+        self._write_cache(self.cached_name, self.cached_attributes + ["_derived"])
+        if self._cached is not None:
+            self._write_cache(self.body_cached_name, self.cached_attributes + self.body_attributes)
 
-        # Post processing of data
+    def metadata_fingerprint(self):
+        """Return the fingerprint of the configuration derived attributes depend on.
+
+        Those are the title prefixes, and the words used to process authors.
+        """
+        return _metadata_fingerprint(self.config)
+
+    @classmethod
+    def config_fingerprint(cls, config):
+        """Return the fingerprint of the configuration songs of this class depend on.
+
+        Songs read with configurations having the same fingerprint are
+        identical, and can be shared (see :mod:`patacrep.songs.registry`).
+        """
+        return hashlib.sha1(repr((
+            cls.__module__,
+            cls.__qualname__,
+            config['book']['encoding'],
+            config['book']['lang'],
+            tuple(config.get('_datadir', [])),
+            config.get('_cache', False),
+            config.get('_cache_dir'),
+            _metadata_fingerprint(config),
+            )).encode("utf8")).hexdigest()
+
+    def bind(self, config):
+        """Return a copy of this song, using configuration `config`.
+
+        The configuration must have the same :meth:`config_fingerprint` as
+        the one of this song. The copy shares the song metadata, but has its
+        own errors and content: rendering or releasing it does not change this
+        song.
+        """
+        song = copy.copy(self)
+        song.config = config
+        song._derived = self._derived.copy() # pylint: disable=protected-access
+        if self._errors is not None:
+            song._errors = list(self._errors) # pylint: disable=protected-access
+        return song
+
+    def _process_metadata(self):
+        """Post processing of the titles and authors set by the parser."""
+        self.raw_authors = self.authors
+        self._derive_metadata()
+
+    def _derive_metadata(self):
+        """Set the attributes depending on the configuration (and remember them)."""
         self.unprefixed_titles = [
             unprefixed_title(
                 title,
-                config['titles']['prefix']
+                self.config['titles']['prefix']
                 )
             for title
             in self.titles
             ]
         self.authors = process_listauthors(
-            self.authors,
-            **config.get("_compiled_authwords", {})
+            self.raw_authors,
+            **self.config.get("_compiled_authwords", {})
             )
+        fingerprint = self.metadata_fingerprint()
+        self._derived.pop(fingerprint, None)
+        self._derived[fingerprint] = {
+            attribute: getattr(self, attribute)
+            for attribute in self.derived_attributes
+            }
+        while len(self._derived) > self.derived_cache_size:
+            del self._derived[next(iter(self._derived))]
+
+    def _derived_retrieved(self):
+        """Set the derived attributes from the cache, if they are known for this configuration."""
+        derived = self._derived.get(self.metadata_fingerprint())
+        if derived is None:
+            return False
+        for attribute, value in derived.items():
+            setattr(self, attribute, value)
+        return True
 
-        # Cache management
-        self._version = self.CACHE_VERSION
-        self._write_cache()
+    @property
+    def cached(self):
+        """Data needed to render the song (parsed when first needed)."""
+        if self._cached is None:
+            self._load_body()
+        return self._cached
+
+    @cached.setter
+    def cached(self, value):
+        self._cached = value
+
+    @property
+    def errors(self):
+        """Errors of the song (the song content is parsed when first needed)."""
+        if self._errors is None:
+            self._load_body()
+        return self._errors
+
+    @errors.setter
+    def errors(self, value):
+        self._errors = value
+
+    def _load_body(self):
+        """Parse the song content (or retrieve it from the cache)."""
+        if self._parse_error is not None:
+            raise self._parse_error
+        attributes = self.cached_attributes + self.body_attributes
+        # Errors are already known if the content has been released (see
+        # :meth:`release`): they are kept as is.
+        errors = self._errors
+        if errors is None:
+            retrieved = attributes
+        else:
+            retrieved = [attr for attr in attributes if attr != "errors"]
+        if self._cache_retrieved(self.body_cached_name, retrieved):
+            return
+        self.cached = {}
+        self.errors = []
+        try:
+            self._parse()
+        except Exception as error:
+            self.cached = self.errors = None
+            self._parse_error = error
+            raise
+        self._process_metadata()
+        self._write_cache(self.body_cached_name, attributes)
+        if errors is not None:
+            self.errors = errors
+
+    def release(self):
+        """Forget the song content, to free memory.
+
+        Song metadata and errors are kept. The content will be retrieved from
+        the cache (or parsed) again if it is needed again.
+        """
+        self.cached = None
 
     @property
     def cached_name(self):
         """Name of the file used for the cache"""
+        if self.config.get('_cache_dir'):
+            return cache.central_cached_name(self.config['_cache_dir'], self.content_key)
         return cached_name(self.datadir, self.subpath)
 
+    @property
+    def body_cached_name(self):
+        """Name of the file used for the cache of the song content"""
+        return self.cached_name + cache.BODY_SUFFIX
+
+    @property
+    def content_key(self):
+        """Hash identifying the song in the central cache.
+
+        It depends on the file content, and on everything else parsing the
+        song depends on (see :meth:`_content_key_items`).
+        """
+        return hashlib.sha1(repr(
+            (self.filehash,) + self._content_key_items()
+            ).encode("utf8")).hexdigest()
+
+    def _content_key_items(self):
+        """Return the tuple of (other than the file content) data parsing depends on."""
+        return (
+            type(self).__module__,
+            type(self).__qualname__,
+            self.encoding,
+            self.config['book']['lang'],
+            )
+
     @property
     def filehash(self):
         """Compute (and cache) the md5 hash of the file"""
         if self._filehash is None:
-            with open(self.fullpath, 'rb') as songfile:
-                self._filehash = hashlib.md5(songfile.read()).hexdigest()
+            self._filehash = cache.filehash(self.fullpath)
         return self._filehash
 
-    def _cache_retrieved(self):
-        """If relevant, retrieve self from the cache."""
-        if self.use_cache and os.path.exists(self.cached_name):
+    def _cache_retrieved(self, cachename, attributes):
+        """If relevant, retrieve `attributes` of self from cache file `cachename`."""
+        if self.use_cache and os.path.exists(cachename):
             try:
-                with open(self.cached_name, 'rb',) as cachefile:
-                    cached = pickle.load(cachefile)
+                cached = cache.load(cachename)
                 if (
                         cached['_filehash'] == self.filehash
                         and cached['_version'] == self.CACHE_VERSION
                 ):
-                    for attribute in self.cached_attributes:
+                    for attribute in attributes:
                         setattr(self, attribute, cached[attribute])
+                    cache.touch(cachename)
+                    if 'errors' in attributes:
+                        self.errors = [
+                            song_errors.from_dict(self, error)
+                            for error in cached['errors']
+                            ]
+                        for error in self.errors:
+                            LOGGER.warning(error)
                     return True
+            except cache.CorruptedCacheError as error:
+                LOGGER.debug("{} Deleting it.".format(error))
+                try:
+                    os.remove(cachename)
+                except OSError:
+                    pass
             except: # pylint: disable=bare-except
                 LOGGER.warning("Could not use cached version of {}.".format(
                     self.fullpath
                     ))
         return False
 
-    def _write_cache(self):
-        """If relevant, write a dumbed down version of self to the cache."""
+    def _write_cache(self, cachename, attributes):
+        """If relevant, write `attributes` of self to cache file `cachename`."""
         if not self.use_cache:
             return
-        if self.errors:
-            # As errors are exceptions, we cannot cache them because of a Python
-            # bug. When this bug is fixed, we will cache errors.
-            # https://bugs.python.org/issue1692335
-            return
-        cached = {attr: getattr(self, attr) for attr in self.cached_attributes}
-        with open(self.cached_name, 'wb') as cache_file:
-            pickle.dump(
-                cached,
-                cache_file,
-                protocol=-1
-                )
+        cache.dump(
+            self.cache_payload(attributes),
+            cachename,
+            version=self.CACHE_VERSION,
+            serializer=self.config.get('_cache_format'),
+            compression=self.config.get('_cache_compression'),
+            )
+
+    def cache_payload(self, attributes):
+        """Return the dictionary of `attributes` of self, as written to cache."""
+        # The hash is computed lazily: make sure it is known before caching it.
+        self._filehash = self.filehash
+        cached = {attr: getattr(self, attr) for attr in attributes}
+        if 'errors' in attributes:
+            # Errors are exceptions, which cannot always be pickled: they are
+            # cached as dictionaries, and rebuilt when the cache is read.
+            cached['errors'] = [vars(error) for error in self.errors]
+        return cached
 
     def __str__(self):
         return str(self.fullpath)
@@ -216,9 +415,24 @@ class Song:
         - data: song metadata. Used (among others) to sort the songs.
         - cached: additional data that will be cached. Thus, data stored in
           this attribute must be picklable.
+        - errors: the list of errors of the song.
         """
         raise NotImplementedError()
 
+    def _parse_header(self): # pylint: disable=no-self-use
+        """Parse song metadata only, if possible.
+
+        If the song metadata can be known without parsing the whole song, set
+        the `titles`, `lang`, `authors` and `data` attributes (as
+        :meth:`_parse` does), and return `True`. The song content will be
+        parsed by :meth:`_parse` when it is first needed (e.g. when
+        rendering the song), and cached separately. Thus, sorting or listing
+        songs does not require parsing them completely.
+
+        Return `False` otherwise: the song is then parsed by :meth:`_parse`.
+        """
+        return False
+
     def iter_datadirs(self, *subpath):
         """Return an iterator of existing datadirs (with an optionnal subpath)
         """
@@ -0,0 +1,463 @@
+"""Song cache management.
+
+Parsed songs are cached, so that songs that did not change are not parsed
+again. The cached version of song `<datadir>/<subpath>` is a pickled dictionary
+stored in `<datadir>/.cache/<subpath>` (see :func:`cached_name`). It contains
+the song metadata: the song content is cached in a separate file
+`<datadir>/.cache/<subpath>.body`, so that metadata can be read without it.
+
+Songs can also be cached in a central cache directory, shared by all datadirs
+(see :func:`central_cached_name`). In this cache, songs are not identified by
+their path, but by their content: identical songs are parsed once, wherever
+they are.
+
+Cache files are written atomically, and start with a header containing a
+checksum of their content: incomplete or corrupted files are detected when
+they are read (see :func:`load`). The header also tells how the content was
+serialized (see :data:`SERIALIZERS`) and compressed (see
+:data:`COMPRESSIONS`), so that files are read whatever the current settings,
+and which cache version it was written with.
+
+The cache can be bounded (see :func:`evict`): the modification time of cache
+files is updated each time they are used (see :func:`touch`), and the least
+recently used ones are deleted first.
+
+This module does not depend on :mod:`patacrep.songs`: the cache version to
+check entries against is given as argument.
+"""
+
+import collections
+import contextlib
+import copyreg
+import errno
+import hashlib
+import io
+import lzma
+import os
+import pickle
+import struct
+import tempfile
+import zlib
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+#: Name of the cache directory, in each datadir.
+CACHE_DIRNAME = ".cache"
+
+#: Suffix of cache files of song contents.
+BODY_SUFFIX = ".body"
+
+#: Environment variable setting the central cache directory.
+CACHE_DIR_ENV = "PATACREP_CACHE_DIR"
+
+#: Subdirectory of the central cache directory where songs are cached.
+SONGS_DIRNAME = "songs"
+
+#: Subdirectories of cache directories which do not contain songs (compiled
+#: templates, scores and formats).
+OTHER_DIRNAMES = ["templates", "scores", "formats"]
+
+#: Name of the lock file of cache directories (see :func:`lock`).
+LOCK_FILENAME = ".lock"
+
+#: Header of cache files: magic string, serializer and compression codes,
+#: cache version, length and CRC32 checksum of the (serialized and
+#: compressed) content.
+HEADER = struct.Struct(">8sBBIQI")
+MAGIC = b"patacrep"
+
+Header = collections.namedtuple(
+    "Header",
+    ["magic", "serializer", "compression", "version", "length", "checksum"],
+    )
+
+#: Functions returning a compact representation of objects of some types,
+#: used by :class:`FlatSerializer`. Keys are types, values are functions
+#: returning a `(function, arguments)` tuple (see :meth:`object.__reduce__`).
+FLATTENERS = {}
+
+class _FlatPickler(pickle.Pickler):
+    """Pickler using :data:`FLATTENERS`."""
+    # pylint: disable=too-few-public-methods
+
+    dispatch_table = collections.ChainMap(FLATTENERS, copyreg.dispatch_table)
+
+class PickleSerializer:
+    """Serialize cached data using :mod:`pickle`."""
+
+    name = "pickle"
+    code = 0
+
+    @staticmethod
+    def dumps(data):
+        """Return `data`, serialized as bytes."""
+        return pickle.dumps(data, protocol=-1)
+
+    @staticmethod
+    def loads(content):
+        """Return the data serialized in `content`."""
+        return pickle.loads(content)
+
+class FlatSerializer(PickleSerializer):
+    """Serialize cached data using :mod:`pickle` and :data:`FLATTENERS`.
+
+    Objects having a flattener (e.g. ChordPro songs) are serialized as flat
+    tuples of codes and strings, which are smaller, and faster to load than
+    the graph of objects they represent.
+    """
+
+    name = "flat"
+    code = 1
+
+    @staticmethod
+    def dumps(data):
+        output = io.BytesIO()
+        _FlatPickler(output, protocol=-1).dump(data)
+        return output.getvalue()
+
+#: Available serializers, indexed by name. Each of them must have a unique
+#: `code` (stored in cache files).
+SERIALIZERS = {
+    serializer.name: serializer
+    for serializer in (PickleSerializer, FlatSerializer)
+    }
+DEFAULT_SERIALIZER = "flat"
+
+def _identity(content):
+    """Return `content`."""
+    return content
+
+#: Available compression methods of cache files, as a dictionary of
+#: `(code, compress, decompress)` tuples indexed by name.
+COMPRESSIONS = {
+    "none": (0, _identity, _identity),
+    "zlib": (1, zlib.compress, zlib.decompress),
+    "lzma": (2, lzma.compress, lzma.decompress),
+    }
+DEFAULT_COMPRESSION = "none"
+
+#: Status of cache entries (see :meth:`CacheEntry.status`).
+VALID = "valid"
+MISSING = "missing"
+CHANGED = "changed"
+OUTDATED = "outdated"
+CORRUPTED = "corrupted"
+
+def cache_dir(datadir):
+    """Return the cache directory of `datadir`."""
+    return os.path.join(datadir, CACHE_DIRNAME)
+
+def cached_name(datadir, filename):
+    """Return the filename of the cache version of the file."""
+    fullpath = os.path.abspath(os.path.join(cache_dir(datadir), filename))
+    directory = os.path.dirname(fullpath)
+    try:
+        os.makedirs(directory)
+    except OSError as error:
+        if error.errno == errno.EEXIST and os.path.isdir(directory):
+            pass
+        else:
+            raise
+    return fullpath
+
+def default_central_dir():
+    """Return the default central cache directory.
+
+    This is `$XDG_CACHE_HOME/patacrep` (`~/.cache/patacrep` if
+    `XDG_CACHE_HOME` is not set).
+    """
+    return os.path.join(
+        os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"),
+        "patacrep",
+        )
+
+def central_cached_name(cachedir, key):
+    """Return the filename of the cache version of the song identified by `key`.
+
+    Arguments:
+    - cachedir: the central cache directory;
+    - key: hash identifying the song content (see :attr:`Song.content_key`).
+    """
+    fullpath = os.path.abspath(os.path.join(cachedir, SONGS_DIRNAME, key[:2], key))
+    os.makedirs(os.path.dirname(fullpath), exist_ok=True)
+    return fullpath
+
+def filehash(filename):
+    """Return the md5 hash of the file content."""
+    with open(filename, 'rb') as songfile:
+        return hashlib.md5(songfile.read()).hexdigest()
+
+class CorruptedCacheError(Exception):
+    """The content of a cache file does not match its checksum."""
+
+    def __init__(self, cachename):
+        super().__init__("Cache file '{}' is corrupted.".format(cachename))
+        self.cachename = cachename
+
+def _unpack_header(content, cachename):
+    """Return the :class:`Header` at the beginning of `content` (bytes)."""
+    if len(content) < HEADER.size:
+        raise CorruptedCacheError(cachename)
+    header = Header(*HEADER.unpack_from(content))
+    if header.magic != MAGIC:
+        raise CorruptedCacheError(cachename)
+    return header
+
+def read_header(cachename):
+    """Return the :class:`Header` of cache file `cachename`, without reading its content.
+
+    Raise :class:`CorruptedCacheError` if it is not a valid header.
+    """
+    with open(cachename, 'rb') as cachefile:
+        return _unpack_header(cachefile.read(HEADER.size), cachename)
+
+def load(cachename):
+    """Return the content of cache file `cachename`.
+
+    Raise :class:`CorruptedCacheError` if the file is incomplete or corrupted,
+    or cannot be read by this version of patacrep.
+    """
+    with open(cachename, 'rb') as cachefile:
+        content = cachefile.read()
+    header = _unpack_header(content, cachename)
+    content = memoryview(content)[HEADER.size:]
+    if header.length != len(content) or zlib.crc32(content) != header.checksum:
+        raise CorruptedCacheError(cachename)
+    for loader in SERIALIZERS.values():
+        if loader.code == header.serializer:
+            break
+    else:
+        raise CorruptedCacheError(cachename)
+    for code, _, decompress in COMPRESSIONS.values():
+        if code == header.compression:
+            break
+    else:
+        raise CorruptedCacheError(cachename)
+    try:
+        return loader.loads(decompress(content))
+    except Exception as error: # pylint: disable=broad-except
+        raise CorruptedCacheError(cachename) from error
+
+def _umask():
+    """Return the umask of the process."""
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+#: Permissions of cache files: the default permissions of new files (cache
+#: directories may be shared by several users: see :func:`central_cached_name`).
+FILE_MODE = 0o666 & ~_umask()
+
+def dump(data, cachename, *, version=0, serializer=None, compression=None):
+    """Write `data` to cache file `cachename`.
+
+    Arguments:
+    - data: the data to cache;
+    - cachename: the name of the cache file;
+    - version: the cache version of data (written in the header, so that
+      outdated files can be detected without reading them: see :func:`evict`);
+    - serializer: the name of the serializer (see :data:`SERIALIZERS`);
+    - compression: the name of the compression method (see :data:`COMPRESSIONS`).
+
+    The file is written atomically: it is written to a temporary file, which
+    is then renamed. Concurrent readers read either the previous version of
+    the file, or the new one. Its permissions are :data:`FILE_MODE` (temporary
+    files are only readable by their owner).
+    """
+    serializer = SERIALIZERS[serializer or DEFAULT_SERIALIZER]
+    compression, compress, _ = COMPRESSIONS[compression or DEFAULT_COMPRESSION]
+    content = compress(serializer.dumps(data))
+    directory, basename = os.path.split(cachename)
+    with tempfile.NamedTemporaryFile(
+        dir=directory,
+        prefix=".{}.".format(basename),
+        suffix=".tmp",
+        delete=False,
+        ) as cachefile:
+        try:
+            cachefile.write(HEADER.pack(
+                MAGIC, serializer.code, compression, version, len(content), zlib.crc32(content),
+                ))
+            cachefile.write(content)
+            os.chmod(cachefile.name, FILE_MODE)
+        except BaseException:
+            cachefile.close()
+            os.remove(cachefile.name)
+            raise
+    os.replace(cachefile.name, cachename)
+
+@contextlib.contextmanager
+def lock(cachedir, *, shared=False):
+    """Hold an advisory lock on cache directory `cachedir`.
+
+    Writing cache files does not need it (files are written atomically).
+    It is meant for commands processing many cache files: commands writing
+    many files hold a shared lock, while commands deleting them hold an
+    exclusive lock.
+
+    Does nothing on systems without :mod:`fcntl` (e.g. Windows).
+    """
+    if fcntl is None:
+        yield
+        return
+    os.makedirs(cachedir, exist_ok=True)
+    # Opened read-only, so that users sharing the cache directory can lock
+    # the lock file created by another one.
+    descriptor = os.open(os.path.join(cachedir, LOCK_FILENAME), os.O_RDONLY | os.O_CREAT, 0o666)
+    with os.fdopen(descriptor, "rb") as lockfile:
+        fcntl.flock(lockfile, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lockfile, fcntl.LOCK_UN)
+
+class CacheEntry:
+    """A file of the cache, bound to the song it is the cached version of."""
+
+    def __init__(self, datadir, subpath):
+        self.datadir = datadir
+        self.subpath = subpath
+
+    @property
+    def cachename(self):
+        """Path of the cache file."""
+        return os.path.join(cache_dir(self.datadir), self.subpath)
+
+    @property
+    def songpath(self):
+        """Path of the song this entry is the cached version of."""
+        subpath = self.subpath
+        if subpath.endswith(BODY_SUFFIX):
+            subpath = subpath[:-len(BODY_SUFFIX)]
+        return os.path.join(self.datadir, subpath)
+
+    @property
+    def size(self):
+        """Size of the cache file, in bytes."""
+        return os.path.getsize(self.cachename)
+
+    def status(self, version):
+        """Check this entry against its song, and return its status.
+
+        The status is one of:
+        - VALID: the entry can be used;
+        - MISSING: the song has been deleted;
+        - CHANGED: the song has changed since it was cached;
+        - OUTDATED: the entry was written with another cache version than
+          `version`;
+        - CORRUPTED: the entry cannot be read.
+        """
+        try:
+            cached = load(self.cachename)
+            cached_version = cached['_version']
+            cached_hash = cached['_filehash']
+        except Exception: # pylint: disable=broad-except
+            return CORRUPTED
+        if cached_version != version:
+            return OUTDATED
+        if not os.path.isfile(self.songpath):
+            return MISSING
+        if cached_hash != filehash(self.songpath):
+            return CHANGED
+        return VALID
+
+    def remove(self):
+        """Remove the cache file (and its parent directories, if empty)."""
+        _remove(cache_dir(self.datadir), self.subpath)
+
+def _remove(root, subpath):
+    """Remove file `subpath` of directory `root` (and its parent directories, if empty)."""
+    os.remove(os.path.join(root, subpath))
+    directory = os.path.dirname(os.path.join(root, subpath))
+    root = os.path.abspath(root)
+    while os.path.abspath(directory) != root:
+        try:
+            os.rmdir(directory)
+        except OSError:
+            break
+        directory = os.path.dirname(directory)
+
+def _iter_files(root):
+    """Iterate over the paths (relative to `root`) of the song files of cache directory `root`.
+
+    Lock files, temporary files and subdirectories which do not contain songs
+    are ignored.
+    """
+    for dirpath, dirnames, filenames in os.walk(root):
+        if dirpath == root:
+            dirnames[:] = [name for name in dirnames if name not in OTHER_DIRNAMES]
+        for filename in sorted(filenames):
+            if filename.startswith("."):
+                continue
+            yield os.path.relpath(os.path.join(dirpath, filename), root)
+
+def iter_entries(datadir):
+    """Iterate over the :class:`CacheEntry` objects of `datadir`."""
+    for subpath in _iter_files(cache_dir(datadir)):
+        yield CacheEntry(datadir, subpath)
+
+def touch(cachename):
+    """Record that cache file `cachename` has just been used.
+
+    Its modification time is used as the time it was last used (access time
+    is not reliable, depending on mount options). Errors are ignored (e.g.
+    read-only caches).
+    """
+    try:
+        os.utime(cachename)
+    except OSError:
+        pass
+
+def evict(cachedir, version, *, max_size=None, max_entries=None):
+    """Remove outdated, and least recently used, files of cache directory `cachedir`.
+
+    Arguments:
+    - cachedir: a cache directory (the cache directory of a datadir, or a
+      central cache directory);
+    - version: the current cache version: files written with another version
+      (or corrupted) are removed;
+    - max_size: maximum size (in bytes) of the remaining cache files (`None`
+      for no limit);
+    - max_entries: maximum number of remaining cache files (`None` for no
+      limit).
+
+    Least recently used files (see :func:`touch`) are removed until both
+    limits are respected. Files are only identified by their header: their
+    content is not read. Return the list of removed files (relative to
+    `cachedir`).
+    """
+    removed = []
+    entries = []
+    for subpath in _iter_files(cachedir):
+        cachename = os.path.join(cachedir, subpath)
+        try:
+            stat = os.stat(cachename)
+            if read_header(cachename).version == version:
+                entries.append((stat.st_mtime, subpath, stat.st_size))
+                continue
+        except (OSError, CorruptedCacheError):
+            pass
+        removed.append(subpath)
+
+    entries.sort()
+    size = sum(entry[2] for entry in entries)
+    count = len(entries)
+    for _, subpath, filesize in entries:
+        if (
+                (max_size is None or size <= max_size)
+                and (max_entries is None or count <= max_entries)
+        ):
+            break
+        removed.append(subpath)
+        size -= filesize
+        count -= 1
+
+    for subpath in list(removed):
+        try:
+            _remove(cachedir, subpath)
+        except OSError:
+            removed.remove(subpath)
+    return removed
@@ -1,5 +1,6 @@
 """Chordpro parser"""
 
+import functools
 import logging
 import operator
 import os
@@ -11,9 +12,10 @@ import jinja2
 
 from patacrep import encoding, files, pkg_datapath
 from patacrep.songs import Song
-from patacrep.songs.chordpro.syntax import parse_song
+from patacrep.songs.chordpro import ast
+from patacrep.songs.chordpro.syntax import parse_header, parse_song
 from patacrep.songs.errors import FileNotFound, SongUnknownLanguage
-from patacrep.templates import Renderer
+from patacrep.templates import Renderer, compile_templates, compiled_loader, escape_specials
 from patacrep.latex import lang2babel, UnknownLanguage
 
 LOGGER = logging.getLogger(__name__)
@@ -26,6 +28,22 @@ DEFAULT_FILTERS = {
     'sortargs': sort_directive_argument,
     }
 
+@functools.lru_cache()
+def _jinja_environment(datadirs, searchpath):
+    """Return a jinja2 environment loading templates from `searchpath`.
+
+    Templates compiled in the cache of `datadirs` (see
+    :meth:`ChordproSong.compile_templates`) are used if they are up to date.
+
+    Environments are shared between songs, so that each template is compiled
+    once per process instead of once per song.
+    """
+    loader = FileSystemLoader(searchpath)
+    compiled = compiled_loader(datadirs, searchpath)
+    if compiled is not None:
+        loader = ChoiceLoader([compiled, loader])
+    return Environment(loader=loader)
+
 class ChordproSong(Song):
     """Chordpro song parser"""
     # pylint: disable=abstract-method
@@ -39,10 +57,31 @@ class ChordproSong(Song):
         if self._translation_map_url is None:
             self._translation_map_url = self._translation_map
 
+    def _parse_header(self):
+        """Parse the song metadata, if it precedes the song content."""
+        with encoding.open_read(self.fullpath, encoding=self.encoding) as song:
+            song = parse_header(
+                song.read().strip()+"\n",
+                self.fullpath,
+                directives=self._directive_parsers(),
+                )
+        if song is None:
+            return False
+        self.authors = song.authors
+        self.titles = song.titles
+        self.lang = song.get_data_argument('language', self.lang)
+        self.data = song.meta
+        return True
+
     def _parse(self):
         """Parse content, and return the dictionary of song data."""
         with encoding.open_read(self.fullpath, encoding=self.encoding) as song:
-            song = parse_song(song.read().strip()+"\n", self.fullpath)
+            song = parse_song(
+                song.read().strip()+"\n",
+                self.fullpath,
+                engine=self.config.get('_chordpro_engine', 'ply'),
+                directives=self._directive_parsers(),
+                )
         self.authors = song.authors
         self.titles = song.titles
         self.lang = song.get_data_argument('language', self.lang)
@@ -52,6 +91,13 @@ class ChordproSong(Song):
             'song': song,
             }
 
+    def _directive_parsers(self):
+        """Return the parsers of directive arguments (including datadir plugins)."""
+        return files.load_directive_plugins(self.config.get('_datadir', []))
+
+    def _content_key_items(self):
+        return super()._content_key_items() + tuple(sorted(self._directive_parsers()))
+
     def _filters(self):
         """Return additional jinja2 filters."""
         filters = DEFAULT_FILTERS.copy()
@@ -73,9 +119,12 @@ class ChordproSong(Song):
             "content": self.cached['song'].content,
             }
 
-        jinjaenv = Environment(loader=FileSystemLoader(
-            self.iter_datadirs("templates", "songs", "chordpro", self.output_language)
-            ))
+        jinjaenv = _jinja_environment(
+            tuple(self.config['_datadir']),
+            self.searchpath(self.config['_datadir']),
+            )
+        # Some filters are bound to this song: they have to be set again
+        # before each rendering.
         jinjaenv.filters.update(self._filters())
 
         try:
@@ -87,6 +136,20 @@ class ChordproSong(Song):
         except jinja2.exceptions.TemplateNotFound:
             raise NotImplementedError("Cannot convert to format '{}'.".format(self.output_language))
 
+    @classmethod
+    def searchpath(cls, datadirs):
+        """Return the tuple of directories song templates are loaded from."""
+        return tuple(
+            os.path.abspath(path)
+            for path
+            in files.iter_datadirs(datadirs, "templates", "songs", "chordpro", cls.output_language)
+            )
+
+    @classmethod
+    def compile_templates(cls, datadirs):
+        """Compile song templates (see :func:`patacrep.templates.compile_templates`)."""
+        return compile_templates(datadirs, cls.searchpath(datadirs))
+
     @staticmethod
     @pass_context
     def _render_ast(context, content):
@@ -97,15 +160,13 @@ class ChordproSong(Song):
         return context.environment.get_template(content.template()).render(new_context)
 
     def _escape_specials(self, content, chars=None, *, translation_map=None):
+        """Escape special characters of `content` (a string, or a directive)."""
         if translation_map is None:
             translation_map = self._translation_map
-        if chars is None:
-            chars = translation_map.keys()
-        return str(content).translate(str.maketrans({
-            key: value
-            for key, value in translation_map.items()
-            if key in chars
-            }))
+        if type(content) is ast.Directive: # pylint: disable=unidiomatic-typecheck
+            # Subclasses of Directive are rendered differently.
+            content = content.argument
+        return escape_specials(content, chars, translation_map=translation_map)
 
     def _escape_url(self, content):
         return self._escape_specials(content, translation_map=self._translation_map_url)
@@ -2,11 +2,12 @@
 
 # pylint: disable=too-few-public-methods
 
-from collections import OrderedDict
+from collections import OrderedDict, deque
 import functools
 import logging
+import sys
 
-from patacrep.songs import errors
+from patacrep.songs import cache, errors
 
 LOGGER = logging.getLogger()
 
@@ -63,15 +64,47 @@ def directive_name(text):
     """Return name of the directive, considering eventual shortcuts."""
     return DIRECTIVE_SHORTCUTS.get(text, text)
 
+def _rebuild(cls, lineno, *fields):
+    """Rebuild an AST node from its compact representation.
+
+    See :meth:`AST.__reduce_ex__`.
+    """
+    node = cls.__new__(cls)
+    node.lineno = lineno
+    for name, value in zip(cls._fields, fields):
+        if isinstance(value, str):
+            value = sys.intern(value)
+        setattr(node, name, value)
+    return node
 
 class AST:
-    """Generic object representing elements of the song."""
+    """Generic object representing elements of the song.
+
+    A song contains thousands of small nodes (words, spaces, chords, etc.),
+    which are kept in memory and cached: those node classes define
+    ``__slots__``, and the :attr:`_fields` used to pickle them compactly.
+
+    Argument `lineno` is the line of the song the node has been read at (if
+    relevant).
+    """
+    __slots__ = ('lineno',)
     _template = None
     inline = False
-    lexer = None
 
-    def __init__(self):
-        self.lineno = self.lexer.lineno
+    #: Attributes (besides :attr:`lineno`) defining a node. Subclasses
+    #: setting it are pickled as a tuple of those attributes.
+    _fields = None
+
+    def __init__(self, *, lineno=None):
+        self.lineno = lineno
+
+    def __reduce_ex__(self, protocol):
+        if self._fields is None:
+            return super().__reduce_ex__(protocol)
+        return (
+            _rebuild,
+            (self.__class__, self.lineno) + tuple(getattr(self, name) for name in self._fields),
+            )
 
     def template(self):
         """Return the template to be used to render this object."""
@@ -86,13 +119,19 @@ class Error(AST):
     """Parsing error. To be ignored."""
 
 class Line(AST):
-    """A line is a sequence of (possibly truncated) words, spaces and chords."""
+    """A line is a sequence of (possibly truncated) words, spaces and chords.
 
+    The parser builds lines from their end: while being built, items are
+    stored in a :class:`collections.deque`, which is turned into a list by
+    :meth:`finalize`.
+    """
+    __slots__ = ('line',)
+    _fields = __slots__
     _template = "line"
 
-    def __init__(self, *items):
-        super().__init__()
-        self.line = list(items)
+    def __init__(self, *items, lineno=None):
+        super().__init__(lineno=lineno)
+        self.line = deque(items)
 
     def __iter__(self):
         yield from self.line
@@ -103,7 +142,12 @@ class Line(AST):
         Does nothing if argument is `None`.
         """
         if data is not None:
-            self.line.insert(0, data)
+            self.line.appendleft(data)
+        return self
+
+    def finalize(self):
+        """Store the items as a list, once the line is complete."""
+        self.line = list(self.line)
         return self
 
     def strip(self):
@@ -128,46 +172,53 @@ class Echo(AST):
     _template = "echo"
     type = 'echo'
 
-    def __init__(self, line):
-        super().__init__()
+    def __init__(self, line, *, lineno=None):
+        super().__init__(lineno=lineno)
         self.line = line
 
 class LineElement(AST):
     """Something present on a line."""
     # pylint: disable=abstract-method
-    pass
+    __slots__ = ()
 
 class Word(LineElement):
     """A chunk of word."""
+    __slots__ = ('value',)
+    _fields = __slots__
     _template = "word"
 
-    def __init__(self, value):
-        super().__init__()
-        self.value = value
+    def __init__(self, value, *, lineno=None):
+        super().__init__(lineno=lineno)
+        self.value = sys.intern(value)
 
 class Space(LineElement):
     """A space between words"""
+    __slots__ = ()
+    _fields = __slots__
     _template = "space"
 
-    def __init__(self):
-        super().__init__()
+    def __init__(self, *, lineno=None):
+        super().__init__(lineno=lineno)
 
 class ChordList(LineElement):
     """A list of chords."""
+    __slots__ = ('chords',)
+    _fields = __slots__
     _template = "chordlist"
 
-    def __init__(self, *chords):
-        super().__init__()
+    def __init__(self, *chords, lineno=None):
+        super().__init__(lineno=lineno)
         self.chords = chords
 
 class Chord(AST):
     """A chord."""
-
+    __slots__ = ('chord',)
+    _fields = __slots__
     _template = "chord"
 
-    def __init__(self, chord):
-        super().__init__()
-        self.chord = chord
+    def __init__(self, chord, *, lineno=None):
+        super().__init__(lineno=lineno)
+        self.chord = sys.intern(chord)
 
     @property
     def pretty_chord(self):
@@ -175,18 +226,28 @@ class Chord(AST):
         return self.chord.replace('b', '♭').replace('#', '♯')
 
 class Verse(AST):
-    """A verse (or bridge, or chorus)"""
+    """A verse (or bridge, or chorus)
+
+    As :class:`Line`, verses are built from their end (see :meth:`finalize`).
+    """
+    __slots__ = ('lines',)
+    _fields = __slots__
     _template = "verse"
     type = "verse"
     inline = True
 
-    def __init__(self):
-        super().__init__()
-        self.lines = []
+    def __init__(self, *, lineno=None):
+        super().__init__(lineno=lineno)
+        self.lines = deque()
 
     def prepend(self, data):
         """Add data at the beginning of verse."""
-        self.lines.insert(0, data)
+        self.lines.appendleft(data)
+        return self
+
+    def finalize(self):
+        """Store the lines as a list, once the verse is complete."""
+        self.lines = list(self.lines)
         return self
 
     def directive(self):
@@ -208,10 +269,12 @@ class Verse(AST):
 
 class Chorus(Verse):
     """Chorus"""
+    __slots__ = ()
     type = 'chorus'
 
 class Bridge(Verse):
     """Bridge"""
+    __slots__ = ()
     type = 'bridge'
 
 class Song(AST):
@@ -236,9 +299,9 @@ class Song(AST):
         "tag": "add_cumulative",
         }
 
-    def __init__(self, filename, directives, *, error_builders=None):
-        super().__init__()
-        self.content = []
+    def __init__(self, filename, directives, *, error_builders=None, lineno=None):
+        super().__init__(lineno=lineno)
+        self.content = deque()
         self.meta = OrderedDict()
         self._authors = []
         self._titles = []
@@ -259,12 +322,12 @@ class Song(AST):
         elif data is None:
             # New line
             if not (self.content and isinstance(self.content[0], EndOfLine)):
-                self.content.insert(0, EndOfLine())
+                self.content.appendleft(EndOfLine(lineno=self.lineno))
         elif isinstance(data, Line):
             # Add a new line, maybe in the current verse.
             if not data.is_empty():
                 if not (self.content and isinstance(self.content[0], Verse)):
-                    self.content.insert(0, Verse())
+                    self.content.appendleft(Verse(lineno=self.lineno))
                 self.content[0].prepend(data.strip())
         elif isinstance(data, Directive) and data.inline:
             # Add a directive in the content of the song.
@@ -273,7 +336,7 @@ class Song(AST):
             self.content.append(data)
         elif data.inline:
             # Add an object in the content of the song.
-            self.content.insert(0, data)
+            self.content.appendleft(data)
         elif isinstance(data, Directive):
             # Add a metadata directive. Some of them are added using special
             # methods listed in ``METADATA_ADD``.
@@ -293,6 +356,19 @@ class Song(AST):
             raise Exception()
         return self
 
+    def finalize(self):
+        """Store the content (and verses) as lists, once parsing is over.
+
+        The song is built from its end, by :meth:`add`: see :meth:`Line.finalize`.
+        Verses (including choruses and bridges) may be extended by :meth:`add`
+        until the end of parsing, so they are finalized here as well.
+        """
+        self.content = list(self.content)
+        for item in self.content:
+            if isinstance(item, (Verse, Tab)):
+                item.finalize()
+        return self
+
     def add_title(self, data):
         """Add a title"""
         self._titles.append(data.argument)
@@ -344,6 +420,7 @@ class Song(AST):
         self.meta['morekeys'].append(Directive(
             key.strip(),
             ":".join(argument).strip(),
+            lineno=data.lineno,
             ))
 
 class EndOfLine(AST):
@@ -353,8 +430,8 @@ class EndOfLine(AST):
 class Directive(AST):
     """A directive"""
 
-    def __init__(self, keyword, argument=None):
-        super().__init__()
+    def __init__(self, keyword, argument=None, *, lineno=None):
+        super().__init__(lineno=lineno)
         self.keyword = directive_name(keyword.strip())
         if keyword == 'meta':
             argument = argument.partition(':')
@@ -393,12 +470,12 @@ class Define(Directive):
         open). Can be `None` if not defined.
     """
 
-    def __init__(self, key, basefret, frets, fingers):
+    def __init__(self, key, basefret, frets, fingers, *, lineno=None):
         self.key = key
         self.basefret = basefret # Can be None
         self.frets = frets
         self.fingers = fingers # Can be None
-        super().__init__("define", None)
+        super().__init__("define", None, lineno=lineno)
 
     @property
     def pretty_key(self):
@@ -417,24 +494,142 @@ class Image(Directive):
         An iterable of tuples ``(type, float, unit)``.
     """
 
-    def __init__(self, filename, size=None):
+    def __init__(self, filename, size=None, *, lineno=None):
         self.filename = filename
         if size is None:
             size = []
         self.size = size
-        super().__init__("image", None)
+        super().__init__("image", None, lineno=lineno)
 
 class Tab(AST):
-    """Tablature"""
+    """Tablature
+
+    As :class:`Line`, tablatures are built from their end (see :meth:`finalize`).
+    """
 
     inline = True
     _template = "tablature"
 
-    def __init__(self):
-        super().__init__()
-        self.content = []
+    def __init__(self, *, lineno=None):
+        super().__init__(lineno=lineno)
+        self.content = deque()
 
     def prepend(self, data):
         """Add an element at the beginning of content."""
-        self.content.insert(0, data)
+        self.content.appendleft(data)
+        return self
+
+    def finalize(self):
+        """Store the content as a list, once the tablature is complete."""
+        self.content = list(self.content)
         return self
+
+#: Version of the flat representation of songs (see :func:`flatten_song`).
+#: Increment this number when changing this representation.
+FLAT_VERSION = 1
+
+#: Codes of the nodes having a flat representation.
+_WORD, _SPACE, _CHORDLIST, _LINE, _VERSE, _CHORUS, _BRIDGE, _ENDOFLINE, _OTHER = range(9)
+_VERSE_CODES = {Verse: _VERSE, Chorus: _CHORUS, Bridge: _BRIDGE}
+
+def _flatten(node):
+    """Return the flat representation of `node` (see :func:`flatten_song`)."""
+    # pylint: disable=too-many-return-statements, unidiomatic-typecheck
+    cls = type(node)
+    if cls is Word:
+        return (_WORD, node.lineno, node.value)
+    if cls is Space:
+        return (_SPACE, node.lineno)
+    if cls is ChordList and all(type(chord) is Chord for chord in node.chords):
+        return (
+            _CHORDLIST,
+            node.lineno,
+            tuple((chord.lineno, chord.chord) for chord in node.chords),
+            )
+    if cls is Line:
+        return (_LINE, node.lineno, [_flatten(item) for item in node.line])
+    if cls in _VERSE_CODES:
+        return (_VERSE_CODES[cls], node.lineno, [_flatten(line) for line in node.lines])
+    if cls is EndOfLine:
+        return (_ENDOFLINE, node.lineno)
+    return (_OTHER, node)
+
+def _new(cls, lineno):
+    """Return a new, uninitialized, `cls` node."""
+    node = cls.__new__(cls)
+    node.lineno = lineno
+    return node
+
+def _unflatten_word(flat):
+    """Build a :class:`Word` from its flat representation."""
+    node = _new(Word, flat[1])
+    node.value = sys.intern(flat[2])
+    return node
+
+def _unflatten_chordlist(flat):
+    """Build a :class:`ChordList` from its flat representation."""
+    node = _new(ChordList, flat[1])
+    chords = []
+    for lineno, value in flat[2]:
+        chord = _new(Chord, lineno)
+        chord.chord = sys.intern(value)
+        chords.append(chord)
+    node.chords = tuple(chords)
+    return node
+
+def _unflatten_line(flat):
+    """Build a :class:`Line` from its flat representation."""
+    node = _new(Line, flat[1])
+    node.line = [_UNFLATTEN[item[0]](item) for item in flat[2]]
+    return node
+
+def _verse_unflattener(cls):
+    """Return the function building a `cls` verse from its flat representation."""
+    def unflatten(flat):
+        """Build a verse from its flat representation."""
+        node = _new(cls, flat[1])
+        node.lines = [_unflatten_line(line) for line in flat[2]]
+        return node
+    return unflatten
+
+#: Functions building nodes from their flat representation, indexed by codes.
+_UNFLATTEN = [
+    _unflatten_word,
+    lambda flat: _new(Space, flat[1]),
+    _unflatten_chordlist,
+    _unflatten_line,
+    _verse_unflattener(Verse),
+    _verse_unflattener(Chorus),
+    _verse_unflattener(Bridge),
+    lambda flat: _new(EndOfLine, flat[1]),
+    lambda flat: flat[1],
+    ]
+
+def flatten_song(song):
+    """Return a compact representation of `song`, to be pickled.
+
+    Nodes of the song content are represented as nested tuples of codes,
+    line numbers and strings (other nodes, like directives, are pickled as
+    is). Such tuples are smaller, and faster to unpickle, than the nodes they
+    represent.
+
+    This is a reduction function: it returns a `(function, arguments)`
+    tuple (see :meth:`object.__reduce__`).
+    """
+    attributes = vars(song).copy()
+    content = attributes.pop('content')
+    return (
+        _unflatten_song,
+        (FLAT_VERSION, song.lineno, attributes, [_flatten(item) for item in content]),
+        )
+
+def _unflatten_song(version, lineno, attributes, content):
+    """Build a song from its flat representation (see :func:`flatten_song`)."""
+    if version != FLAT_VERSION:
+        raise ValueError("Unsupported version of flat songs: {}.".format(version))
+    song = _new(Song, lineno)
+    song.__dict__.update(attributes)
+    song.content = [_UNFLATTEN[item[0]](item) for item in content]
+    return song
+
+cache.FLATTENERS[Song] = flatten_song
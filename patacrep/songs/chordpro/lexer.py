@@ -100,9 +100,13 @@ class ChordProLexer:
     t_tablature_ENDOFLINE = r'\r?\n'
 
     def __init__(self, *, filename=None):
-        self.__class__.lexer = lex.lex(module=self)
         self.error_builders = []
         self.filename = filename
+        self.lexer = _base_lexer().clone(self)
+        # Cloning shares the state stack, and does not rebind the rules of
+        # the current state.
+        self.lexer.lexstatestack = []
+        self.lexer.begin('INITIAL')
 
     # Define a rule so we can track line numbers
     @staticmethod
@@ -201,3 +205,13 @@ class ChordProLexer:
     def t_directiveargument_error(self, token):
         """Manage errors"""
         return self.t_directive_error(token)
+
+@functools.lru_cache()
+def _base_lexer():
+    """Return the lexer every :class:`ChordProLexer` is a clone of.
+
+    Building a lexer compiles its (large) regular expressions: this is done
+    once per process. The rules are bound to an uninitialized lexer, and are
+    rebound to the actual :class:`ChordProLexer` objects when cloning.
+    """
+    return lex.lex(module=ChordProLexer.__new__(ChordProLexer))
@@ -0,0 +1,350 @@
+"""Fast ChordPro parser
+
+This is an alternative to the PLY based :class:`ChordproParser`: songs are
+split into lines, each line is scanned with a single regular expression, and
+the song is built by a small recursive descent parser. It produces the very
+same :class:`ast.Song` (including line numbers) as :class:`ChordproParser`.
+
+Songs this parser does not handle exactly like :class:`ChordproParser` (that
+is, songs containing errors, or some rare valid constructs, like chords or
+directive arguments spanning several lines) are parsed again, using
+:class:`ChordproParser`.
+
+It is also used to parse the metadata of songs, without parsing their content
+(see :meth:`FastChordproParser.parse_header`).
+"""
+
+import logging
+import re
+
+from patacrep.songs.chordpro import ast
+from patacrep.songs.chordpro import syntax
+from patacrep.songs.syntax import Parser
+
+LOGGER = logging.getLogger()
+
+#: Tokens of a line, in the initial state of :class:`ChordProLexer` (in
+#: the same order).
+_INITIAL = re.compile(r"""
+    (?P<SOC>{(?:soc|start_of_chorus)})
+    |(?P<EOC>{(?:eoc|end_of_chorus)})
+    |(?P<SOB>{(?:sob|start_of_bridge)})
+    |(?P<EOB>{(?:eob|end_of_bridge)})
+    |(?P<SE>{(?:se|start_echo)})
+    |(?P<EE>{(?:ee|end_echo)})
+    |(?P<SOT>{(?:sot|start_of_tab)})
+    |(?P<COMMENT>\#.*)
+    |(?P<WORD>[^{}\\\r\]\[\t\ ]+)
+    |\[(?P<CHORD>[^\]]*)\]
+    |(?P<DIRECTIVE>
+        {[\ \t]*
+        (?P<keyword>[a-zA-Z_]+)
+        (?:[\ \t]*:(?P<argument>(?:[^\\}]|\\[{}\ \#\\])*))?
+        }
+    )
+    |\\(?P<ESCAPED>[{}\ \#\\])
+    |(?P<SPACE>[\ \t]+)
+    """, re.VERBOSE)
+
+#: Escaped characters in directive arguments
+_ESCAPED = re.compile(r"\\([{} #\\])")
+
+#: A line of tablature: leading spaces, and either the end of tablature, or text.
+_TABLATURE = re.compile(r"""
+    (?P<space>[\ \t]*)
+    (?:(?P<EOT>{(?:eot|end_of_tab)})(?P<rest>.*) | (?P<TEXT>[^\r]*))
+    $
+    """, re.VERBOSE)
+
+#: Directives (or block delimiters) anywhere in a song, with their keyword
+_ANY_DIRECTIVE = re.compile(r"{[\ \t]*(?P<keyword>[a-zA-Z_]+)[\ \t]*[:}]")
+
+#: Directives starting or ending blocks (which are not metadata)
+_DELIMITERS = {
+    "{{{}}}".format(keyword)
+    for keyword in (
+        "soc", "start_of_chorus", "eoc", "end_of_chorus",
+        "sob", "start_of_bridge", "eob", "end_of_bridge",
+        "se", "start_echo", "ee", "end_echo",
+        "sot", "start_of_tab",
+        )
+    }
+
+#: Tablatures (in which directives are not parsed)
+_TABLATURES = re.compile(
+    r"^[\ \t]*{(?:sot|start_of_tab)}.*?^[\ \t]*{(?:eot|end_of_tab)}",
+    re.MULTILINE | re.DOTALL,
+    )
+
+#: Token types starting a chorus or bridge, mapped to the corresponding
+#: node class and token type ending it.
+_BLOCKS = {
+    "SOC": (ast.Chorus, "EOC"),
+    "SOB": (ast.Bridge, "EOB"),
+    }
+
+class _Fallback(Exception):
+    """Raised when the song cannot be parsed by :class:`FastChordproParser`."""
+
+class FastChordproParser(syntax.ChordproParser):
+    """Fast ChordPro parser class
+
+    Songs which cannot be parsed by this class are parsed by
+    :class:`syntax.ChordproParser`.
+    """
+
+    def __init__(self, filename=None): # pylint: disable=super-init-not-called
+        Parser.__init__(self) # pylint: disable=non-parent-init-called
+        self.filename = filename
+        self.directive_parsers = syntax.CHORDPRO_DIRECTIVES
+        self._directives = []
+
+    def parse(self, content):
+        """Parse file
+
+        If the song is not supported by this parser, it is parsed by the PLY
+        based parser.
+        """
+        self._directives = []
+        self._errors = []
+        try:
+            return self._song(content)
+        except _Fallback:
+            LOGGER.debug("Song %s: Using the PLY parser.", self.filename)
+            return syntax.parse_song(
+                content,
+                self.filename,
+                engine="ply",
+                directives=self.directive_parsers,
+                )
+
+    def parse_header(self, content):
+        """Parse the metadata of a song, without parsing its content.
+
+        Lines are read until the first one which is not a metadata directive
+        (nor an empty line or a comment). Return an :class:`ast.Song` without
+        content, or `None` if the metadata of the song cannot be known this
+        way (e.g. some metadata directives follow the beginning of the song
+        content, or the header contains errors).
+        """
+        self._directives = []
+        self._errors = []
+        lines = content.split("\n")
+        # Line number, as counted by the lexer.
+        lineno = 1
+        for index, line in enumerate(lines):
+            try:
+                tokens = self._tokens(line)
+            except _Fallback:
+                break
+            if tokens:
+                if not _is_metadata(tokens):
+                    break
+                try:
+                    self._line(tokens, lineno)
+                except _Fallback:
+                    return None
+            lineno += 1
+        else:
+            index = len(lines)
+
+        body = _TABLATURES.sub("", "\n".join(lines[index:]))
+        for match in _ANY_DIRECTIVE.finditer(body):
+            keyword = ast.directive_name(match.group("keyword"))
+            if match.group(0) not in _DELIMITERS and keyword not in ast.INLINE_DIRECTIVES:
+                return None
+
+        return ast.Song(self.filename, directives=self._directives, lineno=lineno).finalize()
+
+    def error(self, *, line=None, column=None, message=""):
+        """Errors are left to the PLY based parser."""
+        raise _Fallback()
+
+    def _song(self, content):
+        """Parse content, and return the :class:`ast.Song` object."""
+        lines = content.split("\n")
+        if lines.pop():
+            # Last line does not end with a newline.
+            raise _Fallback()
+        lines = iter(lines)
+        blocks = []
+        # Line number, as counted by the lexer.
+        lineno = 1
+        for line in lines:
+            tokens = self._tokens(line)
+            if not tokens:
+                blocks.append(None)
+            elif tokens[0][0] in _BLOCKS:
+                blocks.append(self._block(tokens, lines, lineno))
+                lineno = blocks[-1].lineno
+            elif tokens[0][0] == "SOT":
+                blocks.append(self._tablature(tokens, lines, lineno))
+            else:
+                blocks.append(self._line(tokens, lineno))
+            lineno += 1
+
+        song = ast.Song(
+            self.filename,
+            directives=self._directives,
+            error_builders=self._errors,
+            lineno=lineno,
+            )
+        for block in reversed(blocks):
+            song.add(block)
+        return song.finalize()
+
+    @staticmethod
+    def _tokens(line):
+        """Return the list of `(type, value)` tokens of a line.
+
+        Comments and leading spaces are omitted. Directives are returned as a
+        single token, whose value is the `(keyword, argument)` tuple.
+        """
+        if line.endswith("\r"):
+            line = line[:-1]
+        tokens = []
+        position = 0
+        while position < len(line):
+            match = _INITIAL.match(line, position)
+            if match is None:
+                raise _Fallback()
+            position = match.end()
+            kind = match.lastgroup
+            if kind == "WORD":
+                tokens.append((kind, match.group(kind)))
+            elif kind == "SPACE":
+                if tokens:
+                    tokens.append((kind, None))
+            elif kind == "CHORD":
+                if match.group(kind):
+                    tokens.append((kind, match.group(kind)))
+            elif kind == "ESCAPED":
+                tokens.append(("WORD", match.group(kind)))
+            elif kind == "DIRECTIVE":
+                argument = match.group("argument")
+                if argument is not None:
+                    argument = _ESCAPED.sub(r"\1", argument).strip()
+                tokens.append((kind, (match.group("keyword"), argument)))
+            elif kind == "SOT":
+                # The end of line is scanned as tablature
+                if tokens or line[position:].strip(" \t"):
+                    raise _Fallback()
+                tokens.append((kind, None))
+                break
+            elif kind != "COMMENT":
+                tokens.append((kind, None))
+        return tokens
+
+    def _line(self, tokens, lineno):
+        """Return the :class:`ast.Line` made of `tokens`.
+
+        A line is either a directive (optionally followed by a space), or a
+        sequence of words, spaces, chords and echos.
+
+        Nodes are given the line number the lexer would be at when the PLY
+        based parser builds them, that is, once the token following them has
+        been read: the lexer is on the next line if it is the end of line.
+        """
+        if tokens[0][0] == "DIRECTIVE":
+            if len(tokens) > 2 or (len(tokens) == 2 and tokens[1][0] != "SPACE"):
+                raise _Fallback()
+            if len(tokens) == 1:
+                lineno += 1
+            keyword, argument = tokens[0][1]
+            directive = self._directive(keyword, argument, lineno=lineno)
+            if directive is None:
+                return ast.Line(lineno=lineno).finalize()
+            return ast.Line(directive, lineno=lineno).finalize()
+
+        items, index = self._line_items(tokens, 0, lineno)
+        if index != len(tokens):
+            raise _Fallback()
+        return ast.Line(*items, lineno=lineno + 1).finalize()
+
+    def _line_items(self, tokens, index, lineno):
+        """Parse the words, spaces, chords and echos of a line.
+
+        Return the list of nodes, and the index of the first token which is
+        not part of it.
+        """
+        items = []
+        while index < len(tokens):
+            kind, value = tokens[index]
+            if index == len(tokens) - 1:
+                # The token following this one is the end of line.
+                nodelineno = lineno + 1
+            else:
+                nodelineno = lineno
+            if kind == "WORD":
+                items.append(ast.Word(value, lineno=nodelineno))
+            elif kind == "SPACE":
+                items.append(ast.Space(lineno=nodelineno))
+            elif kind == "CHORD":
+                items.append(ast.ChordList(
+                    *[ast.Chord(chord, lineno=nodelineno) for chord in value.split()],
+                    lineno=nodelineno
+                    ))
+            elif kind == "SE":
+                echo, index = self._line_items(tokens, index + 1, lineno)
+                if index == len(tokens):
+                    raise _Fallback()
+                items.append(ast.Echo(
+                    ast.Line(*echo, lineno=lineno).finalize(),
+                    lineno=lineno + 1 if index == len(tokens) - 1 else lineno,
+                    ))
+            elif kind == "EE":
+                break
+            else:
+                raise _Fallback()
+            index += 1
+        return items, index
+
+    def _block(self, tokens, lines, lineno):
+        """Parse a chorus or a bridge, and return the :class:`ast.Verse` object.
+
+        Its line number is the one of its last line.
+        """
+        verse, end = _BLOCKS[tokens[0][0]]
+        if tokens[1:] not in ([], [("SPACE", None)]):
+            raise _Fallback()
+        content = []
+        for line in lines:
+            lineno += 1
+            tokens = self._tokens(line)
+            if not tokens:
+                raise _Fallback()
+            if tokens[0][0] == end:
+                if tokens[1:] not in ([], [("SPACE", None)]):
+                    raise _Fallback()
+                block = verse(lineno=lineno)
+                block.lines.extend(content)
+                return block
+            content.append(self._line(tokens, lineno))
+        raise _Fallback()
+
+    def _tablature(self, tokens, lines, lineno):
+        """Parse a tablature, and return the :class:`ast.Tab` object.
+
+        Ends of lines of tablatures are not counted by the lexer.
+        """
+        tab = ast.Tab(lineno=lineno)
+        for line in lines:
+            if line.endswith("\r"):
+                line = line[:-1]
+            match = _TABLATURE.match(line)
+            if match is None:
+                raise _Fallback()
+            if match.group("EOT") is not None:
+                if self._tokens(match.group("rest")) not in ([], [("SPACE", None)]):
+                    raise _Fallback()
+                return tab
+            if match.group("TEXT").strip():
+                tab.content.append(match.group("TEXT"))
+        raise _Fallback()
+
+def _is_metadata(tokens):
+    """Return `True` iff the line made of `tokens` is a known metadata directive."""
+    if tokens[0][0] != "DIRECTIVE" or tokens[1:] not in ([], [("SPACE", None)]):
+        return False
+    keyword = ast.directive_name(tokens[0][1][0])
+    return keyword in ast.AVAILABLE_DIRECTIVES and keyword not in ast.INLINE_DIRECTIVES
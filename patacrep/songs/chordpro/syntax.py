@@ -3,6 +3,7 @@
 import logging
 import re
 import shlex
+import threading
 
 import ply.yacc as yacc
 
@@ -23,6 +24,7 @@ class ChordproParser(Parser):
         super().__init__()
         self.tokens = tokens
         self.filename = filename
+        self.directive_parsers = CHORDPRO_DIRECTIVES
         self._directives = []
         self.parser = yacc.yacc(
             module=self,
@@ -35,14 +37,18 @@ class ChordproParser(Parser):
 
         This is a shortcut to `yacc.yacc(...).parse()`. The arguments are
         transmitted to this method.
+
+        The parser can be used to parse several songs: the state related to
+        the song being parsed is reset here.
         """
+        self._directives = []
+        self._errors = []
         lexer = ChordProLexer(filename=self.filename)
-        ast.AST.lexer = lexer.lexer
         parsed = self.parser.parse(content, lexer=lexer.lexer)
         if parsed is None:
             raise ContentError(message='Fatal error during song parsing.')
         parsed.error_builders.extend(lexer.error_builders)
-        return parsed
+        return parsed.finalize()
 
     def p_song(self, symbols):
         """song : block song
@@ -53,6 +59,7 @@ class ChordproParser(Parser):
                 self.filename,
                 directives=self._directives,
                 error_builders=self._errors,
+                lineno=symbols.lexer.lineno,
                 )
         else:
             symbols[0] = symbols[2].add(symbols[1])
@@ -81,176 +88,35 @@ class ChordproParser(Parser):
         """
         symbols[0] = None
 
-    @staticmethod
-    def _parse_define(groups):
-        """Parse a `{define: KEY base-fret BASE frets FRETS fingers FINGERS}` directive
-
-        Return a :class:`ast.Define` object.
-        """
-        # pylint: disable=too-many-branches
-        if not groups['key'].strip():
-            return None
-        else:
-            key = ast.Chord(groups['key'].strip())
-
-        if groups['basefret'] is None:
-            basefret = None
-        else:
-            basefret = int(groups['basefret'])
-
-        if groups['frets'] is None:
-            frets = None
-        else:
-            frets = []
-            for fret in groups['frets'].split():
-                if fret in "xX":
-                    frets.append(None)
-                else:
-                    frets.append(int(fret))
-
-        if groups['fingers'] is None:
-            fingers = None
-        else:
-            fingers = []
-            for finger in groups['fingers'].split():
-                if finger == '-':
-                    fingers.append(None)
-                else:
-                    fingers.append(int(finger))
-
-        return ast.Define(
-            key=key,
-            basefret=basefret,
-            frets=frets,
-            fingers=fingers,
-            )
-
-    def _iter_raw_image_size_arguments(self, arguments, *, lineno):
-        for item in arguments:
-            prefix, _, suffix = item.partition("=")
-            if prefix in ['width', 'height']:
-                match = re.compile(
-                    r"^(?P<value>(\d*\.\d+|\d+))(?P<unit>cm|em|pt)$",
-                    re.VERBOSE,
-                    ).match(suffix)
-                if match is not None:
-                    yield (prefix, match.groupdict()['value'], match.groupdict()['unit'])
-                    continue
-            elif prefix in ['scale']:
-                match = re.compile(
-                    r"^(?P<value>(\d*\.\d+|\d+))$",
-                    re.VERBOSE,
-                    ).match(suffix)
-                if match is not None:
-                    yield (prefix, match.groupdict()['value'], "")
-                    continue
-            else:
-                self.error(
-                    line=lineno,
-                    message="Image: Unknown argument name '{}'.".format(prefix),
-                )
-                continue
-            self.error(
-                line=lineno,
-                message="Image: Unsupported {} value: '{}'.".format(prefix, suffix),
-            )
-
-    def _iter_image_size_arguments(self, argument, *, lineno):
-        arguments = set()
-        length_names = frozenset(["width", "height"])
-        for name, value, unit in self._iter_raw_image_size_arguments(argument, lineno=lineno):
-            if name in arguments:
-                self.error(
-                    line=lineno,
-                    message="Image: Ignoring repeated argument: {}.".format(name),
-                    )
-                continue
-            if (
-                    name == "scale" and not length_names.isdisjoint(arguments)
-                ) or (
-                    name in length_names and "scale" in arguments
-                ):
-                self.error(
-                    line=lineno,
-                    message=(
-                        "Image: Ignoring '{}' argument: Cannot mix scale and "
-                        "width or height argument."
-                        ).format(name),
-                    )
-                continue
-            arguments.add(name)
-            yield name, value, unit
-
     def p_directive(self, symbols):
         """directive : LBRACE KEYWORD directive_next RBRACE
                      | LBRACE SPACE KEYWORD directive_next RBRACE
         """
-        # pylint: disable=too-many-branches
         if len(symbols) == 5:
             keyword = symbols[2]
             argument = symbols[3]
         else:
             keyword = symbols[3]
             argument = symbols[4]
+        symbols[0] = self._directive(keyword, argument, lineno=symbols.lexer.lineno)
 
-        if keyword == "define":
-            match = re.compile(
-                r"""
-                    ^
-                    (?P<key>[^\ ]*)\ *
-                    (base-fret\ *(?P<basefret>\d{1,2}))?\ *
-                    frets\ *(?P<frets>((\d+|x|X)\ *)+)\ *
-                    (fingers\ *(?P<fingers>(([0-4-])\ *)*))?
-                    $
-                """,
-                re.VERBOSE
-                ).match(argument)
-
-            if match is None:
-                if argument.strip():
-                    self.error(
-                        line=symbols.lexer.lineno,
-                        message="Invalid chord definition '{}'.".format(argument),
-                        )
-                else:
-                    self.error(
-                        line=symbols.lexer.lineno,
-                        message="Invalid empty chord definition.",
-                        )
-                symbols[0] = ast.Error()
-                return
-
-            define = self._parse_define(match.groupdict())
-            if define is None:
-                self.error(
-                    line=symbols.lexer.lineno,
-                    message="Invalid chord definition '{}'.".format(argument),
-                    )
-                symbols[0] = ast.Error()
-                return
-            self._directives.append(define)
-        elif keyword == "image":
-            splitted = shlex.split(argument)
-            if len(splitted) < 1:
-                self.error(
-                    line=symbols.lexer.lineno,
-                    message="Missing filename for image directive",
-                    )
-                symbols[0] = ast.Error()
-            else:
-                symbols[0] = ast.Image(
-                    splitted[0],
-                    list(
-                        self._iter_image_size_arguments(splitted[1:], lineno=symbols.lexer.lineno)
-                        ),
-                    )
-        else:
-            directive = ast.Directive(keyword, argument)
-            if directive.inline:
-                symbols[0] = directive
-            else:
-                self._directives.append(directive)
+    def _directive(self, keyword, argument, *, lineno):
+        """Process directive `{keyword: argument}`.
 
+        Arguments of some directives are parsed by the functions of
+        :attr:`directive_parsers` (see :data:`CHORDPRO_DIRECTIVES`).
+        Metadata directives are stored, to be added to the song at the end of
+        parsing. Return the object to insert in the line: an inline directive,
+        an :class:`ast.Error`, or `None`.
+        """
+        if keyword in self.directive_parsers:
+            directive = self.directive_parsers[keyword](self, argument, lineno=lineno)
+        else:
+            directive = ast.Directive(keyword, argument, lineno=lineno)
+        if isinstance(directive, ast.Directive) and not directive.inline:
+            self._directives.append(directive)
+            return None
+        return directive
 
     @staticmethod
     def p_directive_next(symbols):
@@ -283,7 +149,7 @@ class ChordproParser(Parser):
             line=symbols.lexer.lineno,
             message="Directive can only be preceded or followed by spaces",
             )
-        symbols[0] = ast.Line()
+        symbols[0] = ast.Line(lineno=symbols.lexer.lineno).finalize()
 
     @staticmethod
     def p_line(symbols):
@@ -294,15 +160,15 @@ class ChordproParser(Parser):
         """
         if isinstance(symbols[2], ast.Line):
             # Line with words, etc.
-            symbols[0] = symbols[2].prepend(symbols[1])
+            symbols[0] = symbols[2].prepend(symbols[1]).finalize()
         else:
             # Directive
             if symbols[1] is None:
                 # Meta directive. Nothing to do
-                symbols[0] = ast.Line()
+                symbols[0] = ast.Line(lineno=symbols.lexer.lineno).finalize()
             else:
                 # Inline directive
-                symbols[0] = ast.Line(symbols[1])
+                symbols[0] = ast.Line(symbols[1], lineno=symbols.lexer.lineno).finalize()
 
     @staticmethod
     def p_line_next(symbols):
@@ -313,24 +179,28 @@ class ChordproParser(Parser):
                      | empty
         """
         if len(symbols) == 2:
-            symbols[0] = ast.Line()
+            symbols[0] = ast.Line(lineno=symbols.lexer.lineno)
         else:
             symbols[0] = symbols[2].prepend(symbols[1])
 
     @staticmethod
     def p_word(symbols):
         """word : WORD"""
-        symbols[0] = ast.Word(symbols[1])
+        symbols[0] = ast.Word(symbols[1], lineno=symbols.lexer.lineno)
 
     @staticmethod
     def p_space(symbols):
         """space : SPACE"""
-        symbols[0] = ast.Space()
+        symbols[0] = ast.Space(lineno=symbols.lexer.lineno)
 
     @staticmethod
     def p_chord(symbols):
         """chord : CHORD"""
-        symbols[0] = ast.ChordList(*[ast.Chord(chord) for chord in symbols[1].split()])
+        lineno = symbols.lexer.lineno
+        symbols[0] = ast.ChordList(
+            *[ast.Chord(chord, lineno=lineno) for chord in symbols[1].split()],
+            lineno=lineno
+            )
 
     @staticmethod
     def p_chorus(symbols):
@@ -346,7 +216,7 @@ class ChordproParser(Parser):
                           | empty
         """
         if len(symbols) == 2:
-            symbols[0] = ast.Chorus()
+            symbols[0] = ast.Chorus(lineno=symbols.lexer.lineno)
         elif len(symbols) == 3:
             symbols[0] = symbols[2]
         else:
@@ -366,7 +236,7 @@ class ChordproParser(Parser):
                           | empty
         """
         if len(symbols) == 2:
-            symbols[0] = ast.Bridge()
+            symbols[0] = ast.Bridge(lineno=symbols.lexer.lineno)
         elif len(symbols) == 3:
             symbols[0] = symbols[2]
         else:
@@ -376,7 +246,7 @@ class ChordproParser(Parser):
     def p_echo(symbols):
         """echo : SE line_next EE
         """
-        symbols[0] = ast.Echo(symbols[2])
+        symbols[0] = ast.Echo(symbols[2].finalize(), lineno=symbols.lexer.lineno)
 
     @staticmethod
     def p_tab(symbols):
@@ -392,7 +262,7 @@ class ChordproParser(Parser):
                        | empty
         """
         if len(symbols) == 2:
-            symbols[0] = ast.Tab()
+            symbols[0] = ast.Tab(lineno=symbols.lexer.lineno)
         else:
             if symbols[1].strip():
                 symbols[2].prepend(symbols[1])
@@ -413,6 +283,235 @@ class ChordproParser(Parser):
             self.parser.errok()
         return token
 
-def parse_song(content, filename=None):
-    """Parse song and return its metadata."""
-    return ChordproParser(filename).parse(content)
+#: Arguments of the `define` directive
+_DEFINE = re.compile(
+    r"""
+        ^
+        (?P<key>[^\ ]*)\ *
+        (base-fret\ *(?P<basefret>\d{1,2}))?\ *
+        frets\ *(?P<frets>((\d+|x|X)\ *)+)\ *
+        (fingers\ *(?P<fingers>(([0-4-])\ *)*))?
+        $
+    """,
+    re.VERBOSE
+    )
+
+#: Values of the `width` and `height` arguments of the `image` directive
+_IMAGE_LENGTH = re.compile(r"^(?P<value>(\d*\.\d+|\d+))(?P<unit>cm|em|pt)$")
+
+#: Values of the `scale` argument of the `image` directive
+_IMAGE_SCALE = re.compile(r"^(?P<value>(\d*\.\d+|\d+))$")
+
+#: Characters having a special meaning for :func:`shlex.split`
+_SHELL_SPECIAL = re.compile(r"""['"\\]""")
+
+#: Words of a string, as split by :func:`shlex.split` (if the string does not
+#: contain any special character).
+_SHELL_WORD = re.compile(r"[^\ \t\r\n]+")
+
+def _parse_define(parser, argument, *, lineno):
+    """Parse a `{define: KEY base-fret BASE frets FRETS fingers FINGERS}` directive
+
+    Return a :class:`ast.Define` object (or an :class:`ast.Error` object).
+    """
+    # pylint: disable=too-many-branches
+    if argument is None:
+        argument = ""
+    match = _DEFINE.match(argument)
+    if match is None:
+        if argument.strip():
+            parser.error(
+                line=lineno,
+                message="Invalid chord definition '{}'.".format(argument),
+                )
+        else:
+            parser.error(
+                line=lineno,
+                message="Invalid empty chord definition.",
+                )
+        return ast.Error(lineno=lineno)
+
+    groups = match.groupdict()
+    if not groups['key'].strip():
+        parser.error(
+            line=lineno,
+            message="Invalid chord definition '{}'.".format(argument),
+            )
+        return ast.Error(lineno=lineno)
+    else:
+        key = ast.Chord(groups['key'].strip(), lineno=lineno)
+
+    if groups['basefret'] is None:
+        basefret = None
+    else:
+        basefret = int(groups['basefret'])
+
+    if groups['frets'] is None:
+        frets = None
+    else:
+        frets = []
+        for fret in groups['frets'].split():
+            if fret in "xX":
+                frets.append(None)
+            else:
+                frets.append(int(fret))
+
+    if groups['fingers'] is None:
+        fingers = None
+    else:
+        fingers = []
+        for finger in groups['fingers'].split():
+            if finger == '-':
+                fingers.append(None)
+            else:
+                fingers.append(int(finger))
+
+    return ast.Define(
+        key=key,
+        basefret=basefret,
+        frets=frets,
+        fingers=fingers,
+        lineno=lineno,
+        )
+
+def _iter_raw_image_size_arguments(parser, arguments, *, lineno):
+    """Iterate over the `(name, value, unit)` size arguments of an image."""
+    for item in arguments:
+        prefix, _, suffix = item.partition("=")
+        if prefix in ['width', 'height']:
+            match = _IMAGE_LENGTH.match(suffix)
+            if match is not None:
+                yield (prefix, match.groupdict()['value'], match.groupdict()['unit'])
+                continue
+        elif prefix in ['scale']:
+            match = _IMAGE_SCALE.match(suffix)
+            if match is not None:
+                yield (prefix, match.groupdict()['value'], "")
+                continue
+        else:
+            parser.error(
+                line=lineno,
+                message="Image: Unknown argument name '{}'.".format(prefix),
+            )
+            continue
+        parser.error(
+            line=lineno,
+            message="Image: Unsupported {} value: '{}'.".format(prefix, suffix),
+        )
+
+def _iter_image_size_arguments(parser, argument, *, lineno):
+    """Iterate over the valid `(name, value, unit)` size arguments of an image."""
+    arguments = set()
+    length_names = frozenset(["width", "height"])
+    for name, value, unit in _iter_raw_image_size_arguments(parser, argument, lineno=lineno):
+        if name in arguments:
+            parser.error(
+                line=lineno,
+                message="Image: Ignoring repeated argument: {}.".format(name),
+                )
+            continue
+        if (
+                name == "scale" and not length_names.isdisjoint(arguments)
+            ) or (
+                name in length_names and "scale" in arguments
+            ):
+            parser.error(
+                line=lineno,
+                message=(
+                    "Image: Ignoring '{}' argument: Cannot mix scale and "
+                    "width or height argument."
+                    ).format(name),
+                )
+            continue
+        arguments.add(name)
+        yield name, value, unit
+
+def _parse_image(parser, argument, *, lineno):
+    """Parse a `{image: FILENAME SIZE...}` directive
+
+    Return a :class:`ast.Image` object (or an :class:`ast.Error` object).
+    """
+    if argument is None:
+        argument = ""
+    if _SHELL_SPECIAL.search(argument) is None:
+        splitted = _SHELL_WORD.findall(argument)
+    else:
+        splitted = shlex.split(argument)
+    if len(splitted) < 1:
+        parser.error(
+            line=lineno,
+            message="Missing filename for image directive",
+            )
+        return ast.Error(lineno=lineno)
+    return ast.Image(
+        splitted[0],
+        list(_iter_image_size_arguments(parser, splitted[1:], lineno=lineno)),
+        lineno=lineno,
+        )
+
+#: Parsers of the arguments of directives, as functions `(parser, argument, *,
+#: lineno)`. They return the node to insert in the song (an inline or a
+#: metadata directive, an :class:`ast.Error`, or `None`), and may report
+#: errors using `parser.error()`. Other directives are plain
+#: :class:`ast.Directive` objects.
+#:
+#: Datadir plugins can add parsers for other directives: see
+#: :func:`patacrep.files.load_directive_plugins`.
+CHORDPRO_DIRECTIVES = {
+    "define": _parse_define,
+    "image": _parse_image,
+    }
+
+#: Available parsing engines:
+#: - ply: :class:`ChordproParser`;
+#: - fast: :class:`patacrep.songs.chordpro.scanner.FastChordproParser`.
+ENGINES = ("ply", "fast")
+
+# Parsers of the current thread, indexed by engine
+_PARSERS = threading.local()
+
+def _cached_parser(engine="ply"):
+    """Return a parser shared by all songs parsed by the current thread.
+
+    Building the parsing tables is much more expensive than parsing a song.
+    Parsers hold the state of the song being parsed: each thread has its own
+    parsers, so that songs can be parsed concurrently.
+    """
+    parser = getattr(_PARSERS, engine, None)
+    if parser is None:
+        if engine == "fast":
+            # pylint: disable=cyclic-import
+            from patacrep.songs.chordpro.scanner import FastChordproParser
+            parser = FastChordproParser()
+        else:
+            parser = ChordproParser()
+        setattr(_PARSERS, engine, parser)
+    return parser
+
+def parse_song(content, filename=None, *, engine="ply", directives=None):
+    """Parse song and return its metadata.
+
+    Arguments:
+    - engine: one of :data:`ENGINES`;
+    - directives: the parsers of directive arguments (default is
+      :data:`CHORDPRO_DIRECTIVES`).
+    """
+    if engine not in ENGINES:
+        raise ValueError("Unknown ChordPro parsing engine '{}'.".format(engine))
+    parser = _cached_parser(engine)
+    parser.filename = filename
+    parser.directive_parsers = CHORDPRO_DIRECTIVES if directives is None else directives
+    return parser.parse(content)
+
+def parse_header(content, filename=None, *, directives=None):
+    """Parse the metadata of a song (but not its content).
+
+    Return a song without content, or `None` if the whole song has to be
+    parsed to know its metadata (see
+    :meth:`scanner.FastChordproParser.parse_header`). Argument `directives`
+    is the same as in :func:`parse_song`.
+    """
+    parser = _cached_parser("fast")
+    parser.filename = filename
+    parser.directive_parsers = CHORDPRO_DIRECTIVES if directives is None else directives
+    return parser.parse_header(content)
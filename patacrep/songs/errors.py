@@ -6,6 +6,9 @@ class SongError(SharedError):
     """Generic song error"""
     # pylint: disable=too-few-public-methods
 
+    #: Keys of :attr:`__dict__` used as arguments (with the song) to rebuild the error.
+    _arguments = ('message',)
+
     def __init__(self, song, message):
         super().__init__()
         self.song = song
@@ -31,10 +34,20 @@ class SongError(SharedError):
             })
         return parent
 
+    @classmethod
+    def from_dict(cls, song, data):
+        """Rebuild an error of `song`, from its dictionary representation.
+
+        The dictionary representation is the one returned by `vars(error)`.
+        """
+        return cls(song, **{key: data.get(key) for key in cls._arguments})
+
 class SongSyntaxError(SongError):
     """Syntax error"""
     # pylint: disable=too-few-public-methods
 
+    _arguments = ('line', 'message')
+
     def __init__(self, song, line, message):
         super().__init__(song, message)
         #: Line of error. May be `None` if irrelevant.
@@ -58,6 +71,8 @@ class SongSyntaxError(SongError):
 class FileNotFound(SongError):
     """File not found error"""
 
+    _arguments = ('filename',)
+
     def __init__(self, song, filename):
         super().__init__(song, "File '{}' not found.".format(filename))
         self.filename = filename
@@ -73,6 +88,8 @@ class FileNotFound(SongError):
 class SongUnknownLanguage(SongError):
     """Song language is not known."""
 
+    _arguments = ('original', 'fallback', 'message')
+
     def __init__(self, song, original, fallback, message):
         super().__init__(song, message)
         self.original = original
@@ -86,3 +103,21 @@ class SongUnknownLanguage(SongError):
             'fallback': self.fallback,
             })
         return parent
+
+def _iter_error_classes(cls=SongError):
+    """Iterate over `cls` and its subclasses (recursively)."""
+    yield cls
+    for subclass in cls.__subclasses__():
+        yield from _iter_error_classes(subclass)
+
+def from_dict(song, data):
+    """Rebuild an error of `song`, from its dictionary representation.
+
+    The dictionary representation is the one returned by `vars(error)`. It
+    contains only standard python types, so it can be cached (which errors
+    cannot, because of https://bugs.python.org/issue1692335).
+    """
+    for cls in _iter_error_classes():
+        if cls.__name__ == data['type']:
+            return cls.from_dict(song, data)
+    return SongError(song, data['message'])
@@ -0,0 +1,74 @@
+"""Per-process registry of songs.
+
+A song may be included several times in a songbook (e.g. by a `sort` block,
+and by a themed `section`), and the same process may build several
+songbooks. The registry reads the metadata of each song once per process
+(from the cache, or by parsing it): songs are identified by their path, the
+status of their file (which changes when the song is edited), and the
+fingerprint of the configuration (see
+:meth:`patacrep.songs.Song.config_fingerprint`). At most :data:`MAX_SONGS`
+songs are registered (the least recently used ones are forgotten).
+
+Songs are handed out as copies (see :meth:`patacrep.songs.Song.bind`), bound
+to the configuration of the caller: errors found when rendering one of them,
+or releasing its content, do not change the other ones. The registry only
+keeps song metadata: the content of a song is kept by the copy it was parsed
+for (until it is released), and the other copies retrieve it from the cache
+(or parse it again, if the cache is disabled).
+"""
+
+import collections
+import os
+import threading
+
+#: Maximum number of registered songs.
+MAX_SONGS = 10000
+
+# Registered songs, least recently used first: keys are `(renderer, fullpath,
+# subpath, fingerprint)` tuples; values are `(signature, song)` tuples.
+_SONGS = collections.OrderedDict()
+_LOCK = threading.Lock()
+
+def _signature(path):
+    """Return the signature of the status of file `path` (changed when the file is edited)."""
+    stat = os.stat(path)
+    return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+def get_song(renderer, subpath, config, *, datadir=None):
+    """Return song `subpath` (of `datadir`), read by class `renderer`.
+
+    The arguments are the arguments of the `renderer` constructor. The
+    metadata of the song is read once per process, as long as its file does
+    not change (and the song is not forgotten, see :data:`MAX_SONGS`).
+    """
+    fullpath = os.path.abspath(os.path.join(datadir or "", subpath))
+    try:
+        signature = _signature(fullpath)
+    except OSError:
+        # Let the song report the error
+        return renderer(subpath, config, datadir=datadir)
+    key = (renderer, fullpath, subpath, renderer.config_fingerprint(config))
+
+    with _LOCK:
+        registered = _SONGS.get(key)
+        if registered is not None:
+            _SONGS.move_to_end(key)
+    if registered is not None and registered[0] == signature:
+        return registered[1].bind(config)
+
+    song = renderer(subpath, config, datadir=datadir)
+    # The content (if it has been parsed) is kept by the returned copy only:
+    # the registered song does not keep it in memory.
+    bound = song.bind(config)
+    song.release()
+    with _LOCK:
+        _SONGS[key] = (signature, song)
+        _SONGS.move_to_end(key)
+        while len(_SONGS) > MAX_SONGS:
+            _SONGS.popitem(last=False)
+    return bound
+
+def clear():
+    """Forget all the registered songs."""
+    with _LOCK:
+        _SONGS.clear()
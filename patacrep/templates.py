@@ -1,42 +1,58 @@
 """Template for .tex generation settings and utilities"""
 
+import functools
+import hashlib
 import logging
+import os
+import pickle
 import re
+import shutil
 import urllib
 
 import yaml
 
-from jinja2 import Environment, FileSystemLoader, ChoiceLoader, \
+import jinja2
+from jinja2 import Environment, FileSystemLoader, ChoiceLoader, ModuleLoader, \
         TemplateNotFound, nodes
 from jinja2.ext import Extension
+from jinja2.loaders import split_template_path
 from jinja2.meta import find_referenced_templates
 
 from patacrep import errors, files, utils
 from patacrep.latex import lang2babel, UnknownLanguage
+from patacrep.songs import cache
 import patacrep.encoding
 
 LOGGER = logging.getLogger(__name__)
 
-_VARIABLE_REGEXP = re.compile(
-    r"""
-    \(\*-?\ *variables\ *\*\)    # Match (* variables *) or (*- variables *)
-    (                            # Match and capture the following:
-    (?:                          # Start of non-capturing group, used to match a single character
-    (?!                          # only if it's impossible to match the following:
-    \(\*-?\ *                    # - a literal (* or (*-
-    (?:                          # Inner non-capturing group, used for the following alternation:
-    variables                    # - Either match the word variables
-    |                            # or
-    endvariables                 # - the word endvariables
-    )                            # End of inner non-capturing group
-    \ *-?\*\)                    # - a literal *) or -*)
-    )                            # End of negative lookahead assertion
-    .                            # Match any single character
-    )*                           # Repeat as often as possible
-    )                            # End of capturing group 1
-    \(\*\ *endvariables\ *-?\*\) # until (* endvariables *) or (* endvariables -*) is matched.
-    """,
-    re.VERBOSE|re.DOTALL)
+#: Tags starting and ending blocks of variables (with optional whitespace
+#: control signs): `(* variables *)` and `(* endvariables *)`.
+_VARIABLES_TAG = re.compile(
+    r"\(\*(?P<before>-?)\ *(?P<keyword>variables|endvariables)\ *(?P<after>-?)\*\)"
+    )
+
+def _iter_variables_blocks(content):
+    """Iterate over the content of the blocks of variables of a template.
+
+    Blocks start with `(* variables *)` or `(*- variables *)`, end with
+    `(* endvariables *)` or `(* endvariables -*)`, and do not contain any
+    other tag of variables. Tags are found in a single pass over `content`.
+
+    >>> list(_iter_variables_blocks(
+    ...     "(* variables *)a(* endvariables -*)(* variables *)b(*- variables *)c(* endvariables *)"
+    ...     ))
+    ['a', 'c']
+    """
+    start = None
+    for tag in _VARIABLES_TAG.finditer(content):
+        if tag.group("keyword") == "variables" and not tag.group("after"):
+            start = tag.end()
+        elif tag.group("keyword") == "endvariables" and not tag.group("before"):
+            if start is not None:
+                yield content[start:tag.start()]
+            start = None
+        else:
+            start = None
 
 TRANSLATION_MAP = {
     '{': r'\{',
@@ -60,29 +76,190 @@ TRANSLATION_MAP_URL = {
     '&': '\\&',
     }
 
-def _escape_specials(text, *, chars=None, translation_map=None):
-    '''Escape TeX special characters'''
-    if translation_map is None:
-        translation_map = TRANSLATION_MAP
+#: Cache of translation tables, used by :func:`translation_table`.
+_TRANSLATION_TABLES = {}
+
+def translation_table(translation_map, chars=None):
+    """Return the table used by `str.translate()` to escape characters.
+
+    Arguments:
+    - translation_map: dictionary of characters, and their escaped value;
+    - chars: characters to escape (all characters of `translation_map` if `None`).
+
+    Tables are cached (and shared by the songbook and the songs), keyed by
+    the identity of `translation_map` (which is not expected to change), and
+    `chars`.
+
+    >>> translation_table(TRANSLATION_MAP, "%&") is translation_table(TRANSLATION_MAP, "%&")
+    True
+    """
+    cachekey = (id(translation_map), chars)
+    try:
+        return _TRANSLATION_TABLES[cachekey][1]
+    except KeyError:
+        pass
+    except TypeError:
+        # `chars` is not hashable: the table is not cached.
+        cachekey = None
     if chars is None:
         chars = translation_map.keys()
-    return str(text).translate(str.maketrans({
+    table = str.maketrans({
         key: value
         for key, value in translation_map.items()
         if key in chars
-        }))
+        })
+    if cachekey is not None:
+        # `translation_map` is kept, so that its id is not reused.
+        _TRANSLATION_TABLES[cachekey] = (translation_map, table)
+    return table
+
+def escape_specials(text, chars=None, *, translation_map=None):
+    """Escape TeX special characters
+
+    Arguments:
+    - text: text to escape (converted to a string if necessary);
+    - chars: characters to escape (all characters of `translation_map` if `None`);
+    - translation_map: dictionary of characters, and their escaped value
+      (default is :data:`TRANSLATION_MAP`).
+
+    >>> print(escape_specials("50% & {more}", "%&"))
+    50\\% \\& {more}
+    """
+    if translation_map is None:
+        translation_map = TRANSLATION_MAP
+    if not isinstance(text, str):
+        text = str(text)
+    return text.translate(translation_table(translation_map, chars))
 
 def _escape_url(text):
     """Escape TeX special characters, in url."""
-    return _escape_specials(text, translation_map=TRANSLATION_MAP_URL)
+    return escape_specials(text, translation_map=TRANSLATION_MAP_URL)
 
 DEFAULT_FILTERS = {
-    "escape_specials": _escape_specials,
+    "escape_specials": escape_specials,
     "escape_url": _escape_url,
     "iter_datadirs": files.iter_datadirs,
     "path2posix": files.path2posix,
     }
 
+#: Name of the directory of template caches (compiled templates, and
+#: variables of templates), in the cache directory.
+CACHE_DIRNAME = "templates"
+
+#: Name of the file storing the fingerprint of compiled templates.
+FINGERPRINT_FILENAME = "fingerprint"
+
+def configure_environment(jinjaenv):
+    """Set the syntax of patacrep templates on jinja2 environment `jinjaenv`."""
+    jinjaenv.block_start_string = '(*'
+    jinjaenv.block_end_string = '*)'
+    jinjaenv.variable_start_string = '(('
+    jinjaenv.variable_end_string = '))'
+    jinjaenv.comment_start_string = '(% comment %)'
+    jinjaenv.comment_end_string = '(% endcomment %)'
+    jinjaenv.line_comment_prefix = '%!'
+    jinjaenv.trim_blocks = True
+    jinjaenv.lstrip_blocks = True
+
+def compiled_path(datadirs, searchpath):
+    """Return the directory of the compiled templates of `searchpath`.
+
+    Arguments:
+    - datadirs: list of datadirs: templates are compiled in the cache
+      directory of the first one;
+    - searchpath: list of directories templates are loaded from.
+
+    Return `None` if there is no datadir.
+    """
+    if not datadirs:
+        return None
+    return os.path.join(
+        cache.cache_dir(datadirs[0]),
+        CACHE_DIRNAME,
+        hashlib.sha1("\n".join(searchpath).encode("utf8")).hexdigest(),
+        )
+
+def _fingerprint(searchpath):
+    """Return the fingerprint of the templates of `searchpath`.
+
+    It changes when a template is added, removed or changed (or when
+    patacrep or jinja2 is upgraded).
+    """
+    state = [patacrep.__version__, jinja2.__version__]
+    for directory in searchpath:
+        state.append(directory)
+        for root, _, filenames in sorted(os.walk(directory)):
+            for filename in sorted(filenames):
+                stat = os.stat(os.path.join(root, filename))
+                state.append("{} {} {}".format(
+                    os.path.join(root, filename),
+                    stat.st_size,
+                    stat.st_mtime_ns,
+                    ))
+    return hashlib.sha1("\n".join(state).encode("utf8")).hexdigest()
+
+def compiled_loader(datadirs, searchpath):
+    """Return a loader of the compiled templates of `searchpath`.
+
+    Return `None` if templates have not been compiled (see
+    :func:`compile_templates`), or if they have changed since then.
+    """
+    path = compiled_path(datadirs, searchpath)
+    if path is None:
+        return None
+    try:
+        with open(os.path.join(path, FINGERPRINT_FILENAME)) as fingerprint:
+            if fingerprint.read() != _fingerprint(searchpath):
+                LOGGER.info(
+                    "Templates have changed since they were compiled in '%s'.",
+                    path,
+                    )
+                return None
+    except OSError:
+        return None
+    return ModuleLoader(path)
+
+class _AnyFilter(dict):
+    """Filters of an environment used to compile templates.
+
+    Some filters are only known when templates are rendered: any filter is
+    accepted when compiling templates (they are looked up again when
+    templates are rendered).
+    """
+
+    def get(self, key, default=None):
+        return super().get(key, _unknown_filter)
+
+def _unknown_filter(value, *args, **kwargs): # pylint: disable=unused-argument
+    """Filter known when templates are rendered."""
+    return value
+
+def compile_templates(datadirs, searchpath, *, extensions=()):
+    """Compile templates of `searchpath` to Python modules.
+
+    Arguments:
+    - datadirs: list of datadirs: templates are compiled in the cache
+      directory of the first one;
+    - searchpath: list of directories templates are loaded from;
+    - extensions: jinja2 extensions used by those templates.
+
+    Compiled templates are loaded by :func:`compiled_loader`. Return the
+    directory they are compiled in (or `None` if there is no datadir).
+    """
+    path = compiled_path(datadirs, searchpath)
+    if path is None:
+        return None
+    jinjaenv = Environment(loader=FileSystemLoader(searchpath), extensions=extensions)
+    configure_environment(jinjaenv)
+    jinjaenv.filters = _AnyFilter(jinjaenv.filters)
+    fingerprint = _fingerprint(searchpath)
+    shutil.rmtree(path, ignore_errors=True)
+    jinjaenv.compile_templates(path, zip=None, log_function=LOGGER.debug)
+    # Written last: templates are not used if their compilation is interrupted.
+    with open(os.path.join(path, FINGERPRINT_FILENAME), "w") as fingerprintfile:
+        fingerprintfile.write(fingerprint)
+    return path
+
 class VariablesExtension(Extension):
     """Extension to jinja2 to silently ignore variable block.
     Instead, they are parsed by this module.
@@ -107,15 +284,7 @@ class Renderer:
         self.errors = []
         self.encoding = encoding
         self.jinjaenv = jinjaenv
-        self.jinjaenv.block_start_string = '(*'
-        self.jinjaenv.block_end_string = '*)'
-        self.jinjaenv.variable_start_string = '(('
-        self.jinjaenv.variable_end_string = '))'
-        self.jinjaenv.comment_start_string = '(% comment %)'
-        self.jinjaenv.comment_end_string = '(% endcomment %)'
-        self.jinjaenv.line_comment_prefix = '%!'
-        self.jinjaenv.trim_blocks = True
-        self.jinjaenv.lstrip_blocks = True
+        configure_environment(self.jinjaenv)
         # Fill default filters
         for key, value in self.filters().items():
             if key not in self.jinjaenv.filters:
@@ -144,10 +313,34 @@ class Renderer:
             self.errors.append(error)
             return error.babel
 
+def _source_loader(searchpath):
+    """Return a loader of templates (as source code) from `searchpath`."""
+    return ChoiceLoader([FileSystemLoader(directory) for directory in searchpath])
+
+@functools.lru_cache()
+def _book_environment(datadirs, searchpath, extensions):
+    """Return a jinja2 environment loading songbook templates from `searchpath`.
+
+    Templates compiled in the cache of `datadirs` (see
+    :meth:`TexBookRenderer.compile_templates`) are used if they are up to
+    date; templates are loaded from the filesystem otherwise.
+
+    Environments are shared between songbooks, so that songbooks built by the
+    same process compile each template once.
+    """
+    loaders = [_source_loader(searchpath)]
+    compiled = compiled_loader(datadirs, searchpath)
+    if compiled is not None:
+        loaders.insert(0, compiled)
+    return Environment(loader=ChoiceLoader(loaders), extensions=list(extensions))
+
 class TexBookRenderer(Renderer):
     """Tex renderer for the whole songbook"""
 
-    def __init__(self, template, datadirs, lang, encoding=None):
+    #: Jinja2 extensions used by songbook templates.
+    extensions = [VariablesExtension]
+
+    def __init__(self, template, datadirs, lang, encoding=None, *, cache=False):
         '''Start a new jinja2 environment for .tex creation.
 
         Arguments:
@@ -156,41 +349,47 @@ class TexBookRenderer(Renderer):
           (which may contain file <datadir>/templates/<template>).
         - lang: main language of songbook.
         - encoding: if set, encoding of the template.
+        - cache: if true, variables of templates are cached (in the cache
+          directory of the first datadir).
         '''
         self.lang = lang
-        # Load templates in filesystem ...
-        loaders = [
-            FileSystemLoader(datadir)
-            for datadir in files.iter_datadirs(datadirs, 'templates', 'songbook')
-            ]
-        jinjaenv = Environment(
-            loader=ChoiceLoader(loaders),
-            extensions=[VariablesExtension],
-            )
+        self.datadirs = datadirs
+        self.use_cache = cache
+        searchpath = self.searchpath(datadirs)
+        self._searchpath = searchpath
+        self._source_loader = _source_loader(searchpath)
+        jinjaenv = _book_environment(tuple(datadirs), tuple(searchpath), tuple(self.extensions))
         try:
             super().__init__(template, jinjaenv, encoding)
         except TemplateNotFound as exception:
-            # Only works if all loaders are FileSystemLoader().
-            paths = [
-                item
-                for loader in self.jinjaenv.loader.loaders
-                for item in loader.searchpath
-                ]
             raise errors.TemplateError(
                 exception,
                 errors.notfound(
                     exception.name,
-                    paths,
+                    searchpath,
                     message='Template "{name}" not found in {paths}.'
                     ),
                 )
+        # The environment is shared between songbooks: filters bound to this
+        # renderer have to be set again.
+        self.jinjaenv.filters.update(self.filters())
+
+    @staticmethod
+    def searchpath(datadirs):
+        """Return the list of directories songbook templates are loaded from."""
+        return list(files.iter_datadirs(datadirs, 'templates', 'songbook'))
+
+    @classmethod
+    def compile_templates(cls, datadirs):
+        """Compile songbook templates (see :func:`compile_templates`)."""
+        return compile_templates(datadirs, cls.searchpath(datadirs), extensions=cls.extensions)
 
     def get_all_variables(self, user_config):
         '''Validate template variables (and set defaults when needed)
 
         Will raise `SchemaError` if any data does not respect the schema
         '''
-        data = self.get_template_variables(self.template)
+        data = self.get_template_variables(self.template.name)
         variables = dict()
         for templatename, param in data.items():
             template_config = user_config.get(templatename, {})
@@ -230,15 +429,32 @@ class TexBookRenderer(Renderer):
         Arguments:
         - basetemplate: the name of the template, as a string.
           in 'template' (or one of its subtemplates), it is not parsed.
+
+        Variables are cached (if cache is enabled), until any of those
+        templates is changed (or overridden in a datadir).
         """
+        cachename = self._variables_cached_name(basetemplate)
+        if cachename is not None:
+            try:
+                cached = cache.load(cachename)
+                if all(
+                        self._template_state(templatename) == state
+                        for templatename, state in cached['templates'].items()
+                    ):
+                    return cached['variables']
+            except (
+                    OSError, cache.CorruptedCacheError,
+                    pickle.UnpicklingError, EOFError, KeyError, AttributeError,
+                ):
+                pass
+
         variables = {}
-        for templatename, template in self._iter_template_content(basetemplate):
-            match = re.findall(_VARIABLE_REGEXP, template)
-            if not match:
-                continue
-            if templatename not in variables:
-                variables[templatename] = {}
-            for variables_string in match:
+        templates = {}
+        for templatename, filename, template in self._iter_template_content(basetemplate):
+            templates[templatename] = self._template_state(templatename)
+            for variables_string in _iter_variables_blocks(template):
+                if templatename not in variables:
+                    variables[templatename] = {}
                 try:
                     variables[templatename].update(
                         yaml.safe_load(variables_string))
@@ -250,19 +466,63 @@ class TexBookRenderer(Renderer):
                             "{filename}. The yaml string was:"
                             "\n'''\n{yamlstring}\n'''"
                         ).format(
-                            filename=template.filename,
+                            filename=filename,
                             yamlstring=variables_string,
                             )
                         )
+
+        if cachename is not None:
+            try:
+                os.makedirs(os.path.dirname(cachename), exist_ok=True)
+                cache.dump({'templates': templates, 'variables': variables}, cachename)
+            except OSError as error:
+                LOGGER.debug("Cannot write cache '%s': %s", cachename, error)
         return variables
 
+    def _variables_cached_name(self, basetemplate):
+        """Return the name of the cache file of variables of `basetemplate`.
+
+        Return `None` if cache is disabled.
+        """
+        if not (self.use_cache and self.datadirs):
+            return None
+        key = "\n".join([patacrep.__version__, str(self.encoding), basetemplate] + self._searchpath)
+        return os.path.join(
+            cache.cache_dir(self.datadirs[0]),
+            CACHE_DIRNAME,
+            "variables",
+            hashlib.sha1(key.encode("utf8")).hexdigest(),
+            )
+
+    def _template_state(self, templatename):
+        """Return the state of the files `templatename` can be loaded from.
+
+        This is the list of the size and modification time of file
+        `templatename` in each directory of the search path (or `None` if it
+        does not exist there). It changes if the template is changed, or
+        overridden in another directory.
+        """
+        pieces = split_template_path(templatename)
+        state = []
+        for directory in self._searchpath:
+            try:
+                stat = os.stat(os.path.join(directory, *pieces))
+                state.append((stat.st_size, stat.st_mtime_ns))
+            except OSError:
+                state.append(None)
+        return state
+
     def _iter_template_content(self, templatename, *, skip=None):
-        """Iterate over template (and subtemplate) content."""
+        """Iterate over template (and subtemplate) content.
+
+        Yield tuples `(templatename, filename, content)`.
+        """
         if skip is None:
             skip = []
-        template = self.jinjaenv.get_template(templatename)
+        # Compiled templates do not give access to their source
+        _, filename, _ = self._source_loader.get_source(self.jinjaenv, templatename)
         with patacrep.encoding.open_read(
-            template.filename,
+            filename,
             encoding=self.encoding
             ) as contentfile:
             content = contentfile.read()
@@ -272,7 +532,7 @@ class TexBookRenderer(Renderer):
                         subtemplatename,
                         skip=skip + [templatename],
                         )
-            yield template.name, content
+            yield templatename, filename, content
 
     def render_tex(self, output, context):
         '''Render a template into a .tex file
@@ -0,0 +1,257 @@
+"""Precompile the preamble of songbooks into LaTeX formats.
+
+Loading the packages of the preamble (`patacrep.sty`, `songs.sty`, fonts,
+etc.) takes most of the time of a LaTeX compilation of a small songbook. The
+songbook templates end the part of the preamble which does not depend on the
+songbook content with the :data:`MARKER` line. This part is dumped (once) into
+a format file, and the following compilations start from this format, reading
+the rest of the `.tex` file (written in `<basename>_body.tex`) only.
+
+Formats are cached, named after the hash of the precompiled preamble and the
+version of LaTeX. They are dumped again if a file read while dumping them
+(e.g. a `.sty` file) changed since then. If the preamble cannot be dumped, or
+if the format turns out to be unusable (some packages do not support being
+precompiled), songbooks are compiled as if no format was used (and dumping
+the format is not tried again until one of those files changes).
+"""
+
+import functools
+import hashlib
+import json
+import logging
+import os
+import subprocess
+import tempfile
+
+from patacrep import encoding, errors, processes
+from patacrep.songs import cache
+
+LOGGER = logging.getLogger(__name__)
+
+CACHE_DIRNAME = "formats"
+
+#: Line of the `.tex` file ending the precompiled part of the preamble.
+MARKER = "%% End of the precompiled preamble"
+
+@functools.lru_cache()
+def tex_version(compiler):
+    """Return the version of `compiler` (first line of `compiler --version`).
+
+    Return `None` if it cannot be run.
+    """
+    try:
+        output = subprocess.check_output(
+            [compiler, "--version"],
+            stdin=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            universal_newlines=True,
+            )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.strip().split("\n")[0]
+
+def split(texname):
+    """Split `texname` at :data:`MARKER`.
+
+    Return a `(preamble, body)` tuple of strings (the marker line being the
+    last line of the preamble), or `None` if the file does not contain the
+    marker (e.g. it has been generated by a custom template).
+    """
+    with encoding.open_read(texname) as texfile:
+        content = texfile.read()
+    index = content.find("\n" + MARKER + "\n")
+    if index == -1:
+        return None
+    index += len(MARKER) + 2
+    return content[:index], content[index:]
+
+def format_name(cachedir, preamble, version):
+    """Return the name (without extension) of the format of `preamble`.
+
+    Arguments:
+    - cachedir: directory of cached formats;
+    - preamble: precompiled part of the preamble;
+    - version: version of LaTeX.
+    """
+    sha = hashlib.sha1()
+    sha.update("{}\0".format(version).encode("utf8"))
+    sha.update(preamble.encode("utf8"))
+    return os.path.join(cachedir, sha.hexdigest())
+
+def _signature(path):
+    """Return the signature of file `path` (or `None` if it does not exist)."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size]
+
+def _dependencies(flsname, tempdir):
+    """Return the files read by LaTeX, as recorded in `flsname`.
+
+    Return a dictionary of signatures (see :func:`_signature`), indexed by
+    absolute paths. Files of `tempdir` are ignored. Return an empty dictionary
+    if `flsname` cannot be read.
+    """
+    pwd = os.getcwd()
+    paths = set()
+    try:
+        with open(flsname, encoding="utf8", errors="replace") as flsfile:
+            for line in flsfile:
+                key, _, value = line.rstrip("\n").partition(" ")
+                if key == "PWD":
+                    pwd = value
+                elif key == "INPUT":
+                    paths.add(os.path.normpath(os.path.join(pwd, value)))
+    except OSError:
+        return {}
+    return {
+        path: _signature(path)
+        for path in sorted(paths)
+        if os.path.commonpath([path, tempdir]) != tempdir
+        }
+
+def _read_dependencies(filename):
+    """Return the dependencies written in `filename` (or `None` if it cannot be read)."""
+    try:
+        with open(filename, encoding="utf8") as depsfile:
+            return json.load(depsfile)
+    except (OSError, ValueError):
+        return None
+
+def _unchanged(dependencies):
+    """Return `True` iff none of the files of `dependencies` changed since they were recorded."""
+    return all(
+        _signature(path) == signature
+        for path, signature in dependencies.items()
+        )
+
+def is_valid(name):
+    """Return `True` iff format `name` exists, and the files it was dumped from did not change."""
+    dependencies = _read_dependencies(name + ".json")
+    if dependencies is None or not os.path.isfile(name + ".fmt"):
+        return False
+    return _unchanged(dependencies)
+
+def has_failed(name):
+    """Return `True` iff format `name` was discarded, and the files it depends on did not change.
+
+    Failures recorded without any dependency (e.g. LaTeX could not read
+    anything) are ignored: dumping the format is tried again.
+    """
+    dependencies = _read_dependencies(name + ".failed")
+    return bool(dependencies) and _unchanged(dependencies)
+
+def discard(name, dependencies=None):
+    """Remove format `name`, and record that it is not to be dumped again.
+
+    It is dumped again once one of the files of `dependencies` (by default,
+    the files it was dumped from) changes. Errors (e.g. read-only cache) are
+    logged, and ignored.
+    """
+    if dependencies is None:
+        dependencies = _read_dependencies(name + ".json") or {}
+    try:
+        for extension in [".fmt", ".json"]:
+            try:
+                os.remove(name + extension)
+            except FileNotFoundError:
+                pass
+        with open(name + ".failed", "w", encoding="utf8") as failedfile:
+            json.dump(dependencies, failedfile)
+    except OSError as error:
+        LOGGER.debug("Cannot discard format '{}': {}".format(name, error))
+
+def dump(compiler, options, preamble, name, *, timeout=None):
+    """Dump `preamble` into format `name`.
+
+    Arguments:
+    - compiler: LaTeX compiler (e.g. `lualatex`);
+    - options: list of options of the compiler;
+    - preamble: precompiled part of the preamble;
+    - name: name of the format (see :func:`format_name`);
+    - timeout: maximum duration of the compilation (in seconds).
+
+    The format is written atomically. Return `True` iff it could be dumped
+    (if it could not, the failure is recorded, see :func:`discard`).
+    """
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(name)) as tempdir:
+        tempdir = os.path.abspath(tempdir)
+        source = os.path.join(tempdir, "preamble.tex")
+        with open(source, "w", encoding="utf8") as sourcefile:
+            sourcefile.write(preamble)
+            sourcefile.write("\\dump\n")
+        output = os.path.join(tempdir, "format")
+        try:
+            returncode = processes.run(
+                [
+                    compiler,
+                    "-ini",
+                    "-recorder",
+                    "-output-directory={}".format(tempdir),
+                    "-jobname=format",
+                ] + options + ["&" + compiler, source],
+                timeout=timeout,
+                )
+        except errors.StepTimeoutError as error:
+            LOGGER.debug(error)
+            returncode = None
+        if returncode != 0 or not os.path.isfile(output + ".fmt"):
+            discard(name, _dependencies(output + ".fls", tempdir))
+            return False
+        dependencies = _dependencies(output + ".fls", tempdir)
+        with open(output + ".json", "w", encoding="utf8") as depsfile:
+            json.dump(dependencies, depsfile)
+        os.replace(output + ".fmt", name + ".fmt")
+        os.replace(output + ".json", name + ".json")
+    try:
+        os.remove(name + ".failed")
+    except FileNotFoundError:
+        pass
+    return True
+
+def prepare(compiler, options, basename, datadirs, *, timeout=None):
+    """Precompile the preamble of `<basename>.tex`, if possible.
+
+    Arguments:
+    - compiler: LaTeX compiler (e.g. `lualatex`);
+    - options: list of options of the compiler;
+    - basename: basename of the songbook;
+    - datadirs: list of datadirs of the songbook (formats are stored in the
+      cache of the first one);
+    - timeout: maximum duration of the compilation (in seconds).
+
+    Return the name of the format (without extension), after having written
+    the rest of the `.tex` file into `<basename>_body.tex`, or `None` if the
+    songbook is to be compiled without a format.
+    """
+    if not datadirs:
+        return None
+    parts = split("{}.tex".format(basename))
+    if parts is None:
+        LOGGER.debug("'{}.tex' has no precompiled preamble.".format(basename))
+        return None
+    preamble, body = parts
+    version = tex_version(compiler)
+    if version is None:
+        return None
+
+    cachedir = os.path.join(cache.cache_dir(datadirs[0]), CACHE_DIRNAME)
+    name = format_name(cachedir, preamble, version)
+    if has_failed(name):
+        return None
+    if not is_valid(name):
+        LOGGER.info("Precompiling the preamble of '{}.tex'…".format(basename))
+        try:
+            os.makedirs(cachedir, exist_ok=True)
+            dumped = dump(compiler, options, preamble, name, timeout=timeout)
+        except OSError as error:
+            LOGGER.info("The preamble cannot be precompiled ({}).".format(error))
+            return None
+        if not dumped:
+            LOGGER.info("The preamble cannot be precompiled: it is compiled at each pass.")
+            return None
+
+    with open("{}_body.tex".format(basename), "w", encoding="utf8") as bodyfile:
+        bodyfile.write(body)
+    return name
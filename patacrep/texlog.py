@@ -0,0 +1,259 @@
+"""Parse the output of LaTeX into structured events.
+
+While LaTeX compiles a songbook, each line of its output is given to a
+:class:`LogParser`, which turns warnings, errors, overfull or underfull boxes,
+missing files and requests to compile again into events. Events are
+dictionaries of standard python types (so that they can be exported as JSON),
+containing the following keys:
+- `type`: one of "error", "warning", "rerun", "missing_file", "overfull",
+  "underfull", "format" (the format file given to LaTeX cannot be loaded);
+- `message`: the message of LaTeX (without location);
+- `file`: the file being read by LaTeX when the message was printed (or
+  `None`, if unknown);
+- `line`: the line (of this file) the message refers to (or `None`);
+- `song`: the song the message refers to (or `None`): for ChordPro songs, the
+  path written before the song in the `.tex` file; for LaTeX songs, the path
+  of the song file;
+- depending on the type, more keys may be present in the event (e.g. `box`
+  and `amount` for overfull boxes, `package` for warnings, `missing` for
+  missing files).
+"""
+
+import bisect
+import os
+import re
+
+#: Environment variables of LaTeX compilations: do not wrap lines of the
+#: output (which would split messages).
+ENVIRONMENT = {"max_print_line": "10000"}
+
+#: Extensions of LaTeX songs (which are included in the `.tex` file using
+#: `\import`, instead of being written in it).
+SONG_EXTENSIONS = (".tsg", ".sg", ".tis")
+
+# Songs written in the .tex file are preceded by a separator, and their path
+# (see :meth:`patacrep.content.song.SongRenderer.render`).
+_SONG_SEPARATOR = "%" * 80
+_SONG_PATH_RE = re.compile(r"^%% (?P<path>.*)$")
+_SONGS_END = r"\end{songs}"
+
+_FILE_RE = re.compile(r"\((?P<file>[^\s()]+\.\w+)?|\)")
+_WARNING_RE = re.compile(
+    r"^(?:(?:Package|Class) (?P<package>\S+) |LaTeX (?:(?P<latex>\w+) )?)Warning: (?P<message>.*)$"
+    )
+_CONTINUATION_RE = re.compile(r"^\((?P<package>[^)\s]+)\)\s+(?P<message>.*)$")
+_INPUT_LINE_RE = re.compile(r"on input line (?P<line>\d+)")
+_BOX_RE = re.compile(
+    r"^(?P<type>Overfull|Underfull) \\(?P<box>[hv]box) \((?P<amount>[^)]*)\)(?P<location>.*)$"
+    )
+_LINES_RE = re.compile(r"lines? (?P<line>\d+)")
+_ERROR_RE = re.compile(r"^! (?P<message>.*)$")
+_ERROR_LINE_RE = re.compile(r"^l\.(?P<line>\d+)")
+_MISSING_RE = re.compile(r"^No file (?P<file>.+)\.$|File `(?P<notfound>[^']+)' not found")
+_RERUN_RE = re.compile(r"\brerun\b", re.IGNORECASE)
+_FORMAT_RE = re.compile(r"^---! .*\.fmt\b|Fatal format file error|I can't find the format file")
+
+def read_songs(filename):
+    """Return the songs written in `filename` (a `.tex` file).
+
+    Return a sorted list of `(first, last, path)` tuples, where `first` and
+    `last` are the first and last lines of the song. Return an empty list if
+    `filename` cannot be read.
+    """
+    songs = []
+    current = None
+    previous = ""
+    try:
+        with open(filename, encoding="utf8", errors="replace") as texfile:
+            for number, line in enumerate(texfile, 1):
+                line = line.rstrip("\n")
+                match = _SONG_PATH_RE.match(line)
+                if previous == _SONG_SEPARATOR and match:
+                    if current is not None:
+                        songs.append((current[0], number - 2, current[1]))
+                    current = (number, match.group("path"))
+                elif line.strip() == _SONGS_END and current is not None:
+                    songs.append((current[0], number - 1, current[1]))
+                    current = None
+                previous = line
+            if current is not None:
+                songs.append((current[0], number, current[1]))
+    except OSError:
+        return []
+    return songs
+
+class LogParser:
+    """Turn the output of LaTeX into events (see module documentation).
+
+    Arguments:
+    - texname: name of the compiled `.tex` file;
+    - songs: songs written in this file (as returned by :func:`read_songs`).
+
+    Lines are given to :meth:`feed`, and :meth:`close` is called once the
+    output is complete. Events are appended to :attr:`events`.
+    """
+
+    def __init__(self, texname, songs=()):
+        self.texname = os.path.basename(texname)
+        self.songs = sorted(songs)
+        self._firsts = [first for first, _, _ in self.songs]
+        self.events = []
+        # Stack of files being read by LaTeX (`None` for parentheses that do
+        # not open a file).
+        self._files = []
+        # Warning or error, whose message may continue on the next lines
+        self._pending = None
+
+    @property
+    def rerun(self):
+        """Return `True` iff LaTeX requested to be run again."""
+        return any(event['type'] == "rerun" for event in self.events)
+
+    @property
+    def format_failed(self):
+        """Return `True` iff a failed compilation may be due to its format.
+
+        That is, the format file could not be loaded, or LaTeX failed before
+        reaching the songs (e.g. because of a package which does not support
+        being precompiled, see :mod:`patacrep.texformat`). Errors occurring in
+        songs are errors of the document itself.
+        """
+        if any(event['type'] == "format" for event in self.events):
+            return True
+        return not any(
+            event['song'] is not None
+            for event in self.events
+            if event['type'] == "error"
+            )
+
+    def _current_file(self):
+        """Return the file currently read by LaTeX (or `None`)."""
+        for filename in reversed(self._files):
+            if filename is not None:
+                return filename
+        return None
+
+    def _song(self, filename, line):
+        """Return the song at `line` of `filename` (or `None`)."""
+        if filename is None:
+            return None
+        if os.path.basename(filename) == self.texname:
+            if line is None:
+                return None
+            index = bisect.bisect_right(self._firsts, line) - 1
+            if index >= 0 and line <= self.songs[index][1]:
+                return self.songs[index][2]
+            return None
+        if filename.endswith(SONG_EXTENSIONS):
+            return filename
+        return None
+
+    def _event(self, type_, message, line=None, **kwargs):
+        """Return a new event (see module documentation)."""
+        filename = self._current_file()
+        event = {
+            'type': type_,
+            'message': message,
+            'file': filename,
+            'line': line,
+            'song': self._song(filename, line),
+            }
+        event.update(kwargs)
+        return event
+
+    def _flush(self):
+        """Record the pending event (if any)."""
+        if self._pending is None:
+            return
+        event = self._pending
+        self._pending = None
+        if event['type'] == "warning":
+            match = _INPUT_LINE_RE.search(event['message'])
+            if match and event['line'] is None:
+                event['line'] = int(match.group("line"))
+                event['song'] = self._song(event['file'], event['line'])
+            if _RERUN_RE.search(event['message']):
+                event['type'] = "rerun"
+        self.events.append(event)
+
+    def feed(self, line):
+        """Parse a line of the output of LaTeX."""
+        if self._pending is not None:
+            if self._pending['type'] == "warning":
+                match = _CONTINUATION_RE.match(line)
+                if match and match.group("package") == self._pending['package']:
+                    self._pending['message'] += " " + match.group("message")
+                    return
+            else:
+                match = _ERROR_LINE_RE.match(line)
+                if match:
+                    self._pending['line'] = int(match.group("line"))
+                    self._pending['song'] = self._song(
+                        self._pending['file'],
+                        self._pending['line'],
+                        )
+                    self._flush()
+                    return
+                if not _ERROR_RE.match(line):
+                    # Context of the error
+                    return
+            self._flush()
+
+        self._parse(line)
+
+        for match in _FILE_RE.finditer(line):
+            if match.group(0) == ")":
+                if self._files:
+                    self._files.pop()
+            else:
+                self._files.append(match.group("file"))
+
+    def _parse(self, line):
+        """Parse a line which is not the continuation of a previous message."""
+        match = _ERROR_RE.match(line)
+        if match:
+            if match.group("message").startswith(" ==> "):
+                # "Fatal error occurred": consequence of the previous error
+                return
+            self._pending = self._event("error", match.group("message"))
+            missing = _MISSING_RE.search(line)
+            if missing and missing.group("notfound"):
+                self.events.append(self._event(
+                    "missing_file",
+                    match.group("message"),
+                    missing=missing.group("notfound"),
+                    ))
+            return
+
+        match = _WARNING_RE.match(line)
+        if match:
+            self._pending = self._event(
+                "warning",
+                match.group("message"),
+                package=match.group("package") or match.group("latex"),
+                )
+            return
+
+        match = _BOX_RE.match(line)
+        if match:
+            location = _LINES_RE.search(match.group("location"))
+            self.events.append(self._event(
+                match.group("type").lower(),
+                line,
+                int(location.group("line")) if location else None,
+                box=match.group("box"),
+                amount=match.group("amount"),
+                ))
+            return
+
+        if _FORMAT_RE.search(line):
+            self.events.append(self._event("format", line))
+            return
+
+        match = _MISSING_RE.match(line)
+        if match and match.group("file"):
+            self.events.append(self._event("missing_file", line, missing=match.group("file")))
+
+    def close(self):
+        """Record the pending event: output of LaTeX is complete."""
+        self._flush()
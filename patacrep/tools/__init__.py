@@ -11,3 +11,41 @@ def existing_file(name):
     if os.path.isfile(name) and os.access(name, os.R_OK):
         return name
     raise argparse.ArgumentTypeError("Cannot read file '{}'.".format(name))
+
+#: Multipliers of the suffixes accepted by :func:`size`.
+SIZE_SUFFIXES = {
+    "": 1,
+    "k": 1024,
+    "m": 1024**2,
+    "g": 1024**3,
+    }
+
+def size(text):
+    """Check that argument is a size, in bytes, with an optional suffix (K, M or G).
+
+    Return the argument, as an integer number of bytes, for convenience.
+    """
+    number = text.strip().lower().rstrip("b")
+    suffix = ""
+    if number and number[-1] in SIZE_SUFFIXES:
+        number, suffix = number[:-1], number[-1]
+    try:
+        value = int(float(number) * SIZE_SUFFIXES[suffix])
+    except (ValueError, OverflowError):
+        raise argparse.ArgumentTypeError("'{}' is not a size.".format(text))
+    if value < 0:
+        raise argparse.ArgumentTypeError("'{}' is not a positive size.".format(text))
+    return value
+
+def positive_int(text):
+    """Check that argument is a positive integer.
+
+    Return the argument, as an integer, for convenience.
+    """
+    try:
+        value = int(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError("'{}' is not an integer.".format(text))
+    if value < 1:
+        raise argparse.ArgumentTypeError("'{}' is not a positive integer.".format(text))
+    return value
@@ -1,15 +1,26 @@
 """Perform operations on cache."""
 
 import argparse
+import collections
+import contextlib
+import copy
 import logging
+import multiprocessing
 import os
 import shutil
 import sys
+import tempfile
 import textwrap
+import time
 
-from patacrep import errors
+import yaml
+
+from patacrep import authors, errors, files
+from patacrep.content import ContentError
 from patacrep.songbook import open_songbook
-from .. import existing_file
+from patacrep.songs import Song, cache
+from .. import existing_file, positive_int, size
+from .worker import init_worker, warm_song
 
 LOGGER = logging.getLogger("patatools.cache")
 
@@ -18,7 +29,7 @@ def commandline_parser():
 
     parser = argparse.ArgumentParser(
         prog="patatools cache",
-        description="Clean the caches related to a songbook.",
+        description="Manage the caches related to a songbook.",
         formatter_class=argparse.RawTextHelpFormatter,
         )
 
@@ -38,15 +49,296 @@ def commandline_parser():
         )
     clean.set_defaults(command=do_clean)
 
+    warm = subparsers.add_parser(
+        "warm",
+        description=textwrap.dedent("""\
+            Parse the songs of the songbook datadirs, so that they are cached
+            before the songbook is built.
+        """),
+        help="Fill cache.",
+        )
+    warm.add_argument(
+        'songbook',
+        metavar="SONGBOOK",
+        help=textwrap.dedent("""Songbook file to be used to look for songs."""),
+        type=existing_file,
+        )
+    warm.add_argument(
+        '--jobs', '-j',
+        type=positive_int,
+        default=os.cpu_count() or 1,
+        help="Number of songs parsed in parallel (default is the number of CPUs).",
+        )
+    warm.set_defaults(command=do_warm)
+
+    stats = subparsers.add_parser(
+        "stats",
+        description=textwrap.dedent("""\
+            Display statistics about the cache: number and size of entries,
+            stale entries (songs deleted or changed since they were cached),
+            outdated entries (written by another version of patacrep), and
+            the ratio of songs of the datadirs that are cached.
+        """),
+        help="Display cache statistics.",
+        )
+    stats.add_argument(
+        'songbook',
+        metavar="SONGBOOK",
+        help=textwrap.dedent("""Songbook file to be used to look for cache path."""),
+        type=existing_file,
+        )
+    stats.set_defaults(command=do_stats)
+
+    prune = subparsers.add_parser(
+        "prune",
+        description=textwrap.dedent("""\
+            Delete cache entries of songs that have been deleted or changed,
+            and entries written by another version of patacrep. With
+            --max-size or --max-entries, then delete the least recently used
+            entries until the cache fits.
+        """),
+        help="Delete unusable cache entries.",
+        )
+    prune.add_argument(
+        'songbook',
+        metavar="SONGBOOK",
+        help=textwrap.dedent("""Songbook file to be used to look for cache path."""),
+        type=existing_file,
+        )
+    prune.add_argument(
+        '--max-size',
+        type=size,
+        default=None,
+        help="Then delete least recently used entries, until the cache fits in this size (e.g. 500M).",
+        )
+    prune.add_argument(
+        '--max-entries',
+        type=positive_int,
+        default=None,
+        help="Then delete least recently used entries, until the cache has this number of entries.",
+        )
+    prune.set_defaults(command=do_prune)
+
+    benchmark = subparsers.add_parser(
+        "benchmark",
+        description=textwrap.dedent("""\
+            Parse the songs of the songbook datadirs (without using the
+            cache), and compare the size, dump and load times of their cache
+            files, for each format and compression method.
+        """),
+        help="Compare cache formats.",
+        )
+    benchmark.add_argument(
+        'songbook',
+        metavar="SONGBOOK",
+        help=textwrap.dedent("""Songbook file to be used to look for songs."""),
+        type=existing_file,
+        )
+    benchmark.add_argument(
+        '--repeat', '-r',
+        type=positive_int,
+        default=5,
+        help="Number of measures (the best one is reported).",
+        )
+    benchmark.set_defaults(command=do_benchmark)
+
     return parser
 
+def iter_songs(config):
+    """Iterate over the songs of the songbook datadirs.
+
+    Songs are yielded as tuples `(datadir, subpath)`.
+    """
+    extensions = files.load_renderer_plugins(config['_datadir'])['tsg'].keys()
+    for songdir in config['_songdir']:
+        if not os.path.isdir(songdir.datadir):
+            continue
+        for filename in sorted(files.recursive_find(songdir.fullpath, extensions)):
+            yield songdir.datadir, os.path.normpath(os.path.join(songdir.subpath, filename))
+
 def do_clean(namespace):
     """Execute the `patatools cache clean` command."""
     for datadir in open_songbook(namespace.songbook)['_datadir']:
-        cachedir = os.path.join(datadir, ".cache")
+        cachedir = cache.cache_dir(datadir)
         LOGGER.info("Deleting cache directory '{}'...".format(cachedir))
         if os.path.isdir(cachedir):
-            shutil.rmtree(cachedir)
+            with cache.lock(cachedir):
+                shutil.rmtree(cachedir)
+
+def do_warm(namespace):
+    """Execute the `patatools cache warm` command."""
+    config = open_songbook(namespace.songbook)
+    config['_cache'] = True
+    config['_error'] = "fix"
+    config['_compiled_authwords'] = authors.compile_authwords(
+        copy.deepcopy(config['authors'])
+        )
+    songs = list(iter_songs(config))
+
+    if config.get('_cache_dir'):
+        cachedirs = [config['_cache_dir']]
+    else:
+        cachedirs = sorted({cache.cache_dir(datadir) for datadir, _ in songs})
+
+    LOGGER.info("Parsing {} songs...".format(len(songs)))
+    with contextlib.ExitStack() as stack:
+        for cachedir in cachedirs:
+            stack.enter_context(cache.lock(cachedir, shared=True))
+        if namespace.jobs == 1 or len(songs) < 2:
+            init_worker(config)
+            results = list(map(warm_song, songs))
+        else:
+            with multiprocessing.Pool(
+                processes=min(namespace.jobs, len(songs)),
+                initializer=init_worker,
+                initargs=(config,),
+                ) as pool:
+                results = list(pool.imap_unordered(warm_song, songs))
+
+    failures = [(path, error) for path, error in results if error is not None]
+    for path, error in sorted(failures):
+        LOGGER.error("Cannot parse '{}': {}".format(path, error))
+    LOGGER.info("{} songs cached, {} failures.".format(
+        len(songs) - len(failures),
+        len(failures),
+        ))
+
+def do_stats(namespace):
+    """Execute the `patatools cache stats` command."""
+    config = open_songbook(namespace.songbook)
+    songs = list(iter_songs(config))
+    report = {}
+    for datadir in config['_datadir']:
+        statuses = {}
+        size = 0
+        for entry in cache.iter_entries(datadir):
+            statuses[entry.subpath] = entry.status(Song.CACHE_VERSION)
+            size += entry.size
+        counter = collections.Counter(statuses.values())
+        datadir_songs = [subpath for songdatadir, subpath in songs if songdatadir == datadir]
+        hits = len([
+            subpath
+            for subpath in datadir_songs
+            if statuses.get(subpath) == cache.VALID
+            ])
+        report[datadir] = {
+            'entries': len(statuses),
+            'size': size,
+            'valid': counter[cache.VALID],
+            'stale': counter[cache.MISSING] + counter[cache.CHANGED],
+            'outdated': counter[cache.OUTDATED],
+            'corrupted': counter[cache.CORRUPTED],
+            'songs': len(datadir_songs),
+            'hit_ratio': round(hits / len(datadir_songs), 3) if datadir_songs else None,
+            }
+    sys.stdout.write(yaml.safe_dump(report, allow_unicode=True, default_flow_style=False))
+
+def do_prune(namespace):
+    """Execute the `patatools cache prune` command."""
+    for datadir in open_songbook(namespace.songbook)['_datadir']:
+        pruned = 0
+        if not os.path.isdir(cache.cache_dir(datadir)):
+            continue
+        with cache.lock(cache.cache_dir(datadir)):
+            for entry in list(cache.iter_entries(datadir)):
+                status = entry.status(Song.CACHE_VERSION)
+                if status != cache.VALID:
+                    LOGGER.debug("Deleting {} cache entry '{}'.".format(status, entry.cachename))
+                    entry.remove()
+                    pruned += 1
+            if namespace.max_size is not None or namespace.max_entries is not None:
+                pruned += len(cache.evict(
+                    cache.cache_dir(datadir),
+                    Song.CACHE_VERSION,
+                    max_size=namespace.max_size,
+                    max_entries=namespace.max_entries,
+                    ))
+        LOGGER.info("Deleted {} entries from cache directory '{}'.".format(
+            pruned,
+            cache.cache_dir(datadir),
+            ))
+
+def _timed(function, payloads, repeat):
+    """Return the best time (in seconds) of `repeat` calls to `function(payloads)`."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(payloads)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def benchmark_format(payloads, serializer, compression, repeat):
+    """Measure the cache files of `payloads`, written with a given format.
+
+    Arguments:
+    - payloads: list of dictionaries, as written to cache by songs;
+    - serializer: the name of the serializer (see :data:`cache.SERIALIZERS`);
+    - compression: the name of the compression method (see
+      :data:`cache.COMPRESSIONS`);
+    - repeat: number of measures of each time (the best one is returned).
+
+    Return a dictionary of the total size of cache files, and of the times
+    (in seconds) to dump and load them.
+    """
+    with tempfile.TemporaryDirectory() as cachedir:
+        names = [os.path.join(cachedir, str(number)) for number in range(len(payloads))]
+
+        def dump_all(payloads):
+            """Write payloads to cache files."""
+            for payload, name in zip(payloads, names):
+                cache.dump(payload, name, serializer=serializer, compression=compression)
+
+        def load_all(payloads):
+            """Read payloads from cache files."""
+            for name in names[:len(payloads)]:
+                cache.load(name)
+
+        dump_time = _timed(dump_all, payloads, repeat)
+        load_time = _timed(load_all, payloads, repeat)
+        return {
+            'size': sum(os.path.getsize(name) for name in names),
+            'dump': round(dump_time, 4),
+            'load': round(load_time, 4),
+            }
+
+def do_benchmark(namespace):
+    """Execute the `patatools cache benchmark` command."""
+    config = open_songbook(namespace.songbook)
+    config['_cache'] = False
+    config['_error'] = "fix"
+    config['_compiled_authwords'] = authors.compile_authwords(
+        copy.deepcopy(config['authors'])
+        )
+    renderers = files.load_renderer_plugins(config['_datadir'])['tsg']
+
+    payloads = []
+    start = time.perf_counter()
+    for datadir, subpath in iter_songs(config):
+        try:
+            song = renderers[subpath.split(".")[-1]](subpath, config, datadir=datadir)
+            payloads.append(song.cache_payload(song.cached_attributes + song.body_attributes))
+        except (ContentError, OSError, UnicodeError) as error:
+            LOGGER.warning("Ignoring song '{}': {}".format(os.path.join(datadir, subpath), error))
+    parse_time = time.perf_counter() - start
+
+    report = {
+        'songs': len(payloads),
+        'parse': round(parse_time, 4),
+        'formats': {},
+        }
+    for serializer in sorted(cache.SERIALIZERS):
+        for compression in sorted(cache.COMPRESSIONS):
+            LOGGER.info("Measuring format '{}', compression '{}'...".format(
+                serializer,
+                compression,
+                ))
+            report['formats']["{}/{}".format(serializer, compression)] = benchmark_format(
+                payloads,
+                serializer,
+                compression,
+                namespace.repeat,
+                )
+    sys.stdout.write(yaml.safe_dump(report, allow_unicode=True, default_flow_style=False))
 
 def main(args):
     """Main function: run from command line."""
@@ -0,0 +1,37 @@
+"""Parsing of a single song, as run by `patatools cache warm` workers.
+
+Those functions live outside of the `__main__` module so that they can be sent
+to the processes of a :class:`multiprocessing.Pool`.
+"""
+
+import os
+
+from patacrep import files
+from patacrep.content import ContentError
+
+# Per-process state of the workers, set by :func:`init_worker`.
+_WORKER = {}
+
+def init_worker(config):
+    """Prepare a worker process, parsing songs with configuration `config`."""
+    _WORKER['config'] = config
+    _WORKER['renderers'] = files.load_renderer_plugins(config['_datadir'])['tsg']
+
+def warm_song(song):
+    """Parse a song (thus writing it to the cache).
+
+    Argument is a tuple `(datadir, subpath)`. Return a tuple `(path, error)`,
+    where `error` is `None` if parsing succeeded, and a message otherwise.
+    """
+    datadir, subpath = song
+    path = os.path.join(datadir, subpath)
+    extension = subpath.split(".")[-1]
+    try:
+        song = _WORKER['renderers'][extension](subpath, _WORKER['config'], datadir=datadir)
+        # Song content is parsed when first needed: parse (and cache) it now.
+        song.cached # pylint: disable=pointless-statement
+    except ContentError as error:
+        return path, str(error)
+    except (OSError, UnicodeError) as error:
+        return path, "Cannot read file '{}': {}".format(path, error)
+    return path, None
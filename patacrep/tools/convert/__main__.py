@@ -1,19 +1,19 @@
 """Convert between song formats."""
 
-import os
+import argparse
 import logging
+import multiprocessing
+import os
 import sys
+import textwrap
 
 from patacrep import files
-from patacrep.content import ContentError
 from patacrep.utils import yesno
-from patacrep.build import config_model
+from .. import positive_int
+from .worker import init_worker, convert_song
 
 LOGGER = logging.getLogger("patatools.convert")
 
-def _usage():
-    return "patatools convert INPUTFORMAT OUTPUTFORMAT FILES"
-
 def confirm(destname):
     """Ask whether destination name should be overwrited."""
     while True:
@@ -22,57 +22,177 @@ def confirm(destname):
         except ValueError:
             continue
 
+def commandline_parser():
+    """Return a command line parser."""
+
+    parser = argparse.ArgumentParser(
+        prog="patatools convert",
+        description="Convert between song formats.",
+        formatter_class=argparse.RawTextHelpFormatter,
+        )
+
+    parser.add_argument(
+        'source',
+        metavar="INPUTFORMAT",
+        help="Format of the songs to convert (e.g. 'csg').",
+        )
+    parser.add_argument(
+        'dest',
+        metavar="OUTPUTFORMAT",
+        help="Format to convert songs to (e.g. 'tsg').",
+        )
+    parser.add_argument(
+        'files',
+        metavar="FILES",
+        nargs='+',
+        help=textwrap.dedent("""\
+                Songs to convert. Directories are searched recursively for
+                songs with the INPUTFORMAT extension.
+        """),
+        )
+
+    parser.add_argument(
+        '--jobs', '-j',
+        type=positive_int,
+        default=1,
+        help="Number of songs converted in parallel (default 1).",
+        )
+    parser.add_argument(
+        '--output-dir', '-o',
+        metavar="DIR",
+        default=None,
+        help=textwrap.dedent("""\
+                Directory where converted songs are written. The layout of
+                directories given as FILES is preserved. By default, converted
+                songs are written next to the original ones.
+        """),
+        )
+
+    existing = parser.add_mutually_exclusive_group()
+    existing.add_argument(
+        '--overwrite',
+        dest='existing',
+        action='store_const',
+        const='overwrite',
+        help="Overwrite existing destination files without asking.",
+        )
+    existing.add_argument(
+        '--skip-existing',
+        dest='existing',
+        action='store_const',
+        const='skip',
+        help="Do not convert songs whose destination file already exists.",
+        )
+
+    return parser
+
+def iter_sources(paths, extension):
+    """Iterate over `(source, relative)` tuples of songs to convert.
+
+    - `source` is the path of the song file;
+    - `relative` is the path of the song, relative to the directory given as
+      argument (or its basename, if a file was given as argument).
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            for relative in sorted(files.recursive_find(path, [extension])):
+                relative = os.path.normpath(relative)
+                yield os.path.join(path, relative), relative
+        else:
+            yield path, os.path.basename(path)
+
+def destination_name(source, relative, dest, output_dir=None):
+    """Return the name of the converted version of `source`."""
+    if output_dir is None:
+        base = source
+    else:
+        base = os.path.join(output_dir, relative)
+    return "{}.{}".format(os.path.splitext(base)[0], dest)
+
+def _iter_tasks(options):
+    """Iterate over `(source, destname)` conversions to perform.
+
+    Existing destination files are overwritten, skipped, or the user is asked,
+    depending on the command line options.
+    """
+    for source, relative in iter_sources(options.files, options.source):
+        destname = destination_name(source, relative, options.dest, options.output_dir)
+        if os.path.exists(destname):
+            if options.existing == "skip":
+                LOGGER.info("Skipping '%s': '%s' already exists.", source, destname)
+                continue
+            if options.existing is None and not confirm(destname):
+                continue
+        yield source, destname
+
+def _collect_failures(results):
+    """Log and return the list of `(source, error)` failures among results."""
+    failures = []
+    for sourcename, error in results:
+        if error is not None:
+            LOGGER.error(error)
+            failures.append((sourcename, error))
+    return failures
+
+def convert(tasks, source, dest, jobs=1):
+    """Convert songs, and return the list of `(source, error)` failures.
+
+    Arguments:
+    - tasks: list of `(sourcename, destname)` tuples.
+    - source, dest: source and destination formats.
+    - jobs: number of processes to use.
+    """
+    if jobs == 1 or len(tasks) < 2:
+        init_worker(source, dest)
+        return _collect_failures(map(convert_song, tasks))
+
+    with multiprocessing.Pool(
+        processes=min(jobs, len(tasks)),
+        initializer=init_worker,
+        initargs=(source, dest),
+        ) as pool:
+        return _collect_failures(pool.imap_unordered(convert_song, tasks))
+
 def main(args=None):
     """Main function: run from command line."""
     if args is None:
         args = sys.argv
-    if len(args) < 4:
-        LOGGER.error("Invalid number of arguments.")
-        LOGGER.error("Usage: %s", _usage())
-        sys.exit(1)
-
-    source = args[1]
-    dest = args[2]
-    song_files = args[3:]
+    options = commandline_parser().parse_args(args[1:])
 
     renderers = files.load_renderer_plugins()
 
-    if dest not in renderers:
+    if options.dest not in renderers:
         LOGGER.error(
             "Unknown destination file format '%s'. Available ones are %s.",
-            source,
+            options.dest,
             ", ".join(["'{}'".format(key) for key in renderers.keys()])
             )
         sys.exit(1)
-    if source not in renderers[dest]:
+    if options.source not in renderers[options.dest]:
         LOGGER.error(
             "Unknown source file format '%s'. Available ones are %s.",
-            source,
-            ", ".join(["'{}'".format(key) for key in renderers[dest].keys()])
+            options.source,
+            ", ".join(["'{}'".format(key) for key in renderers[options.dest].keys()])
             )
         sys.exit(1)
 
-    for file in song_files:
-        try:
-            song = renderers[dest][source](file, config_model('default')['en'])
-            destname = "{}.{}".format(".".join(file.split(".")[:-1]), dest)
-            if os.path.exists(destname):
-                if not confirm(destname):
-                    continue
-            with open(destname, "w") as destfile:
-                destfile.write(song.render())
-
-        except ContentError:
-            LOGGER.error("Cannot parse file '%s'.", file)
-            sys.exit(1)
-        except NotImplementedError:
-            LOGGER.error("Cannot convert to format '%s'.", dest)
-            sys.exit(1)
-        except KeyboardInterrupt:
-            print()
-            LOGGER.info("Aborted by user.")
-            sys.exit(0)
+    try:
+        tasks = list(_iter_tasks(options))
+        failures = convert(tasks, options.source, options.dest, options.jobs)
+    except KeyboardInterrupt:
+        print()
+        LOGGER.info("Aborted by user.")
+        sys.exit(0)
 
+    LOGGER.info(
+        "%d song(s) converted, %d failure(s).",
+        len(tasks) - len(failures),
+        len(failures),
+        )
+    if failures:
+        for sourcename, _ in sorted(failures):
+            LOGGER.info("Failed: %s", sourcename)
+        sys.exit(1)
     sys.exit(0)
 
 if __name__ == "__main__":
@@ -0,0 +1,55 @@
+"""Conversion of a single song, as run by `patatools convert` workers.
+
+Those functions live outside of the `__main__` module so that they can be sent
+to the processes of a :class:`multiprocessing.Pool`.
+"""
+
+import os
+
+from patacrep import files
+from patacrep.build import config_model
+from patacrep.content import ContentError
+
+# Per-process state of the conversion workers, set by :func:`init_worker`.
+_WORKER = {}
+
+def init_worker(source, dest):
+    """Prepare a conversion process.
+
+    Renderer plugins and default configuration are loaded once per process, and
+    shared by every song converted by it (as well as the parser and templates,
+    which are cached by the renderers).
+    """
+    _WORKER['renderer'] = files.load_renderer_plugins()[dest][source]
+    _WORKER['config'] = config_model('default')['en']
+    _WORKER['dest'] = dest
+
+def convert_song(task):
+    """Convert a song.
+
+    Return a tuple `(source, error)`, where `error` is `None` if conversion
+    succeeded, and a message otherwise.
+    """
+    source, destname = task
+    try:
+        song = _WORKER['renderer'](source, _WORKER['config'])
+        rendered = song.render()
+    except ContentError:
+        return source, "Cannot parse file '{}'.".format(source)
+    except NotImplementedError as error:
+        message = "Cannot convert to format '{}'.".format(_WORKER['dest'])
+        if str(error):
+            message += " {}".format(error)
+        return source, message
+    except (OSError, UnicodeError) as error:
+        return source, "Cannot read file '{}': {}".format(source, error)
+
+    destdir = os.path.dirname(destname)
+    try:
+        if destdir:
+            os.makedirs(destdir, exist_ok=True)
+        with open(destname, "w") as destfile:
+            destfile.write(rendered)
+    except OSError as error:
+        return source, "Cannot write file '{}': {}".format(destname, error)
+    return source, None
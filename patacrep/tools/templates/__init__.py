@@ -0,0 +1 @@
+"""Perform operations on templates."""
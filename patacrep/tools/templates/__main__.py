@@ -0,0 +1,87 @@
+"""Perform operations on templates."""
+
+import argparse
+import logging
+import sys
+import textwrap
+
+from patacrep import errors, files
+from patacrep.songbook import open_songbook
+from patacrep.templates import TexBookRenderer
+from .. import existing_file
+
+LOGGER = logging.getLogger("patatools.templates")
+
+def commandline_parser():
+    """Return a command line parser."""
+
+    parser = argparse.ArgumentParser(
+        prog="patatools templates",
+        description="Operations related to the templates of a songbook.",
+        formatter_class=argparse.RawTextHelpFormatter,
+        )
+
+    subparsers = parser.add_subparsers()
+    subparsers.required = True
+
+    compile_parser = subparsers.add_parser(
+        "compile",
+        description=textwrap.dedent("""\
+            Compile the songbook and song templates (including the ones of the
+            songbook datadirs) to Python modules, stored in the cache
+            directory of the first datadir, so that they are not compiled
+            again each time a songbook is built.
+
+            Compiled templates are no longer used once a template of the
+            datadirs is added, removed or changed: run this command again.
+        """),
+        help="Compile templates.",
+        )
+    compile_parser.add_argument(
+        'songbook',
+        metavar="SONGBOOK",
+        help=textwrap.dedent("""Songbook file to be used to look for templates."""),
+        type=existing_file,
+        )
+    compile_parser.set_defaults(command=do_compile)
+
+    return parser
+
+def iter_template_compilers(datadirs):
+    """Iterate over the functions compiling the templates of a songbook.
+
+    Those are the `compile_templates()` class methods of the songbook
+    renderer, and of the song renderers (each one being yielded once).
+    """
+    yield TexBookRenderer.compile_templates
+    searchpaths = set()
+    for renderers in files.load_renderer_plugins(datadirs).values():
+        for renderer in renderers.values():
+            if not hasattr(renderer, "compile_templates"):
+                continue
+            searchpath = tuple(renderer.searchpath(datadirs))
+            if searchpath not in searchpaths:
+                searchpaths.add(searchpath)
+                yield renderer.compile_templates
+
+def do_compile(namespace):
+    """Execute the `patatools templates compile` command."""
+    datadirs = open_songbook(namespace.songbook)['_datadir']
+    for compiler in iter_template_compilers(datadirs):
+        path = compiler(datadirs)
+        if path is None:
+            LOGGER.warning("No datadir to compile templates in.")
+            return
+        LOGGER.info("Compiled templates in '{}'.".format(path))
+
+def main(args):
+    """Main function: run from command line."""
+    options = commandline_parser().parse_args(args[1:])
+    try:
+        options.command(options)
+    except errors.SongbookError as error:
+        LOGGER.error(str(error))
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main(sys.argv)
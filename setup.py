@@ -49,6 +49,7 @@ setup(
     url='https://github.com/patacrep/patacrep',
     packages=find_packages(exclude=["test*"]),
     license="GPLv2 or any later version",
+    python_requires=">=3.7",
     install_requires=[
         "argdispatch", "unidecode", "jinja2", "ply", "pyyaml",
         ],
@@ -65,8 +66,8 @@ setup(
         "Operating System :: POSIX :: Linux",
         "Operating System :: Microsoft :: Windows",
         "Operating System :: MacOS :: MacOS X",
-        "Programming Language :: Python :: 3.3",
-        "Programming Language :: Python :: 3.4",
+        "Programming Language :: Python :: 3 :: Only",
+        "Programming Language :: Python :: 3.7",
         "Topic :: Utilities",
         ],
     platforms=["GNU/Linux", "Windows", "MacOsX"],
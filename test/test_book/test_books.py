@@ -0,0 +1,125 @@
+"""Tests of the compilation of several songbooks by the same process."""
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from patacrep import errors, files
+from patacrep.build import SongbookBuilder
+from patacrep.songbook import open_songbook
+from patacrep.songbook.__main__ import main as songbook_main
+
+from .. import logging_reduced
+
+DATADIR = os.path.join(os.path.dirname(__file__), "..", "test_patatools", "test_cache_datadir")
+
+class TestBooks(unittest.TestCase):
+    """Test the compilation of several songbooks."""
+
+    def setUp(self):
+        self._tempdir = tempfile.TemporaryDirectory()
+        self.tempdir = self._tempdir.name
+        shutil.copytree(DATADIR, os.path.join(self.tempdir, "datadir"))
+        for name in ["one", "two", "three"]:
+            self.write_book(name + ".yaml")
+        # Steps performed, as a list of (step, basename) tuples
+        self.steps = []
+        self._lock = threading.Lock()
+        for step in ["tex", "pdf"]:
+            patcher = mock.patch.object(
+                SongbookBuilder,
+                "build_" + step,
+                autospec=True,
+                side_effect=self._record(step, getattr(SongbookBuilder, "build_" + step)),
+                )
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self._tempdir.cleanup()
+
+    def write_book(self, name, directory=""):
+        """Write a songbook file."""
+        os.makedirs(os.path.join(self.tempdir, directory), exist_ok=True)
+        with open(os.path.join(self.tempdir, directory, name), "w") as bookfile:
+            bookfile.write("book:\n  datadir: {}\n  lang: en\n".format(
+                os.path.join(self.tempdir, "datadir"),
+                ))
+
+    def _record(self, step, function):
+        """Return a replacement of `function`, recording that `step` was performed."""
+        def replacement(builder):
+            """Record the step (LaTeX is not run)."""
+            if step == "pdf" and "fail" in builder.basename:
+                raise errors.LatexCompilationError(builder.basename)
+            with self._lock:
+                self.steps.append((step, builder.basename))
+            if step != "pdf":
+                function(builder)
+        return replacement
+
+    def _songbook(self, *args):
+        """Run `songbook`, and return its exit code."""
+        with files.chdir(self.tempdir), logging_reduced():
+            try:
+                songbook_main(["songbook", "--steps", "tex,pdf"] + list(args))
+            except SystemExit as systemexit:
+                return systemexit.code
+        return None
+
+    def test_books(self):
+        """Songs are rendered one book after the other, then books are compiled in parallel."""
+        self.assertEqual(self._songbook("one.yaml", "two.yaml", "three.yaml", "-j", "2"), 0)
+        self.assertEqual(
+            self.steps[:3],
+            [("tex", "one"), ("tex", "two"), ("tex", "three")],
+            )
+        self.assertCountEqual(
+            self.steps[3:],
+            [("pdf", "one"), ("pdf", "two"), ("pdf", "three")],
+            )
+        for name in ["one", "two", "three"]:
+            self.assertTrue(os.path.exists(os.path.join(self.tempdir, name + ".tex")))
+
+    def test_manifest(self):
+        """Books can be listed in a manifest."""
+        self.write_book("four.yaml", "sub")
+        with open(os.path.join(self.tempdir, "sub", "manifest.yaml"), "w") as manifest:
+            manifest.write("- four.yaml\n- ../three.yaml\n")
+        self.assertEqual(self._songbook("one.yaml", "--manifest", "sub/manifest.yaml"), 0)
+        self.assertCountEqual(
+            [basename for step, basename in self.steps if step == "pdf"],
+            ["one", "four", "three"],
+            )
+
+    def test_failure(self):
+        """A book failing does not stop the other ones."""
+        self.write_book("fail.yaml")
+        self.assertEqual(self._songbook("one.yaml", "fail.yaml", "two.yaml"), 1)
+        self.assertCountEqual(
+            [basename for step, basename in self.steps if step == "pdf"],
+            ["one", "two"],
+            )
+
+    def test_same_name(self):
+        """Books compiled to the same files are rejected."""
+        self.write_book("one.yaml", "sub")
+        self.assertEqual(self._songbook("one.yaml", "sub/one.yaml"), 1)
+        self.assertEqual(self.steps, [])
+
+    def test_options(self):
+        """LaTeX options are not shared between builders."""
+        builders = []
+        for name in ["one", "two"]:
+            songbook = open_songbook(os.path.join(self.tempdir, name + ".yaml"))
+            songbook['_cache'] = True
+            builders.append(SongbookBuilder(songbook))
+        for builder in builders:
+            builder._set_latex() # pylint: disable=protected-access
+        self.assertEqual(
+            builders[0]._lualatex_options, # pylint: disable=protected-access
+            ["-halt-on-error"],
+            )
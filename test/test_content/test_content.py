@@ -5,12 +5,14 @@
 import glob
 import os
 import unittest
+from unittest import mock
 import yaml
 
 from pkg_resources import resource_filename
 
 from patacrep import content, files
 from patacrep.songbook import prepare_songbook
+from patacrep.songs.chordpro import ChordproSong
 
 from .. import logging_reduced
 from .. import dynamic # pylint: disable=unused-import
@@ -69,6 +71,12 @@ class FileTest(unittest.TestCase, metaclass=dynamic.DynamicTest):
             ).format(base=os.path.basename(base))
         return test_content
 
+    def test_sort_metadata(self):
+        """Test that songs are sorted without parsing their content."""
+        test_content = self._create_content_test(resource_filename(__name__, "sort"))
+        with mock.patch.object(ChordproSong, '_parse', side_effect=AssertionError):
+            test_content(self)
+
     @classmethod
     def _clean_path(cls, elem):
         """Shorten the path relative to the test directory"""
@@ -0,0 +1,46 @@
+"""Tests of the rendering of very simple TeX commands."""
+
+import random
+import unittest
+
+from patacrep.latex.detex import MATCH, Detexer
+
+#: Pieces of synthetic strings, which can be (or build) TeX commands.
+PIECES = [latex for latex, _ in MATCH] + [
+    "\\", "\\\\", "'", "`", "^", '"', "i", "I", "IeC", "c", "C", " ", ",", "~", "dots", "%", "x",
+    ]
+
+def replace(string, match):
+    """Replace each command of `match` in `string`, one after the other."""
+    for latex, plain in match:
+        string = string.replace(latex, plain)
+    return string
+
+class TestDetexer(unittest.TestCase):
+    """Check that :class:`Detexer` replaces commands like successive `str.replace()`."""
+
+    def test_match(self):
+        """Test synthetic strings with the commands of :data:`MATCH`."""
+        detexer = Detexer(MATCH)
+        rng = random.Random(0)
+        for _ in range(20000):
+            string = "".join(rng.choice(PIECES) for _ in range(rng.randint(0, 8)))
+            with self.subTest(string=string):
+                self.assertEqual(detexer.translate(string), replace(string, MATCH))
+
+    def test_interfering(self):
+        """Test random commands, which may overlap or build each other."""
+        rng = random.Random(0)
+        for _ in range(300):
+            match = [
+                (
+                    "\\" + "".join(rng.choice("\\ab ") for _ in range(rng.randint(1, 3))),
+                    "".join(rng.choice("ab ") for _ in range(rng.randint(0, 2))),
+                )
+                for _ in range(rng.randint(1, 6))
+                ]
+            detexer = Detexer(match)
+            for _ in range(200):
+                string = "".join(rng.choice("\\ab ") for _ in range(rng.randint(0, 10)))
+                with self.subTest(match=match, string=string):
+                    self.assertEqual(detexer.translate(string), replace(string, match))
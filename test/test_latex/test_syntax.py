@@ -0,0 +1,47 @@
+"""Tests of the LaTeX song parser."""
+
+import concurrent.futures
+import sys
+import unittest
+
+from patacrep.latex import syntax
+
+from .. import logging_reduced
+
+def song(number):
+    """Return a LaTeX song, depending on `number`."""
+    return (
+        "\\selectlanguage{{lang{number}}}\n"
+        "\\beginsong{{Title {number}\\\\Other title {number}}}\n"
+        "  [by={{Author {number}}}, album={{Album {number}}}, cover={{img/{number}}}]\n"
+        "Content {number}\n"
+        "\\endsong\n"
+        ).format(number=number)
+
+class TestSyntax(unittest.TestCase):
+    """Test of the LaTeX song parser."""
+
+    def test_metadata(self):
+        """Song metadata is parsed."""
+        metadata = syntax.parse_song(song(1), "song.tsg")
+        self.assertEqual(metadata['@language'], "lang1")
+        self.assertEqual(metadata['@titles'], ["Title 1", "Other title 1"])
+        self.assertEqual(metadata['by'], "Author 1")
+        self.assertEqual(metadata['album'], "Album 1")
+
+    def test_threads(self):
+        """Songs can be parsed concurrently."""
+        numbers = list(range(200))
+        # Switch threads often, so that parsing of songs is interleaved
+        self.addCleanup(sys.setswitchinterval, sys.getswitchinterval())
+        sys.setswitchinterval(1e-6)
+        with logging_reduced():
+            expected = [syntax.parse_song(song(number), "song.tsg") for number in numbers]
+            with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+                self.assertEqual(
+                    list(executor.map(
+                        lambda number: syntax.parse_song(song(number), "song.tsg"),
+                        numbers,
+                        )),
+                    expected,
+                    )
@@ -2,10 +2,14 @@
 
 # pylint: disable=too-few-public-methods
 
+import contextlib
+import io
 import os
 import shutil
 import unittest
 
+import yaml
+
 from patacrep.files import chdir
 from patacrep.tools.__main__ import main as tools_main
 from patacrep.tools.cache.__main__ import main as cache_main
@@ -73,3 +77,84 @@ class TestCache(unittest.TestCase):
                 # Clean cache
                 with logging_reduced('patatools.cache'):
                     self._system(main, args)
+
+    def test_warm(self):
+        """Test of the "patatools cache warm" subcommand"""
+        for main, args in [
+                (tools_main, ["patatools", "cache", "warm", "test_cache.yaml"]),
+                (cache_main, ["patatools-cache", "warm", "--jobs", "2", "test_cache.yaml"]),
+            ]:
+            with self.subTest(main=main, args=args):
+                self._remove_cache()
+                with logging_reduced('patatools.cache'):
+                    self._system(main, args)
+                self.assertTrue(os.path.exists(os.path.join(CACHEDIR, "songs", "foo.csg")))
+                self.assertTrue(os.path.exists(os.path.join(CACHEDIR, "songs", "foo.csg.body")))
+
+    def _stats(self):
+        """Run "patatools cache stats", and return the statistics of the datadir."""
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            self._system(cache_main, ["patatools-cache", "stats", "test_cache.yaml"])
+        return yaml.safe_load(output.getvalue())[os.path.dirname(CACHEDIR)]
+
+    def test_stats_prune(self):
+        """Test of the "patatools cache stats" and "patatools cache prune" subcommands"""
+        self.assertEqual(self._stats()['entries'], 0)
+        self.assertEqual(self._stats()['hit_ratio'], 0)
+
+        with logging_reduced('patatools.cache'):
+            self._system(cache_main, ["patatools-cache", "warm", "test_cache.yaml"])
+
+        # Add an entry for a song that does not exist
+        shutil.copy(
+            os.path.join(CACHEDIR, "songs", "foo.csg"),
+            os.path.join(CACHEDIR, "songs", "deleted.csg"),
+            )
+        # Compiled templates are not song entries
+        os.makedirs(os.path.join(CACHEDIR, "templates"), exist_ok=True)
+        open(os.path.join(CACHEDIR, "templates", "fingerprint"), "w").close()
+
+        # Song metadata and song content are cached in two entries
+        stats = self._stats()
+        self.assertEqual(stats['entries'], 3)
+        self.assertEqual(stats['valid'], 2)
+        self.assertEqual(stats['stale'], 1)
+        self.assertEqual(stats['hit_ratio'], 1)
+
+        with logging_reduced('patatools.cache'):
+            self._system(cache_main, ["patatools-cache", "prune", "test_cache.yaml"])
+
+        self.assertTrue(os.path.exists(os.path.join(CACHEDIR, "songs", "foo.csg")))
+        self.assertFalse(os.path.exists(os.path.join(CACHEDIR, "songs", "deleted.csg")))
+        self.assertTrue(os.path.exists(os.path.join(CACHEDIR, "templates", "fingerprint")))
+        self.assertEqual(self._stats()['entries'], 2)
+
+        with logging_reduced('patatools.cache'):
+            self._system(
+                cache_main,
+                ["patatools-cache", "prune", "--max-entries", "1", "test_cache.yaml"],
+                )
+        self.assertEqual(self._stats()['entries'], 1)
+
+    def test_benchmark(self):
+        """Test of the "patatools cache benchmark" subcommand"""
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output), logging_reduced('patatools.cache'):
+            self._system(
+                cache_main,
+                ["patatools-cache", "benchmark", "--repeat", "1", "test_cache.yaml"],
+                )
+        report = yaml.safe_load(output.getvalue())
+        self.assertEqual(report['songs'], 1)
+        self.assertEqual(
+            sorted(report['formats']),
+            [
+                "flat/lzma", "flat/none", "flat/zlib",
+                "pickle/lzma", "pickle/none", "pickle/zlib",
+            ],
+            )
+        for measures in report['formats'].values():
+            self.assertEqual(sorted(measures), ['dump', 'load', 'size'])
+        # The songbook is benchmarked without reading or writing its cache
+        self.assertFalse(os.path.exists(os.path.join(CACHEDIR, "songs", "foo.csg")))
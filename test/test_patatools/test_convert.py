@@ -5,13 +5,16 @@
 import contextlib
 import glob
 import os
+import tempfile
 import unittest
+from unittest import mock
 
 from pkg_resources import resource_filename
 
 from patacrep import files
 from patacrep.tools.__main__ import main as tools_main
 from patacrep.encoding import open_read
+from patacrep.tools.convert import worker
 from patacrep.tools.convert.__main__ import main as convert_main
 
 from .. import dynamic # pylint: disable=unused-import
@@ -75,6 +78,67 @@ class TestConvert(unittest.TestCase, metaclass=dynamic.DynamicTest):
                             1,
                             )
 
+    def test_batch(self):
+        """Test of the batch options of the "patatools convert" subcommand"""
+        songs = ["greensleeves", os.path.join("batch", "scarborough")]
+        with tempfile.TemporaryDirectory() as outputdir:
+            with self.chdir("test_convert_success"):
+                expected = {}
+                for song in songs:
+                    with open_read("{}.csg.tsg.control".format(song)) as controlfile:
+                        expected[song] = controlfile.read().strip().replace(
+                            "@TEST_FOLDER@",
+                            files.path2posix(resource_filename(__name__, "")),
+                            )
+                with logging_reduced():
+                    for options in [
+                            ["--jobs", "2"],
+                            ["--skip-existing"],
+                            ["--jobs", "2", "--overwrite"],
+                        ]:
+                        with self.subTest(options=options):
+                            self.assertEqual(
+                                self._system(
+                                    convert_main,
+                                    ["patatools-convert", "csg", "tsg", "--output-dir", outputdir]
+                                    + options
+                                    + [os.curdir],
+                                    ),
+                                0,
+                                )
+                            for song in songs:
+                                destname = os.path.join(outputdir, "{}.tsg".format(song))
+                                with open_read(destname) as destfile:
+                                    self.assertMultiLineEqual(
+                                        destfile.read().replace('\r\n', '\n').strip(),
+                                        expected[song].strip(),
+                                        )
+            self.assertEqual(sorted(os.listdir(outputdir)), ["batch", "greensleeves.tsg"])
+            self.assertEqual(
+                os.listdir(os.path.join(outputdir, "batch")),
+                ["scarborough.tsg"],
+                )
+
+    def test_not_implemented(self):
+        """Test the error message of songs which cannot be converted"""
+        worker.init_worker("csg", "tsg")
+        for error, message in [
+                (NotImplementedError(), "Cannot convert to format 'tsg'."),
+                (
+                    NotImplementedError("Images are not supported."),
+                    "Cannot convert to format 'tsg'. Images are not supported.",
+                ),
+            ]:
+            with self.subTest(error=error):
+                with mock.patch.dict(
+                    worker._WORKER, # pylint: disable=protected-access
+                    {'renderer': mock.Mock(side_effect=error)},
+                    ):
+                    self.assertEqual(
+                        worker.convert_song(("song.csg", "song.tsg")),
+                        ("song.csg", message),
+                        )
+
     @staticmethod
     @contextlib.contextmanager
     def chdir(*pathlist):
@@ -0,0 +1,88 @@
+"""Tests of the patatools-templates command."""
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import jinja2
+from pkg_resources import resource_filename
+
+from patacrep import files
+from patacrep.build import config_model
+from patacrep.songs import chordpro
+from patacrep.templates import TexBookRenderer, compiled_loader
+from patacrep.tools.__main__ import main as tools_main
+
+from .. import logging_reduced
+
+class TestTemplates(unittest.TestCase):
+    """Test of the "patatools templates" subcommand"""
+
+    def setUp(self):
+        self.datadir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.datadir, "songs"))
+        shutil.copy(
+            resource_filename("test.test_song", "greensleeves.csg.source"),
+            os.path.join(self.datadir, "songs", "greensleeves.csg"),
+            )
+        self.songbook = os.path.join(self.datadir, "songbook.yaml")
+        with open(self.songbook, "w") as songbook:
+            songbook.write("book:\n    lang: en\n")
+        self.config = config_model('default')['en']
+        self.config['_datadir'] = [self.datadir]
+        self.renderer = files.load_renderer_plugins()['tsg']['csg']
+
+    def tearDown(self):
+        shutil.rmtree(self.datadir)
+
+    def _compile(self):
+        """Run `patatools templates compile`."""
+        with logging_reduced('patatools.templates'):
+            try:
+                tools_main(["patatools", "templates", "compile", self.songbook])
+            except SystemExit as systemexit:
+                self.assertEqual(systemexit.code, 0)
+
+    def _render(self):
+        """Render the test song."""
+        with logging_reduced():
+            song = self.renderer(
+                os.path.join("songs", "greensleeves.csg"),
+                self.config,
+                datadir=self.datadir,
+                )
+            with files.chdir(self.datadir):
+                return song.render()
+
+    def test_compile(self):
+        """Compiled templates are used instead of template files."""
+        self._compile()
+        for renderer in (TexBookRenderer, self.renderer):
+            self.assertIsNotNone(compiled_loader(
+                [self.datadir],
+                renderer.searchpath([self.datadir]),
+                ))
+        with mock.patch.object(
+                jinja2.FileSystemLoader, 'get_source', side_effect=AssertionError,
+            ):
+            compiled = self._render()
+
+        # Render again, from template files
+        shutil.rmtree(os.path.join(self.datadir, ".cache"))
+        chordpro._jinja_environment.cache_clear() # pylint: disable=protected-access
+        self.assertEqual(compiled, self._render())
+
+    def test_override(self):
+        """Compiled templates are not used once a template has been overridden."""
+        self._compile()
+        override = os.path.join(self.datadir, "templates", "songs", "chordpro", "latex")
+        os.makedirs(override)
+        with open(os.path.join(override, "content_word"), "w") as template:
+            template.write("WORD")
+        self.assertIsNone(compiled_loader(
+            [self.datadir],
+            self.renderer.searchpath([self.datadir]),
+            ))
+        self.assertIn("WORD", self._render())
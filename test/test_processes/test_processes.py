@@ -0,0 +1,118 @@
+"""Tests of the scheduler of external programs."""
+
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from patacrep import errors, processes
+
+def python(code):
+    """Return the arguments running python code `code`."""
+    return [sys.executable, "-c", code]
+
+class TestProcesses(unittest.TestCase):
+    """Test running external programs."""
+
+    def tearDown(self):
+        processes.set_max_jobs(None)
+
+    def test_output(self):
+        """Output is read line by line, and the return code is returned."""
+        stdout = []
+        stderr = []
+        returncode = processes.run(
+            python(
+                "import sys\n"
+                "print('one')\n"
+                "print('two', file=sys.stderr)\n"
+                "print('three\\r')\n"
+                "sys.exit(3)\n"
+                ),
+            stdout_callback=stdout.append,
+            stderr_callback=stderr.append,
+            )
+        self.assertEqual(returncode, 3)
+        self.assertEqual(stdout, ["one", "three"])
+        self.assertEqual(stderr, ["two"])
+
+    def test_stdin(self):
+        """Standard input is empty, unless the program is interactive."""
+        stdout = []
+        processes.run(
+            python("import sys; print(repr(sys.stdin.read()))"),
+            stdout_callback=stdout.append,
+            )
+        self.assertEqual(stdout, ["''"])
+
+    def test_timeout(self):
+        """Programs are killed if they do not complete in time."""
+        start = time.perf_counter()
+        with self.assertRaises(errors.StepTimeoutError):
+            processes.run(python("import time; time.sleep(30)"), timeout=0.5)
+        self.assertLess(time.perf_counter() - start, 10)
+
+    def test_read_error(self):
+        """Programs are killed if their output cannot be read."""
+        created = []
+        create_subprocess_exec = asyncio.create_subprocess_exec
+
+        async def create(*args, **kwargs):
+            process = await create_subprocess_exec(*args, **kwargs)
+            created.append(process)
+            return process
+
+        start = time.perf_counter()
+        with mock.patch.object(processes.asyncio, "create_subprocess_exec", create):
+            with self.assertRaises(ValueError):
+                processes.run(python(
+                    "import time\n"
+                    "print('x' * {}, flush=True)\n"
+                    "time.sleep(30)\n".format(2 * processes.LINE_LIMIT)
+                    ))
+        self.assertLess(time.perf_counter() - start, 10)
+        self.assertEqual(len(created), 1)
+        self.assertIsNotNone(created[0].returncode)
+
+    def test_max_jobs(self):
+        """At most MAX_JOBS programs are run in parallel."""
+        processes.set_max_jobs(2)
+        with tempfile.TemporaryDirectory() as tempdir:
+            # Each program creates a file while it runs, and records the
+            # number of such files.
+            code = (
+                "import os, sys, time\n"
+                "path = os.path.join(sys.argv[1], sys.argv[2])\n"
+                "open(path, 'w').close()\n"
+                "print(len(os.listdir(sys.argv[1])))\n"
+                "time.sleep(0.3)\n"
+                "os.remove(path)\n"
+                )
+            counts = []
+            threads = [
+                threading.Thread(target=processes.run, args=(
+                    python(code) + [tempdir, str(number)],
+                    ), kwargs={'stdout_callback': lambda line: counts.append(int(line))})
+                for number in range(5)
+                ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(len(counts), 5)
+        self.assertLessEqual(max(counts), 2)
+
+    def test_check_executable(self):
+        """Executables are checked once."""
+        processes.check_executable.cache_clear()
+        self.addCleanup(processes.check_executable.cache_clear)
+        with mock.patch.object(processes.subprocess, "run") as run:
+            processes.check_executable("lualatex")
+            processes.check_executable("lualatex")
+        self.assertEqual(run.call_count, 1)
+        with self.assertRaises(errors.ExecutableNotFound):
+            processes.check_executable(os.path.join(os.curdir, "does-not-exist"))
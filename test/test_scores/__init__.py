@@ -0,0 +1 @@
+"""Tests of the compilation of lilypond scores."""
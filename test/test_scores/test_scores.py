@@ -0,0 +1,193 @@
+"""Tests of the compilation of lilypond scores."""
+
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from patacrep import files, scores
+from patacrep.build import SongbookBuilder
+from patacrep.songbook import open_songbook
+
+from .. import logging_reduced
+
+class FakeLilypond:
+    """Replacement of `processes.run`, pretending to be lilypond."""
+
+    def __init__(self):
+        self.compiled = []
+        self._lock = threading.Lock()
+
+    def __call__(self, args, **kwargs):
+        output = [arg for arg in args if arg.startswith("--output=")][0][len("--output="):]
+        source = args[-1]
+        with self._lock:
+            self.compiled.append(os.path.basename(source))
+        if "broken" in source:
+            return 1
+        with open(source) as sourcefile, open(output + ".pdf", "w") as pdffile:
+            pdffile.write("PDF {} {}".format(args[2], sourcefile.read()))
+        return 0
+
+class TestScores(unittest.TestCase):
+    """Test the `scores` build step."""
+
+    def setUp(self):
+        self._tempdir = tempfile.TemporaryDirectory()
+        self.tempdir = self._tempdir.name
+        self.datadir = os.path.join(self.tempdir, "datadir")
+        os.makedirs(os.path.join(self.datadir, "scores"))
+        for name in ["one", "two", "broken"]:
+            self.write_score(name, name)
+        self.basename = os.path.join(self.tempdir, "book")
+        self.lilypond = FakeLilypond()
+        patchers = [
+            mock.patch.object(scores.processes, "run", self.lilypond),
+            mock.patch.object(scores.subprocess, "check_output", return_value="LilyPond 2.18\n"),
+            ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self._tempdir.cleanup()
+
+    def write_score(self, name, content):
+        """Write score `name` in the datadir."""
+        with open(os.path.join(self.datadir, "scores", name + ".ly"), "w") as scorefile:
+            scorefile.write(content)
+
+    def record(self, *requests):
+        """Write the `.lys` file, as LaTeX does."""
+        with open(self.basename + ".lys", "w") as lysfile:
+            for score, width in requests:
+                lysfile.write("{} {}\n".format(width, score))
+
+    def read_map(self):
+        """Return the content of the `.scores` file, as a dictionary."""
+        mapping = {}
+        with open(self.basename + ".scores") as mapfile:
+            for line in mapfile:
+                score, width, target = line.strip()[len(r"\patacrepcachedscore{"):-1].split("}{")
+                mapping[score, width] = target
+        return mapping
+
+    def test_requests(self):
+        """Scores recorded several times are compiled once."""
+        self.record(
+            ("scores/one.ly", "100.0pt"),
+            ("scores/one.ly", "100.0pt"),
+            ("scores/one", "200.0pt"),
+            )
+        self.assertEqual(
+            scores.read_requests(self.basename + ".lys"),
+            [("scores/one.ly", "100.0pt"), ("scores/one", "200.0pt")],
+            )
+        self.assertEqual(scores.read_requests(self.basename + ".missing"), [])
+
+    def test_build(self):
+        """Scores are compiled into the cache, once."""
+        self.record(
+            ("scores/one.ly", "100.0pt"),
+            ("scores/one", "200.0pt"),
+            ("scores/two.ly", "100.0pt"),
+            ("scores/missing.ly", "100.0pt"),
+            ("scores/broken.ly", "100.0pt"),
+            )
+        with logging_reduced():
+            failures = scores.build_scores(self.basename, [self.datadir], jobs=2)
+        self.assertEqual(failures, ["scores/missing.ly", "scores/broken.ly"])
+        self.assertCountEqual(self.lilypond.compiled, ["one.ly", "one.ly", "two.ly", "broken.ly"])
+
+        mapping = self.read_map()
+        self.assertCountEqual(
+            mapping.keys(),
+            [("scores/one.ly", "100.0pt"), ("scores/one", "200.0pt"), ("scores/two.ly", "100.0pt")],
+            )
+        for (score, width), target in mapping.items():
+            self.assertTrue(target.startswith(os.path.join(self.datadir, ".cache", "scores")))
+            with open(target) as pdffile:
+                self.assertEqual(
+                    pdffile.read(),
+                    "PDF {} {}".format(
+                        scores.PAPER_SIZE.format(width[:-2]),
+                        os.path.basename(score).split(".")[0],
+                        ),
+                    )
+
+        # Second build: nothing is compiled
+        self.lilypond.compiled = []
+        with logging_reduced():
+            scores.build_scores(self.basename, [self.datadir])
+        self.assertEqual(self.lilypond.compiled, ["broken.ly"])
+        self.assertEqual(self.read_map(), mapping)
+
+        # Changed score, or lilypond version: score is compiled again
+        self.lilypond.compiled = []
+        self.write_score("two", "changed")
+        with logging_reduced():
+            scores.build_scores(self.basename, [self.datadir])
+        self.assertCountEqual(self.lilypond.compiled, ["two.ly", "broken.ly"])
+        self.lilypond.compiled = []
+        scores.subprocess.check_output.return_value = "LilyPond 2.20\n"
+        with logging_reduced():
+            scores.build_scores(self.basename, [self.datadir])
+        self.assertCountEqual(self.lilypond.compiled, ["one.ly", "one.ly", "two.ly", "broken.ly"])
+
+    def test_readonly(self):
+        """Scores are compiled by LaTeX if the cache cannot be written."""
+        self.record(("scores/one.ly", "100.0pt"), ("scores/two", "200.0pt"))
+        with logging_reduced():
+            with mock.patch.object(scores.os, "makedirs", side_effect=PermissionError):
+                failures = scores.build_scores(self.basename, [self.datadir])
+        self.assertEqual(failures, ["scores/one.ly", "scores/two"])
+        self.assertEqual(self.lilypond.compiled, [])
+        self.assertEqual(self.read_map(), {})
+
+        with logging_reduced():
+            with mock.patch.object(scores.os, "replace", side_effect=PermissionError):
+                failures = scores.build_scores(self.basename, [self.datadir])
+        self.assertEqual(failures, ["scores/one.ly", "scores/two"])
+        self.assertEqual(self.read_map(), {})
+
+    def test_rerun(self):
+        """Scores requested by the first LaTeX compilation are compiled before the next ones."""
+        with open(self.basename + ".yaml", "w") as songbookfile:
+            songbookfile.write("book:\n  datadir: datadir\n  lang: en\nchords:\n  lilypond: yes\n")
+        songbook = open_songbook(self.basename + ".yaml")
+        songbook['_cache'] = True
+        builder = SongbookBuilder(songbook)
+        compiled = []
+
+        def build_pdf():
+            """Fake LaTeX compilation: record scores, and ask to be run again (twice)."""
+            compiled.append(list(self.lilypond.compiled))
+            self.record(("scores/one.ly", "100.0pt"))
+            builder._rerun = len(compiled) < 3 # pylint: disable=protected-access
+
+        with logging_reduced(), files.chdir(self.tempdir):
+            with mock.patch.object(builder, "build_pdf", build_pdf):
+                builder.build_steps(['scores', 'pdf', 'rerun'])
+        self.assertEqual(compiled, [[], ["one.ly"], ["one.ly"]])
+        self.assertEqual(list(self.read_map()), [("scores/one.ly", "100.0pt")])
+
+    def test_step(self):
+        """Step `scores` does nothing if the songbook does not display scores."""
+        self.record(("scores/one.ly", "100.0pt"))
+        for lilypond in ["no", "yes"]:
+            with open(self.basename + ".yaml", "w") as songbookfile:
+                songbookfile.write(
+                    "book:\n  datadir: datadir\n  lang: en\nchords:\n  lilypond: {}\n".format(
+                        lilypond
+                        )
+                    )
+            songbook = open_songbook(self.basename + ".yaml")
+            songbook['_cache'] = True
+            with logging_reduced(), files.chdir(self.tempdir):
+                SongbookBuilder(songbook).build_steps(['scores'])
+            if lilypond == "no":
+                self.assertEqual(self.lilypond.compiled, [])
+                self.assertFalse(os.path.exists(self.basename + ".scores"))
+        self.assertEqual(self.lilypond.compiled, ["one.ly"])
+        self.assertEqual(list(self.read_map()), [("scores/one.ly", "100.0pt")])
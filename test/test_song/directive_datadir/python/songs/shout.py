@@ -0,0 +1,12 @@
+"""Fake ChordPro directive plugin, for test purposes."""
+
+from patacrep.songs.chordpro import ast
+
+def parse_shout(parser, argument, *, lineno):
+    """Parse `{shout: text}` as an uppercase comment."""
+    if not argument:
+        parser.error(line=lineno, message="Nothing to shout.")
+        return ast.Error(lineno=lineno)
+    return ast.Directive("comment", argument.upper(), lineno=lineno)
+
+CHORDPRO_DIRECTIVES = {'shout': parse_shout}
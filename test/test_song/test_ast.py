@@ -0,0 +1,73 @@
+"""Tests of the ChordPro AST nodes."""
+
+import glob
+import pickle
+import unittest
+from pkg_resources import resource_filename
+
+from patacrep.content import ContentError
+from patacrep.encoding import open_read
+from patacrep.songs.chordpro import ast, syntax
+
+from .. import logging_reduced
+from .test_engines import dump
+
+#: Nodes which do not have an instance dictionary.
+SLOTTED = (ast.Word, ast.Space, ast.ChordList, ast.Chord, ast.Line, ast.Verse)
+
+def _songs():
+    """Iterate over the `(filename, song)` tuples of the test songs."""
+    for filename in sorted(glob.glob(resource_filename(__name__, "*.csg.source"))):
+        with open_read(filename) as songfile:
+            content = songfile.read()
+        try:
+            with logging_reduced():
+                yield filename, syntax.parse_song(content, filename)
+        except ContentError:
+            continue
+
+def _nodes(node):
+    """Iterate over the AST nodes of `node` (included)."""
+    if isinstance(node, ast.AST):
+        yield node
+        for cls in type(node).__mro__:
+            for name in getattr(cls, '__slots__', ()):
+                yield from _nodes(getattr(node, name, None))
+        for value in getattr(node, '__dict__', {}).values():
+            yield from _nodes(value)
+    elif isinstance(node, (list, tuple)):
+        for item in node:
+            yield from _nodes(item)
+
+class TestAST(unittest.TestCase):
+    """Test of the ChordPro AST nodes."""
+
+    maxDiff = None
+
+    def test_pickle(self):
+        """Pickled songs are loaded identically."""
+        for filename, song in _songs():
+            for protocol in range(2, pickle.HIGHEST_PROTOCOL + 1):
+                with self.subTest(song=filename, protocol=protocol):
+                    loaded = pickle.loads(pickle.dumps(song, protocol=protocol))
+                    self.assertEqual(dump(loaded), dump(song))
+
+    def test_slots(self):
+        """Frequent nodes have no instance dictionary."""
+        classes = set()
+        for filename, song in _songs():
+            for node in _nodes(pickle.loads(pickle.dumps(song, protocol=-1))):
+                if isinstance(node, SLOTTED):
+                    classes.add(type(node))
+                    self.assertFalse(hasattr(node, '__dict__'), (filename, node))
+        self.assertTrue(set(SLOTTED) <= classes)
+
+    def test_intern(self):
+        """Words and chords are shared."""
+        line = ast.Line(
+            ast.Word("".join(["wo", "rd"])),
+            ast.ChordList(ast.Chord("".join(["A", "m"]))),
+            )
+        loaded = pickle.loads(pickle.dumps(line, protocol=-1))
+        self.assertIs(loaded.line[0].value, "word")
+        self.assertIs(loaded.line[1].chords[0].chord, "Am")
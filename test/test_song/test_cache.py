@@ -0,0 +1,340 @@
+"""Tests for the song cache."""
+
+import copy
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from pkg_resources import resource_filename
+
+from patacrep import authors, files
+from patacrep.songs import cache
+from patacrep.songs.chordpro import ast
+from patacrep.build import config_model
+from patacrep.songbook import prepare_songbook
+from patacrep.songbook.__main__ import _apply_options, argument_parser
+
+from .. import logging_reduced
+from .test_engines import dump
+
+class TestCache(unittest.TestCase):
+    """Test of the song cache."""
+
+    def setUp(self):
+        self.datadir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.datadir, "songs"))
+        for name in ["invalid_directive.csg", "greensleeves.csg"]:
+            shutil.copy(
+                resource_filename(__name__, name + ".source"),
+                os.path.join(self.datadir, "songs", name),
+                )
+        self.config = config_model('default')['en']
+        self.config['_datadir'] = [self.datadir]
+        self.config['_cache'] = True
+        self.renderer = files.load_renderer_plugins()['tsg']['csg']
+
+    def tearDown(self):
+        shutil.rmtree(self.datadir)
+
+    def _song(self, name="invalid_directive.csg"):
+        """Return the test song."""
+        with logging_reduced():
+            return self.renderer(
+                os.path.join("songs", name),
+                self.config,
+                datadir=self.datadir,
+                )
+
+    def test_errors(self):
+        """Test that songs with errors are cached, with their errors."""
+        parsed = self._song()
+        self.assertTrue(parsed.errors)
+        self.assertTrue(os.path.exists(parsed.cached_name))
+
+        with mock.patch.object(self.renderer, '_parse', side_effect=AssertionError):
+            cached = self._song()
+        self.assertEqual(
+            [vars(error) for error in cached.errors],
+            [vars(error) for error in parsed.errors],
+            )
+        self.assertEqual(
+            [error.__class__ for error in cached.errors],
+            [error.__class__ for error in parsed.errors],
+            )
+        for error in cached.errors:
+            self.assertIs(error.song, cached)
+
+    def test_render(self):
+        """Test that a song retrieved from the cache is rendered as the original one."""
+        parsed = self._song()
+        with mock.patch.object(self.renderer, '_parse', side_effect=AssertionError):
+            cached = self._song()
+        with files.chdir(self.datadir):
+            self.assertEqual(cached.render(), parsed.render())
+
+    def test_header(self):
+        """Test that song content is parsed (and cached) only when needed."""
+        with mock.patch.object(self.renderer, '_parse', side_effect=AssertionError):
+            parsed = self._song("greensleeves.csg")
+        self.assertEqual(parsed.titles[0], "Greensleeves")
+        self.assertEqual(parsed.authors, [("Traditionnel", "")])
+        self.assertFalse(os.path.exists(parsed.body_cached_name))
+
+        with files.chdir(self.datadir):
+            rendered = parsed.render()
+        self.assertTrue(os.path.exists(parsed.body_cached_name))
+
+        with mock.patch.object(self.renderer, '_parse', side_effect=AssertionError):
+            cached = self._song("greensleeves.csg")
+            with files.chdir(self.datadir):
+                self.assertEqual(cached.render(), rendered)
+        self.assertEqual(cached.titles, parsed.titles)
+
+    def test_release(self):
+        """Test that released song content is retrieved again from the cache."""
+        song = self._song("greensleeves.csg")
+        with files.chdir(self.datadir):
+            rendered = song.render()
+        errors = song.errors
+        song.release()
+        with mock.patch.object(self.renderer, '_parse', side_effect=AssertionError):
+            with files.chdir(self.datadir):
+                self.assertEqual(song.render(), rendered)
+        self.assertIs(song.errors, errors)
+
+    def test_config(self):
+        """Test that songbooks with different configurations share the cache."""
+        books = {
+            "default": (
+                copy.deepcopy(self.config),
+                ["Greensleeves", "autre sous-titre", "sous titre"],
+                "Traditionnel",
+                ),
+            "custom": (
+                copy.deepcopy(self.config),
+                ["Greensleeves", "Un autre sous-titre", "Un sous titre"],
+                None,
+                ),
+            }
+        books["custom"][0]['titles']['prefix'] = ["The"]
+        books["custom"][0]['authors']['ignore'] = ["Traditionnel"]
+        for config, _, _ in books.values():
+            config['_compiled_authwords'] = authors.compile_authwords(config['authors'])
+
+        self.config = books["default"][0]
+        self._song("greensleeves.csg")
+        for _ in range(2):
+            for name, (config, titles, author) in books.items():
+                with self.subTest(book=name):
+                    self.config = config
+                    with mock.patch.object(
+                            self.renderer, '_parse_header', side_effect=AssertionError,
+                        ):
+                        song = self._song("greensleeves.csg")
+                    self.assertEqual(song.unprefixed_titles, titles)
+                    self.assertEqual(
+                        [name for name, _ in song.authors],
+                        [author] if author else [],
+                        )
+
+        # Derived metadata of both configurations is cached
+        for config, _, _ in books.values():
+            self.config = config
+            with mock.patch.object(
+                    self.renderer, '_derive_metadata', side_effect=AssertionError,
+                ):
+                self._song("greensleeves.csg")
+
+    def test_central(self):
+        """Test that identical songs of different datadirs share the central cache."""
+        cachedir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cachedir)
+        self.config['_cache_dir'] = cachedir
+        original = self.datadir
+        with files.chdir(original):
+            rendered = self._song().render()
+
+        self.datadir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, original)
+        shutil.copytree(os.path.join(original, "songs"), os.path.join(self.datadir, "songs"))
+        with mock.patch.object(self.renderer, '_parse', side_effect=AssertionError):
+            song = self._song()
+            with files.chdir(self.datadir):
+                self.assertEqual(song.render(), rendered)
+        self.assertTrue(song.cached_name.startswith(cachedir))
+        for datadir in [original, self.datadir]:
+            self.assertFalse(os.path.exists(os.path.join(datadir, ".cache")))
+
+        # Changed song is parsed again
+        with open(os.path.join(self.datadir, "songs", "invalid_directive.csg"), "a") as songfile:
+            songfile.write("{c: New line}\n")
+        with mock.patch.object(self.renderer, '_parse', side_effect=AssertionError):
+            with self.assertRaises(AssertionError):
+                self._song()
+
+    def test_relative_central(self):
+        """Test that a relative central cache directory is relative to the working directory."""
+        workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, workdir)
+        cachedir = os.path.join(workdir, "central")
+        with files.chdir(workdir):
+            songbook = {'datadir': []}
+            _apply_options(songbook, argument_parser(["--cache-dir", "central", "book.yaml"]))
+            with mock.patch.dict(os.environ, {cache.CACHE_DIR_ENV: "central"}):
+                prepared = prepare_songbook({}, workdir, "book", workdir)
+        self.assertEqual(songbook['_cache_dir'], cachedir)
+        self.assertEqual(prepared['_cache_dir'], cachedir)
+
+        self.config['_cache_dir'] = songbook['_cache_dir']
+        with files.chdir(self.datadir):
+            song = self._song()
+            song.render()
+        self.assertTrue(song.cached_name.startswith(cachedir))
+        self.assertTrue(os.path.exists(song.cached_name))
+        self.assertFalse(os.path.exists(os.path.join(self.datadir, "central")))
+
+    def test_corrupted(self):
+        """Test that corrupted cache files are discarded."""
+        parsed = self._song("greensleeves.csg")
+        with open(parsed.cached_name, "rb") as cachefile:
+            content = cachefile.read()
+        for corrupted in [content[:len(content) // 2], content[:-1] + b"\0", b"", b"x" * 100]:
+            with self.subTest(corrupted=corrupted):
+                with open(parsed.cached_name, "wb") as cachefile:
+                    cachefile.write(corrupted)
+                with self.assertRaises(cache.CorruptedCacheError):
+                    cache.load(parsed.cached_name)
+                song = self._song("greensleeves.csg")
+                self.assertEqual(song.titles, parsed.titles)
+                # The cache file has been written again
+                self.assertEqual(cache.load(song.cached_name)['titles'], parsed.titles)
+                with mock.patch.object(self.renderer, '_parse_header', side_effect=AssertionError):
+                    self._song("greensleeves.csg")
+        self.assertEqual(
+            [name for name in os.listdir(os.path.dirname(parsed.cached_name)) if name.startswith(".")],
+            [],
+            )
+
+    def test_formats(self):
+        """Test that songs are retrieved identically, whatever the cache format."""
+        for serializer in cache.SERIALIZERS:
+            for compression in cache.COMPRESSIONS:
+                with self.subTest(serializer=serializer, compression=compression):
+                    shutil.rmtree(cache.cache_dir(self.datadir), ignore_errors=True)
+                    self.config['_cache_format'] = serializer
+                    self.config['_cache_compression'] = compression
+                    for name in ["invalid_directive.csg", "greensleeves.csg"]:
+                        parsed = self._song(name)
+                        with files.chdir(self.datadir):
+                            rendered = parsed.render()
+                        # Cache files are read whatever the current format
+                        del self.config['_cache_format'], self.config['_cache_compression']
+                        with mock.patch.object(self.renderer, '_parse', side_effect=AssertionError):
+                            cached = self._song(name)
+                            with files.chdir(self.datadir):
+                                self.assertEqual(cached.render(), rendered)
+                        self.assertEqual(
+                            dump(cached.cached['song']),
+                            dump(parsed.cached['song']),
+                            )
+                        self.config['_cache_format'] = serializer
+                        self.config['_cache_compression'] = compression
+
+    def test_flat_serializer(self):
+        """Test that the flat serializer uses the registered flatteners."""
+        song = self._song("greensleeves.csg")
+        with files.chdir(self.datadir):
+            song.render()
+        parsed = song.cached['song']
+        with mock.patch.dict(
+                cache.FLATTENERS,
+                {ast.Song: mock.Mock(side_effect=ast.flatten_song)},
+            ):
+            content = cache.FlatSerializer.dumps(parsed)
+            self.assertEqual(cache.FLATTENERS[ast.Song].call_count, 1)
+        self.assertEqual(dump(cache.FlatSerializer.loads(content)), dump(parsed))
+
+    def test_flat_version(self):
+        """Test that songs flattened by another version of patacrep are discarded."""
+        self.config['_cache_format'] = "flat"
+        song = self._song("greensleeves.csg")
+        with files.chdir(self.datadir):
+            song.render()
+        with mock.patch.object(ast, 'FLAT_VERSION', ast.FLAT_VERSION + 1):
+            with self.assertRaises(cache.CorruptedCacheError):
+                cache.load(song.body_cached_name)
+
+    def test_evict(self):
+        """Test that outdated, and least recently used, entries are evicted."""
+        cachedir = cache.cache_dir(self.datadir)
+        song = self._song("greensleeves.csg")
+        other = self._song("invalid_directive.csg")
+        outdated = os.path.join(cachedir, "songs", "outdated.csg")
+        cache.dump({}, outdated, version=self.renderer.CACHE_VERSION - 1)
+        os.utime(song.cached_name, (0, 0))
+        os.utime(other.cached_name, (1, 1))
+        os.utime(other.body_cached_name, (1, 1))
+        os.utime(outdated, (2, 2))
+
+        # Using a cached song makes it the most recently used one
+        with mock.patch.object(self.renderer, '_parse_header', side_effect=AssertionError):
+            self._song("greensleeves.csg")
+        self.assertGreater(os.path.getmtime(song.cached_name), 1)
+
+        self.assertEqual(
+            cache.evict(cachedir, self.renderer.CACHE_VERSION, max_entries=1),
+            [
+                os.path.join("songs", "outdated.csg"),
+                os.path.join("songs", "invalid_directive.csg"),
+                os.path.join("songs", "invalid_directive.csg.body"),
+            ],
+            )
+        self.assertTrue(os.path.exists(song.cached_name))
+        self.assertEqual(
+            cache.evict(cachedir, self.renderer.CACHE_VERSION, max_size=0),
+            [os.path.join("songs", "greensleeves.csg")],
+            )
+        self.assertFalse(os.path.exists(os.path.join(cachedir, "songs")))
+        self.assertEqual(cache.evict(cachedir, self.renderer.CACHE_VERSION, max_size=0), [])
+
+    def test_permissions(self):
+        """Test that cache files get the default permissions of new files."""
+        umask = os.umask(0o022)
+        self.addCleanup(os.umask, umask)
+        with mock.patch.object(cache, "FILE_MODE", 0o644):
+            song = self._song("greensleeves.csg")
+            with files.chdir(self.datadir):
+                song.render()
+            cache.dump({}, os.path.join(cache.cache_dir(self.datadir), "other"))
+        for name in [song.cached_name, song.body_cached_name, "other"]:
+            with self.subTest(name=name):
+                path = os.path.join(cache.cache_dir(self.datadir), name)
+                self.assertEqual(os.stat(path).st_mode & 0o777, 0o644)
+
+        self.assertEqual(cache.FILE_MODE, 0o666 & ~umask)
+
+    @unittest.skipIf(cache.fcntl is None, "Advisory locks are not supported.")
+    def test_lock(self):
+        """Test that shared locks exclude exclusive locks."""
+        cachedir = cache.cache_dir(self.datadir)
+        with cache.lock(cachedir, shared=True):
+            with open(os.path.join(cachedir, cache.LOCK_FILENAME)) as lockfile:
+                cache.fcntl.flock(lockfile, cache.fcntl.LOCK_SH | cache.fcntl.LOCK_NB)
+                cache.fcntl.flock(lockfile, cache.fcntl.LOCK_UN)
+                with self.assertRaises(BlockingIOError):
+                    cache.fcntl.flock(lockfile, cache.fcntl.LOCK_EX | cache.fcntl.LOCK_NB)
+        with open(os.path.join(cachedir, cache.LOCK_FILENAME)) as lockfile:
+            cache.fcntl.flock(lockfile, cache.fcntl.LOCK_EX | cache.fcntl.LOCK_NB)
+
+
+    @unittest.skipIf(cache.fcntl is None, "Advisory locks are not supported.")
+    def test_lock_readonly(self):
+        """Test that a lock file which cannot be written can be locked."""
+        cachedir = cache.cache_dir(self.datadir)
+        with cache.lock(cachedir):
+            pass
+        os.chmod(os.path.join(cachedir, cache.LOCK_FILENAME), 0o444)
+        with cache.lock(cachedir):
+            pass
@@ -0,0 +1,39 @@
+"""Tests for the parsers of ChordPro directive arguments."""
+
+import unittest
+
+from pkg_resources import resource_filename
+
+from patacrep import files
+from patacrep.songs.chordpro import syntax
+
+from .. import logging_reduced
+
+class TestDirectivePlugins(unittest.TestCase):
+    """Test of the directive plugins of datadirs."""
+
+    def setUp(self):
+        self.directives = files.load_directive_plugins([
+            resource_filename(__name__, "directive_datadir"),
+            ])
+
+    def test_load(self):
+        """Test that plugins are loaded, along with the default parsers."""
+        for keyword in syntax.CHORDPRO_DIRECTIVES:
+            self.assertIs(self.directives[keyword], syntax.CHORDPRO_DIRECTIVES[keyword])
+        self.assertIn('shout', self.directives)
+
+    def test_parse(self):
+        """Test that directives are parsed by plugins."""
+        for engine in syntax.ENGINES:
+            with self.subTest(engine=engine), logging_reduced():
+                song = syntax.parse_song(
+                    "{shout: hello}\n{shout}\n",
+                    "shout.csg",
+                    engine=engine,
+                    directives=self.directives,
+                    )
+                directive = song.content[0].lines[0].line[0]
+                self.assertEqual(directive.keyword, "comment")
+                self.assertEqual(directive.argument, "HELLO")
+                self.assertEqual(len(song.error_builders), 1)
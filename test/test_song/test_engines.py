@@ -0,0 +1,156 @@
+"""Differential tests of the ChordPro parsing engines."""
+
+import glob
+import random
+import unittest
+from unittest import mock
+from pkg_resources import resource_filename
+
+from patacrep.content import ContentError
+from patacrep.encoding import open_read
+from patacrep.songs.chordpro import ast, syntax
+
+from .. import logging_reduced
+
+#: Pieces of lines of synthetic songs, with or without errors.
+FRAGMENTS = [
+    "word", "wörd", "a#b", "#comment", " ", "\t", "  ", "[A]", "[Am7 G]", "[]", "[ ]", "[C",
+    "{se}", "{ee}", "{start_echo}", "{end_echo}", "\\{", "\\}", "\\#", "\\\\", "\\x", "}", "]", "\r",
+    "{c: comment}", "{comment:spaced  }", "{ c : x\\}y}", "{title: Title}", "{t:Other}",
+    "{artist: A and B}", "{tag: t}", "{key: foo: bar}", "{unknown: x}", "{lang: fr}",
+    "{partition: p.ly}", "{newline}", "{image: img.png}", "{image: \"im g.png\" width=2cm}",
+    "{image: i.png scale=2 width=1cm}", "{image: i.png foo=1}", "{image:}",
+    "{define: E base-fret 7 frets 0 1 3 3 x x fingers - 1 2 3 - -}",
+    "{define: A frets x 0 2 2 2 0}", "{define: bad}", "{define:}", "{define}", "{image}",
+    "{title}", "{title }",
+    "{ti-tle: x}", "{c: multi\nline}", "{soc}", "{eoc}", "{sob}", "{eob}", "{sot}", "{eot}",
+    "{start_of_chorus}", "{end_of_bridge}",
+    ]
+
+#: Whole lines of synthetic songs, with or without errors.
+LINES = [
+    "", " ", "# a comment", "  # indented comment", "{soc}", "{eoc}", "{sob}", "{eob}",
+    " {soc} ", "{eoc}  ", "{sot}", "{eot}", "  {eot}  ", "{start_of_tab}", "{end_of_tab}",
+    "e|---0---|", "  B|--1--|  ", "x {eot}", "{sot} x",
+    ]
+
+#: Groups of lines of synthetic songs, without errors.
+VALID = [
+    ["[A]Some [B]words {se}echo [C]{ee}"], ["plain line  "], [""], ["  "], ["# comment"],
+    ["{c: x}"], ["{c: x} "], ["  {title: T}"], ["{define: A frets x 0 2 2 2 0}"],
+    ["{image: a.png width=2cm}"],
+    ["before chorus", "{soc}", "  [A]in chorus ", "{partition: x.ly}", "{title: in}", "{eoc}"],
+    ["{sob} ", "bridge {se}{se}nested{ee}{ee}", "{eob}"], ["{soc}", "{eoc}"],
+    ["{sot}", "e|--0--|", "   ", "  B|-1-|  ", "{eot} # done"], ["{sot}  ", "  {eot}"],
+    ["word\\{escaped\\} \\# [G] []"], ["{key: foo: bar}"], ["{unknown: x}"],
+    ["{tag: a}", "{tag: b}"],
+    ]
+
+def synthetic_song(seed, valid):
+    """Return a random song.
+
+    If `valid` is true, the song contains no errors.
+    """
+    rng = random.Random(seed)
+    lines = []
+    for _ in range(rng.randint(0, 40)):
+        if valid:
+            lines.extend(rng.choice(VALID))
+        elif rng.random() < 0.3:
+            lines.append(rng.choice(LINES))
+        else:
+            lines.append("".join(
+                rng.choice(FRAGMENTS) + rng.choice(["", " ", ""])
+                for _ in range(rng.randint(1, 6))
+                ))
+    if valid:
+        end = rng.choice(["\n", "\r\n"])
+        return end.join(lines) + end
+    return rng.choice(["\n", "\r\n"]).join(lines) + rng.choice(["\n", "\r\n", ""])
+
+def dump(node):
+    """Return a comparable representation of an AST (and its error builders)."""
+    if isinstance(node, ast.AST):
+        attributes = {}
+        for cls in type(node).__mro__:
+            for name in getattr(cls, '__slots__', ()):
+                if hasattr(node, name):
+                    attributes[name] = getattr(node, name)
+        attributes.update(getattr(node, '__dict__', {}))
+        if 'error_builders' in attributes:
+            attributes['error_builders'] = [
+                (builder.func, builder.keywords)
+                for builder in attributes['error_builders']
+                ]
+        return (
+            type(node).__name__,
+            {key: dump(value) for key, value in attributes.items()},
+            )
+    if isinstance(node, (list, tuple)):
+        return [type(node).__name__] + [dump(item) for item in node]
+    if isinstance(node, dict):
+        return {key: dump(value) for key, value in node.items()}
+    return node
+
+def parse(content, engine):
+    """Parse content with engine, and return its dump (or the error)."""
+    try:
+        return dump(syntax.parse_song(content, "synthetic.csg", engine=engine))
+    except Exception as error: # pylint: disable=broad-except
+        return repr(error)
+
+class TestEngines(unittest.TestCase):
+    """Check that the 'fast' engine produces the same songs as the 'ply' one."""
+
+    maxDiff = None
+
+    def assertSameSong(self, content): # pylint: disable=invalid-name
+        """Assert that both engines produce the same song from `content`."""
+        with logging_reduced():
+            self.assertEqual(parse(content, "ply"), parse(content, "fast"))
+
+    def test_files(self):
+        """Test songs of the test suite."""
+        for filename in sorted(glob.glob(resource_filename(__name__, "*.csg*"))):
+            with open_read(filename) as songfile:
+                content = songfile.read()
+            for text in (content, content.strip() + "\n"):
+                with self.subTest(filename=filename):
+                    self.assertSameSong(text)
+
+    def test_synthetic(self):
+        """Test random songs, with and without errors."""
+        for seed in range(300):
+            for valid in (True, False):
+                content = synthetic_song(seed, valid)
+                with self.subTest(seed=seed, valid=valid, content=content):
+                    self.assertSameSong(content)
+
+    def test_header(self):
+        """Metadata parsed without song content is the metadata of the song."""
+        contents = [synthetic_song(seed, valid) for seed in range(300) for valid in (True, False)]
+        for filename in sorted(glob.glob(resource_filename(__name__, "*.csg*"))):
+            with open_read(filename) as songfile:
+                contents.append(songfile.read().strip() + "\n")
+        for content in contents:
+            with self.subTest(content=content), logging_reduced():
+                header = syntax.parse_header(content, "synthetic.csg")
+                if header is None:
+                    continue
+                self.assertEqual(header.content, [])
+                try:
+                    song = syntax.parse_song(content, "synthetic.csg")
+                except ContentError:
+                    continue
+                self.assertEqual(
+                    dump([header.titles, header.authors, header.meta]),
+                    dump([song.titles, song.authors, song.meta]),
+                    )
+
+    def test_fast_path(self):
+        """Songs without errors are not parsed by the 'ply' engine."""
+        with mock.patch.object(syntax.ChordproParser, 'parse', side_effect=AssertionError):
+            for seed in range(50):
+                content = synthetic_song(seed, valid=True)
+                with self.subTest(seed=seed, content=content):
+                    syntax.parse_song(content, "synthetic.csg", engine="fast")
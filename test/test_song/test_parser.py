@@ -2,19 +2,25 @@
 
 # pylint: disable=too-few-public-methods
 
+import concurrent.futures
 import contextlib
 import glob
 import os
+import sys
 import unittest
 from pkg_resources import resource_filename
 
 from patacrep import files
 from patacrep.encoding import open_read
 from patacrep.build import config_model
+from patacrep.content import ContentError
 from patacrep.songs import errors
+from patacrep.songs.chordpro import syntax
+from patacrep.songs.chordpro.lexer import ChordProLexer
 
 from .. import logging_reduced
 from .. import dynamic # pylint: disable=unused-import
+from .test_engines import dump
 
 OUTPUTS = {
     'csg': ['csg', 'tsg', 'html'],
@@ -156,3 +162,50 @@ class FileTest(unittest.TestCase, metaclass=dynamic.DynamicTest):
                 base = '.'.join(base + [in_format])
                 with open(crlfname, 'w') as crlffile:
                     crlffile.write(crlf_msg.format(base))
+
+class LexerTest(unittest.TestCase):
+    """Test of the chordpro lexer."""
+
+    @staticmethod
+    def _tokens(filename):
+        """Return the list of tokens of the song `filename`."""
+        lexer = ChordProLexer(filename=filename).lexer
+        with open_read(filename) as songfile:
+            lexer.input(songfile.read())
+        return [(token.type, token.value, token.lineno) for token in iter(lexer.token, None)]
+
+    def test_threads(self):
+        """Songs can be lexed concurrently."""
+        filenames = sorted(glob.glob(resource_filename(__name__, "*.csg.source")))
+        with logging_reduced():
+            expected = [self._tokens(filename) for filename in filenames]
+            with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+                self.assertEqual(list(executor.map(self._tokens, filenames)), expected)
+
+class ParserTest(unittest.TestCase):
+    """Test of the chordpro parser."""
+
+    @staticmethod
+    def _dump(filename, engine):
+        """Return the dump of the song `filename`, parsed by `engine`."""
+        with open_read(filename) as songfile:
+            content = songfile.read()
+        try:
+            return dump(syntax.parse_song(content, filename, engine=engine))
+        except ContentError as error:
+            return str(error)
+
+    def test_threads(self):
+        """Songs can be parsed concurrently."""
+        filenames = sorted(glob.glob(resource_filename(__name__, "*.csg.source"))) * 4
+        # Switch threads often, so that parsing of songs is interleaved
+        self.addCleanup(sys.setswitchinterval, sys.getswitchinterval())
+        sys.setswitchinterval(1e-6)
+        for engine in syntax.ENGINES:
+            with self.subTest(engine=engine), logging_reduced():
+                expected = [self._dump(filename, engine) for filename in filenames]
+                with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+                    self.assertEqual(
+                        list(executor.map(self._dump, filenames, [engine] * len(filenames))),
+                        expected,
+                        )
@@ -0,0 +1,110 @@
+"""Tests of the per-process song registry."""
+
+import copy
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from pkg_resources import resource_filename
+
+from patacrep import files
+from patacrep.songs import registry
+from patacrep.build import config_model
+
+from .. import logging_reduced
+
+class TestRegistry(unittest.TestCase):
+    """Test of the per-process song registry."""
+
+    def setUp(self):
+        self.datadir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.datadir, "songs"))
+        for name in ["invalid_chord.csg", "greensleeves.csg"]:
+            shutil.copy(
+                resource_filename(__name__, name + ".source"),
+                os.path.join(self.datadir, "songs", name),
+                )
+        self.config = config_model('default')['en']
+        self.config['_datadir'] = [self.datadir]
+        self.config['_cache'] = True
+        self.renderer = files.load_renderer_plugins()['tsg']['csg']
+        registry.clear()
+
+    def tearDown(self):
+        registry.clear()
+        shutil.rmtree(self.datadir)
+
+    def _song(self, name="greensleeves.csg", config=None):
+        """Return a song, from the registry."""
+        with logging_reduced():
+            return registry.get_song(
+                self.renderer,
+                os.path.join("songs", name),
+                config or self.config,
+                datadir=self.datadir,
+                )
+
+    def test_shared(self):
+        """Test that songs are read once."""
+        song = self._song()
+        other_config = copy.deepcopy(self.config)
+        with mock.patch.object(self.renderer, '__init__', side_effect=AssertionError):
+            other = self._song(config=other_config)
+        self.assertIsNot(other, song)
+        self.assertIs(other.config, other_config)
+        self.assertIs(other.data, song.data)
+        self.assertEqual(other.titles, song.titles)
+
+    def test_independent(self):
+        """Test that errors and contents of copies are independent."""
+        song = self._song("invalid_chord.csg")
+        other = self._song("invalid_chord.csg")
+        self.assertEqual(len(other.errors), len(song.errors))
+        song.errors.append(None)
+        self.assertEqual(len(other.errors), len(song.errors) - 1)
+
+        with files.chdir(self.datadir):
+            rendered = song.render()
+            song.release()
+            self.assertEqual(other.render(), rendered)
+            self.assertEqual(self._song("invalid_chord.csg").render(), rendered)
+
+    def test_changed(self):
+        """Test that songs are read again when their file changes, or with another configuration."""
+        song = self._song()
+
+        config = copy.deepcopy(self.config)
+        config['titles']['prefix'] = []
+        self.assertEqual(self._song(config=config).unprefixed_titles[1], "Un autre sous-titre")
+        self.assertEqual(self._song().unprefixed_titles[1], "autre sous-titre")
+
+        path = os.path.join(self.datadir, "songs", "greensleeves.csg")
+        with open(path, "a") as songfile:
+            songfile.write("{title: Other title}\n")
+        self.assertNotEqual(self._song().titles, song.titles)
+
+    def test_metadata_only(self):
+        """Test that registered songs do not keep their content, even without the cache."""
+        self.config['_cache'] = False
+        # Song content is parsed with its metadata
+        with mock.patch.object(self.renderer, '_parse_header', return_value=False):
+            song = self._song()
+        self.assertIsNotNone(song._cached) # pylint: disable=protected-access
+        with files.chdir(self.datadir):
+            rendered = song.render()
+            other = self._song()
+            self.assertEqual(other.render(), rendered)
+        for _, registered in registry._SONGS.values(): # pylint: disable=protected-access
+            self.assertIsNone(registered._cached) # pylint: disable=protected-access
+
+    def test_bounded(self):
+        """Test that least recently used songs are forgotten."""
+        with mock.patch.object(registry, 'MAX_SONGS', 1):
+            self._song()
+            self._song("invalid_chord.csg")
+            with mock.patch.object(self.renderer, '__init__', side_effect=AssertionError):
+                self._song("invalid_chord.csg")
+                with self.assertRaises(AssertionError):
+                    self._song()
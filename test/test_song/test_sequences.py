@@ -0,0 +1,60 @@
+"""Tests of the sequences (songs, verses, lines, tablatures) built by the ChordPro parser."""
+
+import unittest
+
+from patacrep.songs.chordpro import ast
+from patacrep.songs.chordpro.syntax import parse_song
+
+from .. import logging_reduced
+
+def _parse(content):
+    """Parse ChordPro song `content`."""
+    with logging_reduced():
+        return parse_song(content, "test.csg")
+
+def _words(line):
+    """Return the words of `line`."""
+    return [item.value for item in line.line if isinstance(item, ast.Word)]
+
+class TestSequences(unittest.TestCase):
+    """Test of the sequences built by the ChordPro parser."""
+
+    def test_line_before_block(self):
+        """A line directly followed by a chorus or bridge is merged into it."""
+        for start, end, block in [
+                ("soc", "eoc", ast.Chorus),
+                ("sob", "eob", ast.Bridge),
+            ]:
+            with self.subTest(block=block):
+                song = _parse("{{title: T}}\nA [C]b\n{{{}}}\nC [D]d\n{{{}}}\n".format(start, end))
+                self.assertEqual(len(song.content), 1)
+                self.assertIsInstance(song.content[0], block)
+                self.assertIsInstance(song.content[0].lines, list)
+                self.assertEqual(
+                    [_words(line) for line in song.content[0].lines],
+                    [["A", "b"], ["C", "d"]],
+                    )
+
+    def test_long_verse(self):
+        """Long verses keep the order of their lines (and words)."""
+        lines = ["line{} [C]word{}".format(number, number) for number in range(2000)]
+        song = _parse("{title: T}\n" + "\n".join(lines) + "\n")
+        self.assertEqual(len(song.content), 1)
+        verse = song.content[0]
+        self.assertIsInstance(verse.lines, list)
+        self.assertEqual(
+            [_words(line) for line in verse.lines],
+            [["line{}".format(number), "word{}".format(number)] for number in range(2000)],
+            )
+        for line in verse.lines:
+            self.assertIsInstance(line.line, list)
+
+    def test_long_tab(self):
+        """Long tablatures keep the order of their lines."""
+        lines = ["e|--{}--|".format(number) for number in range(2000)]
+        song = _parse("{title: T}\n{sot}\n" + "\n".join(lines) + "\n{eot}\n")
+        self.assertEqual(len(song.content), 1)
+        tab = song.content[0]
+        self.assertIsInstance(tab, ast.Tab)
+        self.assertIsInstance(tab.content, list)
+        self.assertEqual(tab.content, lines)
@@ -0,0 +1,65 @@
+"""Tests of the escaping of special characters."""
+
+import types
+import unittest
+
+from patacrep import templates
+from patacrep.songs.chordpro import ChordproSong, ast
+
+class TestEscape(unittest.TestCase):
+    """Test of the escaping of special characters."""
+
+    def test_escape_specials(self):
+        """Special characters are escaped."""
+        self.assertEqual(
+            templates.escape_specials("50% & {more}", "%&"),
+            r"50\% \& {more}",
+            )
+        self.assertEqual(
+            templates.escape_specials("50% & {more} #1_$^~\\"),
+            r"50\% \& \{more\} \#1\_\$\textasciicircum{}\textasciitilde{}\textbackslash{}",
+            )
+        self.assertEqual(templates.escape_specials(50), "50")
+        self.assertEqual(templates.escape_specials("a b&", translation_map={" ": "~"}), "a~b&")
+        self.assertEqual(
+            templates.escape_specials(
+                "http://a.b/c d%",
+                translation_map=templates.TRANSLATION_MAP_URL,
+                ),
+            r"http://a.b/c\%20d\%",
+            )
+
+    def test_chars(self):
+        """Characters to escape may be given in any (hashable or not) container."""
+        for chars in ["%&", ("%", "&"), ["%", "&"], {"%", "&"}]:
+            with self.subTest(chars=chars):
+                self.assertEqual(templates.escape_specials("% & {", chars), r"\% \& {")
+
+    def test_cache(self):
+        """Cached tables are not used for other translation maps."""
+        self.assertIs(
+            templates.translation_table(templates.TRANSLATION_MAP, "%&"),
+            templates.translation_table(templates.TRANSLATION_MAP, "%&"),
+            )
+        for number in range(100):
+            # Maps are created (and deleted) again and again, with the same characters
+            translation_map = {"%": str(number), "&": "and"}
+            with self.subTest(number=number):
+                self.assertEqual(
+                    templates.escape_specials("% &", "%&", translation_map=translation_map),
+                    "{} and".format(number),
+                    )
+        self.assertEqual(templates.escape_specials("% &", "%&"), r"\% \&")
+
+    def test_directive(self):
+        """The argument of plain directives is escaped."""
+        # pylint: disable=protected-access
+        song = types.SimpleNamespace(_translation_map=templates.TRANSLATION_MAP)
+        self.assertEqual(
+            ChordproSong._escape_specials(song, ast.Directive("album", "Tom & Jerry")),
+            r"Tom \& Jerry",
+            )
+        self.assertEqual(
+            ChordproSong._escape_specials(song, "Tom & Jerry", "{}"),
+            "Tom & Jerry",
+            )
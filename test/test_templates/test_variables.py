@@ -0,0 +1,78 @@
+"""Tests of the variables of songbook templates."""
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from patacrep import templates
+
+TEMPLATE = """\
+(* variables *)
+{name}:
+    schema:
+        type: //str
+    default:
+        en: "{value}"
+(* endvariables -*)
+"""
+
+class TestVariables(unittest.TestCase):
+    """Test of the variables of songbook templates."""
+
+    def setUp(self):
+        self.datadir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.datadir, "templates", "songbook"))
+        self._write(
+            self.datadir,
+            "book.tex",
+            "(* extends 'default.tex' *)\n(* include 'included.tex' *)\n",
+            )
+
+    def tearDown(self):
+        shutil.rmtree(self.datadir)
+
+    @staticmethod
+    def _write(datadir, name, content):
+        """Write template `name` of `datadir`."""
+        with open(os.path.join(datadir, "templates", "songbook", name), "w") as template:
+            template.write(content)
+
+    def _variables(self, datadirs=None):
+        """Return the variables of the test template."""
+        if datadirs is None:
+            datadirs = [self.datadir]
+        renderer = templates.TexBookRenderer("book.tex", datadirs, "en", cache=True)
+        return renderer.get_template_variables("book.tex")
+
+    def test_cache(self):
+        """Test that variables are cached, until a template changes."""
+        self._write(self.datadir, "included.tex", TEMPLATE.format(name="foo", value="1"))
+        variables = self._variables()
+        self.assertEqual(variables["included.tex"]["foo"]["default"], {"en": "1"})
+        self.assertIn("default.tex", variables)
+
+        with mock.patch.object(templates, "_iter_variables_blocks", side_effect=AssertionError):
+            self.assertEqual(self._variables(), variables)
+
+        # Template changed
+        self._write(self.datadir, "included.tex", TEMPLATE.format(name="foo", value="22"))
+        self.assertEqual(self._variables()["included.tex"]["foo"]["default"], {"en": "22"})
+
+    def test_override(self):
+        """Test that variables are parsed again when a template is overridden."""
+        other = tempfile.mkdtemp()
+        try:
+            os.makedirs(os.path.join(other, "templates", "songbook"))
+            self._write(other, "included.tex", TEMPLATE.format(name="foo", value="1"))
+            self.assertIn("foo", self._variables([self.datadir, other])["included.tex"])
+
+            # Template of the second datadir is overridden in the first one
+            self._write(self.datadir, "included.tex", TEMPLATE.format(name="bar", value="1"))
+            self.assertEqual(
+                list(self._variables([self.datadir, other])["included.tex"]),
+                ["bar"],
+                )
+        finally:
+            shutil.rmtree(other)
@@ -0,0 +1 @@
+"""Tests of the precompilation of the preamble of songbooks."""
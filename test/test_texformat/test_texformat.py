@@ -0,0 +1,216 @@
+"""Tests of the precompilation of the preamble of songbooks."""
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from patacrep import errors, files, texformat, texlog
+from patacrep.build import SongbookBuilder
+from patacrep.songbook import open_songbook
+from patacrep.songs import cache
+
+from .. import logging_reduced
+
+DATADIR = os.path.join(os.path.dirname(__file__), "..", "test_patatools", "test_cache_datadir")
+
+class TestTexFormat(unittest.TestCase):
+    """Test the precompilation of the preamble."""
+
+    def setUp(self):
+        self._tempdir = tempfile.TemporaryDirectory()
+        self.tempdir = self._tempdir.name
+        shutil.copytree(DATADIR, os.path.join(self.tempdir, "datadir"))
+        with open(os.path.join(self.tempdir, "book.yaml"), "w") as bookfile:
+            bookfile.write("book:\n  datadir: {}\n  lang: en\n".format(
+                os.path.join(self.tempdir, "datadir"),
+                ))
+        self.cachedir = os.path.join(
+            cache.cache_dir(os.path.join(self.tempdir, "datadir")),
+            texformat.CACHE_DIRNAME,
+            )
+        # A style file read while dumping the format
+        self.style = os.path.join(self.tempdir, "style.sty")
+        with open(self.style, "w") as stylefile:
+            stylefile.write("% Style\n")
+        # Return codes of LaTeX: dumping formats, compiling using them, and
+        # compiling without them
+        self.returncodes = {"dump": 0, "format": 0, "plain": 0}
+        # LaTeX compilations
+        self.compilations = []
+        # If true, compilations using the format fail because of an error in a song
+        self.song_error = False
+        # Output of compilations using the format
+        self.format_output = []
+
+        patchers = [
+            mock.patch("patacrep.processes.run", side_effect=self._latex),
+            mock.patch("patacrep.build.processes.check_executable"),
+            mock.patch.object(texformat, "tex_version", return_value="LaTeX 1.0"),
+            ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self._tempdir.cleanup()
+
+    def _latex(self, args, *, stdout_callback=None, **kwargs):
+        """Fake LaTeX compilation."""
+        # pylint: disable=unused-argument
+        if "-ini" in args:
+            self.compilations.append("dump")
+            outputdir = args[3][len("-output-directory="):]
+            with open(args[-1]) as source:
+                self.assertTrue(source.read().endswith(texformat.MARKER + "\n\\dump\n"))
+            with open(os.path.join(outputdir, "format.fls"), "w") as flsfile:
+                flsfile.write("PWD {}\n".format(self.tempdir))
+                flsfile.write("INPUT style.sty\n")
+                flsfile.write("INPUT {}\n".format(args[-1]))
+            if not self.returncodes["dump"]:
+                with open(os.path.join(outputdir, "format.fmt"), "w") as fmtfile:
+                    fmtfile.write("format")
+            return self.returncodes["dump"]
+        if args[1].startswith("-fmt="):
+            self.compilations.append("format")
+            self.assertTrue(os.path.isfile(args[1][len("-fmt="):]))
+            self.assertEqual(args[2], "-jobname=book")
+            with open(args[-1]) as body:
+                self.assertIn("\\begin{document}", body.read())
+            for line in self.format_output:
+                stdout_callback(line)
+            if self.song_error:
+                stdout_callback("(./{}".format(args[-1]))
+                stdout_callback("! Undefined control sequence.")
+                stdout_callback("l.{} \\foo".format(texlog.read_songs(args[-1])[0][0]))
+                return 1
+            return self.returncodes["format"]
+        self.compilations.append("plain")
+        return self.returncodes["plain"]
+
+    def _build(self, steps=("tex", "pdf", "pdf"), error=None):
+        """Build the book, precompiling its preamble, and return its builder.
+
+        If `error` is set, check that the build fails with this error.
+        """
+        with files.chdir(self.tempdir):
+            songbook = open_songbook("book.yaml")
+            songbook['_cache'] = False
+            builder = SongbookBuilder(songbook)
+            builder.precompile = True
+            with logging_reduced('patacrep.build'), logging_reduced('patacrep.texformat'):
+                if error is None:
+                    builder.build_steps(steps)
+                else:
+                    with self.assertRaises(error):
+                        builder.build_steps(steps)
+        return builder
+
+    def _formats(self):
+        """Return the files of the cache of formats."""
+        return sorted(name for name in os.listdir(self.cachedir) if not name.startswith("."))
+
+    def test_split(self):
+        """The .tex file is split at the marker."""
+        self._build(["tex"])
+        preamble, body = texformat.split(os.path.join(self.tempdir, "book.tex"))
+        self.assertTrue(preamble.endswith("\n" + texformat.MARKER + "\n"))
+        self.assertIn("\\documentclass", preamble)
+        self.assertIn("\\usepackage[", preamble)
+        self.assertNotIn("\\begin{document}", preamble)
+        self.assertIn("\\begin{document}", body)
+
+        texname = os.path.join(self.tempdir, "custom.tex")
+        with open(texname, "w") as texfile:
+            texfile.write("\\documentclass{article}\n\\begin{document}\n\\end{document}\n")
+        self.assertIsNone(texformat.split(texname))
+
+    def test_format(self):
+        """The format is dumped once, and dumped again if its dependencies change."""
+        self._build()
+        self.assertEqual(self.compilations, ["dump", "format", "format"])
+        name = self._formats()[0][:-len(".fmt")]
+        self.assertEqual(self._formats(), [name + ".fmt", name + ".json"])
+        self.assertTrue(texformat.is_valid(os.path.join(self.cachedir, name)))
+
+        # Format is shared by builds
+        self.compilations = []
+        self._build()
+        self.assertEqual(self.compilations, ["format", "format"])
+
+        # A file read while dumping the format changed
+        with open(self.style, "a") as stylefile:
+            stylefile.write("% Changed\n")
+        self.assertFalse(texformat.is_valid(os.path.join(self.cachedir, name)))
+        self.compilations = []
+        self._build()
+        self.assertEqual(self.compilations, ["dump", "format", "format"])
+        self.assertTrue(texformat.is_valid(os.path.join(self.cachedir, name)))
+
+    def test_dump_fallback(self):
+        """Books are compiled without format if it cannot be dumped."""
+        self.returncodes["dump"] = 1
+        self._build()
+        self.assertEqual(self.compilations, ["dump", "plain", "plain"])
+        name = self._formats()[0][:-len(".failed")]
+        self.assertEqual(self._formats(), [name + ".failed"])
+
+        # Dumping is not tried again
+        self.compilations = []
+        self._build()
+        self.assertEqual(self.compilations, ["plain", "plain"])
+
+        # ... until a file read while dumping the format changes
+        with open(self.style, "a") as stylefile:
+            stylefile.write("% Fixed\n")
+        self.returncodes["dump"] = 0
+        self.compilations = []
+        self._build()
+        self.assertEqual(self.compilations, ["dump", "format", "format"])
+        self.assertEqual(self._formats(), [name + ".fmt", name + ".json"])
+
+    def test_readonly(self):
+        """Books are compiled without format if the cache cannot be written."""
+        # Cache directory cannot be created
+        os.makedirs(os.path.dirname(self.cachedir))
+        open(self.cachedir, "w").close()
+        self._build()
+        self.assertEqual(self.compilations, ["plain", "plain"])
+        os.remove(self.cachedir)
+
+        # Format cannot be discarded
+        self._build()
+        self.returncodes["format"] = 1
+        self.compilations = []
+        with mock.patch.object(texformat.os, "remove", side_effect=PermissionError):
+            self._build()
+        self.assertEqual(self.compilations, ["format", "plain", "plain"])
+
+    def test_format_fallback(self):
+        """Books are compiled without format if it cannot be used."""
+        self.returncodes["format"] = 1
+        self._build()
+        self.assertEqual(self.compilations, ["dump", "format", "plain", "plain"])
+        name = self._formats()[0][:-len(".failed")]
+        self.assertEqual(self._formats(), [name + ".failed"])
+
+    def test_error(self):
+        """The format is kept if the document itself contains errors."""
+        self.returncodes["format"] = 1
+        self.returncodes["plain"] = 1
+        self.format_output = ["---! ./book.fmt was written by pdftex"]
+        builder = self._build(error=errors.LatexCompilationError)
+        self.assertEqual(self.compilations, ["dump", "format", "plain"])
+        self.assertEqual(len(self._formats()), 2)
+        # Events of the compilation using the format are kept
+        self.assertEqual([event['type'] for event in builder.events], ["format"])
+
+    def test_song_error(self):
+        """Books are not compiled again without format if a song contains errors."""
+        self.song_error = True
+        builder = self._build(error=errors.LatexCompilationError)
+        self.assertEqual(self.compilations, ["dump", "format"])
+        self.assertEqual(len(self._formats()), 2)
+        self.assertEqual([event['type'] for event in builder.events], ["error"])
+        self.assertIsNotNone(builder.events[0]['song'])
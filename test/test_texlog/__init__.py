@@ -0,0 +1 @@
+"""Tests of the parsing of LaTeX output."""
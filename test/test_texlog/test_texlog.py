@@ -0,0 +1,240 @@
+"""Tests of the parsing of LaTeX output."""
+
+import json
+import os
+import shutil
+import tempfile
+import textwrap
+import unittest
+from unittest import mock
+
+from patacrep import files, texlog
+from patacrep.build import SongbookBuilder
+from patacrep.songbook import open_songbook
+from patacrep.songbook.__main__ import main as songbook_main
+
+from .. import logging_reduced
+
+DATADIR = os.path.join(os.path.dirname(__file__), "..", "test_patatools", "test_cache_datadir")
+
+TEX = textwrap.dedent("""\
+    \\documentclass{article}
+    \\begin{document}
+    \\begin{songs}{}
+    SEPARATOR
+    %% songs/foo.csg
+
+    \\beginsong{Foo}
+    A line too long
+    \\endsong
+    SEPARATOR
+    %% songs/bar.csg
+
+    \\beginsong{Bar}
+    \\endsong
+    \\end{songs}
+    \\input{foo_title.sbx}
+    \\end{document}
+    """).replace("SEPARATOR", "%" * 80)
+
+OUTPUT = textwrap.dedent("""\
+    This is LuaTeX, Version 1.10.0 (TeX Live 2019)
+    (./book.tex
+    LaTeX2e <2018-12-01>
+    (/usr/share/texlive/texmf-dist/tex/latex/base/article.cls
+    Document Class: article 2018/09/03 v1.4i Standard LaTeX document class
+    (/usr/share/texlive/texmf-dist/tex/latex/base/size10.clo))
+    No file book.aux.
+    Overfull \\hbox (12.0pt too wide) in paragraph at lines 8--8
+    []\\TU/lmr/m/n/10 A line too long
+    Underfull \\vbox (badness 10000) has occurred while \\output is active []
+    (/datadir/songs/baz.tsg
+    LaTeX Warning: Reference `baz' on page 1 undefined on input line 3.
+    )
+    Package rerunfilecheck Warning: File `book.out' has changed.
+    (rerunfilecheck)                Rerun to get outlines right
+    (rerunfilecheck)                or use package `bookmark'.
+    ! Undefined control sequence.
+    l.13 \\beginsong{Bar}\\foo
+    ! LaTeX Error: File `foo_title.sbx' not found.
+
+    Type X to quit or <RETURN> to proceed,
+    or enter new file name. (Default extension: sbx)
+
+    Enter file name:
+    ! Emergency stop.
+    <read *>
+
+    l.16 \\input{foo_title.sbx}
+    !  ==> Fatal error occurred, no output PDF file produced!
+    Transcript written on book.log.
+    """)
+
+class TestLogParser(unittest.TestCase):
+    """Test of the parsing of LaTeX output."""
+
+    def setUp(self):
+        self._tempdir = tempfile.TemporaryDirectory()
+        self.texname = os.path.join(self._tempdir.name, "book.tex")
+        with open(self.texname, "w") as texfile:
+            texfile.write(TEX)
+
+    def tearDown(self):
+        self._tempdir.cleanup()
+
+    def test_read_songs(self):
+        """Songs written in the .tex file are located."""
+        self.assertEqual(
+            texlog.read_songs(self.texname),
+            [(5, 9, "songs/foo.csg"), (11, 14, "songs/bar.csg")],
+            )
+        self.assertEqual(texlog.read_songs(self.texname + ".missing"), [])
+
+    def test_events(self):
+        """LaTeX output is parsed into events."""
+        parser = texlog.LogParser(self.texname, texlog.read_songs(self.texname))
+        for line in OUTPUT.split("\n"):
+            parser.feed(line)
+        parser.close()
+        self.assertTrue(parser.rerun)
+        self.assertEqual(
+            [
+                (event['type'], event['file'], event['line'], event['song'])
+                for event in parser.events
+            ],
+            [
+                ("missing_file", "./book.tex", None, None),
+                ("overfull", "./book.tex", 8, "songs/foo.csg"),
+                ("underfull", "./book.tex", None, None),
+                ("warning", "/datadir/songs/baz.tsg", 3, "/datadir/songs/baz.tsg"),
+                ("rerun", "./book.tex", None, None),
+                ("error", "./book.tex", 13, "songs/bar.csg"),
+                ("missing_file", "./book.tex", None, None),
+                ("error", "./book.tex", None, None),
+                ("error", "./book.tex", 16, None),
+            ],
+            )
+        events = parser.events
+        self.assertEqual(events[0]['missing'], "book.aux")
+        self.assertEqual(events[1]['box'], "hbox")
+        self.assertEqual(events[1]['amount'], "12.0pt too wide")
+        self.assertEqual(events[3]['package'], None)
+        self.assertEqual(
+            events[4]['message'],
+            "File `book.out' has changed. Rerun to get outlines right or use package `bookmark'.",
+            )
+        self.assertEqual(events[4]['package'], "rerunfilecheck")
+        self.assertEqual(events[5]['message'], "Undefined control sequence.")
+        self.assertEqual(events[6]['missing'], "foo_title.sbx")
+        self.assertEqual(events[7]['message'], "LaTeX Error: File `foo_title.sbx' not found.")
+        self.assertEqual(events[8]['message'], "Emergency stop.")
+        json.dumps(events)
+
+    def _parse(self, output):
+        """Return the parser of `output` (a list of lines)."""
+        parser = texlog.LogParser(self.texname, texlog.read_songs(self.texname))
+        for line in output:
+            parser.feed(line)
+        parser.close()
+        return parser
+
+    def test_format_failed(self):
+        """Errors which may be due to the format are recognised."""
+        self.assertFalse(self._parse(OUTPUT.split("\n")).format_failed)
+        self.assertTrue(self._parse([
+            "(./book.tex",
+            "! Undefined control sequence.",
+            "l.2 \\begin{document}",
+            ]).format_failed)
+        self.assertTrue(self._parse([]).format_failed)
+
+        parser = self._parse([
+            "---! ./book.fmt was written by pdftex",
+            "(Fatal format file error; I'm stymied)",
+            "I can't find the format file `book.fmt'!",
+            ])
+        self.assertEqual([event['type'] for event in parser.events], ["format"] * 3)
+        self.assertTrue(parser.format_failed)
+
+class TestRerun(unittest.TestCase):
+    """Test that LaTeX is run as many times as needed."""
+
+    def setUp(self):
+        self._tempdir = tempfile.TemporaryDirectory()
+        self.tempdir = self._tempdir.name
+        shutil.copytree(DATADIR, os.path.join(self.tempdir, "datadir"))
+        with open(os.path.join(self.tempdir, "book.yaml"), "w") as bookfile:
+            bookfile.write("book:\n  datadir: {}\n  lang: en\n".format(
+                os.path.join(self.tempdir, "datadir"),
+                ))
+        # Output of each LaTeX compilation
+        self.outputs = []
+        patcher = mock.patch("patacrep.build.processes.run", side_effect=self._latex)
+        self.run = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch("patacrep.build.processes.check_executable")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self._tempdir.cleanup()
+
+    def _latex(self, args, *, stdout_callback, **kwargs):
+        """Fake LaTeX compilation: print the next output, and write the index."""
+        # pylint: disable=unused-argument
+        for line in self.outputs.pop(0):
+            stdout_callback(line)
+        with open("book_title.sxd", "w", encoding="utf8") as index:
+            index.write("TITLE INDEX DATA FILE\nFoo\n1\nsong1-1.1\n")
+        return 0
+
+    def _build(self, steps):
+        """Build the book."""
+        with files.chdir(self.tempdir):
+            songbook = open_songbook("book.yaml")
+            songbook['_cache'] = False
+            builder = SongbookBuilder(songbook)
+            with logging_reduced('patacrep.build'):
+                builder.build_steps(steps)
+        return builder
+
+    def test_rerun(self):
+        """LaTeX is run again if indexes changed, or if it asks for it."""
+        rerun = ["LaTeX Warning: Label(s) may have changed. Rerun to get cross-references right."]
+        for outputs, passes in [
+                ([[], [], []], 2),
+                ([[], rerun, []], 3),
+                ([[], rerun, rerun, rerun], 4),
+            ]:
+            with self.subTest(outputs=outputs):
+                self.outputs = list(outputs)
+                builder = self._build(["tex", "pdf", "sbx", "rerun", "clean"])
+                self.assertEqual(self.run.call_count, passes)
+                self.assertEqual(
+                    [(event['type'], event['pass']) for event in builder.events],
+                    [("rerun", number) for number in range(2, passes + 1) if outputs[number - 1]],
+                    )
+                self.run.reset_mock()
+
+        # Index did not change since the previous compilation
+        self.outputs = [[], []]
+        self._build(["pdf", "sbx"])
+        self._build(["pdf", "sbx", "rerun"])
+        self.assertEqual(self.run.call_count, 2)
+
+    def test_events(self):
+        """Events are written as JSON lines."""
+        self.outputs = [["! Undefined control sequence.", "l.12 \\foo"]]
+        with files.chdir(self.tempdir):
+            with logging_reduced():
+                with self.assertRaises(SystemExit):
+                    songbook_main([
+                        "songbook", "--steps", "tex,pdf", "--events", "events.json", "book.yaml",
+                        ])
+            with open("events.json") as eventsfile:
+                events = [json.loads(line) for line in eventsfile]
+        self.assertEqual(len(events), 1)
+        self.assertEqual(events[0]['type'], "error")
+        self.assertEqual(events[0]['book'], "book")
+        self.assertEqual(events[0]['pass'], 1)
+        self.assertEqual(events[0]['line'], 12)